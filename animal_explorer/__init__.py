@@ -0,0 +1,20 @@
+"""
+Helpers for the Animal Explorer for Kids app that don't depend on Streamlit.
+
+For scripts and workers, identify() and ask() (and connect() for more
+control) work like the app with no Streamlit needed; see api.py, and cli.py
+for the command line (python -m animal_explorer).
+"""
+# Loaded on first use, so importing one helper (as app.py does) doesn't
+# pull in the HTTP clients
+_API = ("AnimalAPI", "IdentifyError", "ask", "connect", "identify", "load_image")
+
+__all__ = list(_API)
+
+
+def __getattr__(name):
+    if name in _API:
+        from . import api
+
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
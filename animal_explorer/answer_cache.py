@@ -0,0 +1,512 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from .vocabulary import normalize_name, singular
+
+# Words that don't change what a question is about (and their "singular"
+# forms, since questions are normalized before these are dropped)
+_STOP_WORDS = """
+a an the is are was were be do does did can could would should will shall may might
+i me my you your we our it its they them their he she his her this that these those
+of in on at to for from with about by as and or so if than then there here
+please hey hi um uh ok okay tell know really very much many some any
+""".split()
+STOP_WORDS = frozenset(_STOP_WORDS + [singular(word) for word in _STOP_WORDS])
+# Words that turn a question around ("t" is what's left of "don't")
+NEGATIONS = frozenset(["not", "no", "never", "t", "cannot", "nor", "without"])
+
+# ----------------------------------
+# Normalizing Questions
+# ----------------------------------
+def normalize_question(question):
+    """
+    Lowercase, drop punctuation and plurals: "What do PANDAS eat?!" -> "what do panda eat"
+    """
+    return " ".join(singular(word) for word in normalize_name(question).split())
+
+
+def question_vector(normalized):
+    """
+    A tiny local embedding: content words plus the letter trigrams inside
+    them, hashed into a sparse unit vector.
+
+    "What do pandas eat?" and "what does a panda eat" land on the same
+    vector and "Can penguins fly?" stays far from "Can penguins swim?". A
+    misspelt word only keeps its trigrams, so closest_question() reads it
+    as the word it's a typo of first.
+    """
+    features = {}
+    for word in normalized.split():
+        if word in STOP_WORDS:
+            continue
+        features[word] = features.get(word, 0.0) + 1.0
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            trigram = padded[i:i + 3]
+            features[trigram] = features.get(trigram, 0.0) + 0.25
+
+    vector = {}
+    for feature, weight in features.items():
+        index = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=4).digest(), "big") % 4096
+        vector[index] = vector.get(index, 0.0) + weight
+
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {index: weight / norm for index, weight in vector.items()} if norm else {}
+
+
+def content_words(normalized):
+    """
+    The words of a normalized question that aren't stop words, each once, in order
+    """
+    return tuple(dict.fromkeys(word for word in normalized.split() if word not in STOP_WORDS))
+
+
+def question_guard(normalized, vocabulary=None):
+    """
+    What's checked with same_meaning() before two questions' vectors are
+    compared: the animals named (found with the vocabulary trie, if given),
+    whether the question is negated, and its content words in order.
+    """
+    animals = frozenset(name for name, _ in vocabulary.find(normalized)) if vocabulary is not None else frozenset()
+    words = content_words(normalized)
+    return animals, any(word in NEGATIONS for word in normalized.split()), words
+
+
+def same_meaning(guard, other):
+    """
+    False when two questions' guards show they ask different things, even
+    if their vectors are alike.
+
+    The vectors ignore word order and only weigh words, so this turns down
+    "What eats sharks?" for "What do sharks eat?" (the words they share
+    come in another order), "How big is a whale shark?" for "How big is a
+    whale?" (another animal) and "Why can't penguins fly?" for "Why can
+    penguins fly?". A question naming no animal the vocabulary knows (e.g.
+    a misspelt one) is left to the vectors.
+    """
+    animals, negated, words = guard
+    other_animals, other_negated, other_words = other
+    if negated != other_negated:
+        return False
+    if animals and other_animals and animals != other_animals:
+        return False
+    shared = set(words) & set(other_words)
+    return [word for word in words if word in shared] == [word for word in other_words if word in shared]
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(index, 0.0) for index, weight in a.items())
+
+
+def one_typo(word, other):
+    """
+    True if word is other (both 5+ letters) with one letter wrong, missing,
+    added or swapped with the next: "pandsa" -> "panda"
+    """
+    if word == other or min(len(word), len(other)) < 5 or abs(len(word) - len(other)) > 1:
+        return False
+    if len(word) == len(other):
+        different = [i for i in range(len(word)) if word[i] != other[i]]
+        if len(different) == 1:
+            return True
+        if len(different) != 2 or different[1] != different[0] + 1:
+            return False
+        first, second = different
+        return (word[first], word[second]) == (other[second], other[first])
+    shorter, longer = sorted((word, other), key=len)
+    i = 0
+    while i < len(shorter) and shorter[i] == longer[i]:
+        i += 1
+    return shorter[i:] == longer[i + 1:]
+
+
+def closest_question(normalized, candidates, features, similarity, vocabulary=None):
+    """
+    The candidate question that normalized is asking again, or None.
+
+    That's the one whose question_vector() is most alike, at least
+    `similarity`, among those same_meaning() doesn't turn down.
+    features(question) gives a candidate's (question_guard(), vector).
+    Misspelt words are read as the candidate's word they're a typo of, so
+    "What do pandsa eat?" finds "What do pandas eat?"; the animals named
+    are still the ones actually spelt out.
+    """
+    guard, vector = question_guard(normalized, vocabulary), question_vector(normalized)
+    if not vector:
+        return None
+    candidates = [(question, features(question)) for question in candidates]
+    known = set().union(*(other_guard[2] for _, (other_guard, _) in candidates))
+    # Each unknown word -> the known words it could be a typo of
+    typos = {}
+    for word in guard[2]:
+        if word not in known:
+            meant = [other for other in known if one_typo(word, other)]
+            if meant:
+                typos[word] = meant
+
+    words = normalized.split()
+    best, best_score = None, similarity
+    for question, (other_guard, other) in candidates:
+        asked_guard, asked = guard, vector
+        if typos:
+            respelled = [
+                next((meant for meant in typos.get(word, ()) if meant in other_guard[2]), word) for word in words
+            ]
+            if respelled != words:
+                text = " ".join(respelled)
+                asked_guard, asked = (guard[0],) + question_guard(text)[1:], question_vector(text)
+        if not same_meaning(asked_guard, other_guard):
+            continue
+        score = cosine(asked, other)
+        if score >= best_score:
+            best, best_score = question, score
+    return best
+
+
+# ----------------------------------
+# Shared Answer Cache
+# ----------------------------------
+class AnswerCache:
+    """
+    SQLite-backed cache of chat answers, keyed by normalized question plus
+    the animal being talked about (context, e.g. a result's animal_key).
+
+    get() tries the exact normalized question first and then, if semantic
+    is on, the closest cached question for the same animal whose
+    question_vector() is at least `similarity` alike and that same_meaning()
+    doesn't turn down (animals named, with vocabulary, negation and word
+    order). Only cached questions sharing a content word are compared.
+    Entries expire after
+    ttl_seconds and the least recently used are dropped past max_entries.
+    One instance can be shared between Streamlit sessions (threads).
+    """
+
+    def __init__(self, path, max_entries=2000, ttl_seconds=7 * 24 * 3600, semantic=True, similarity=0.85,
+                 vocabulary=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.similarity = similarity
+        self.vocabulary = vocabulary
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                context TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (context, question)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed)")
+        self._conn.commit()
+
+        # context -> {normalized question: (guard, vector)} and context ->
+        # {content word: questions using it}, rebuilt from disk on startup
+        self._vectors = {}
+        self._by_word = {}
+        if semantic:
+            for context, question in self._conn.execute("SELECT context, question FROM answers"):
+                self._index(context, question)
+
+    def _features(self, normalized):
+        return question_guard(normalized, self.vocabulary), question_vector(normalized)
+
+    def _index(self, context, normalized):
+        features = self._vectors.setdefault(context, {})[normalized] = self._features(normalized)
+        by_word = self._by_word.setdefault(context, {})
+        for word in features[0][2]:
+            by_word.setdefault(word, set()).add(normalized)
+
+    def _closest(self, context, normalized):
+        vectors = self._vectors.get(context, {})
+        by_word = self._by_word.get(context, {})
+        candidates = set().union(*(by_word.get(word, ()) for word in content_words(normalized)))
+        return closest_question(
+            normalized, candidates, lambda question: vectors[question], self.similarity, self.vocabulary
+        )
+
+    def get(self, question, context=""):
+        """
+        Return the cached answer to question about context, or None.
+        """
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            row = self._fetch(context, normalized, now)
+            if row is None and self.semantic:
+                closest = self._closest(context, normalized)
+                if closest is not None:
+                    row = self._fetch(context, closest, now)
+                    if row is not None:
+                        self.semantic_hits += 1
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row
+
+    def _fetch(self, context, normalized, now):
+        row = self._conn.execute(
+            "SELECT answer, created FROM answers WHERE context = ? AND question = ?", (context, normalized)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl_seconds:
+            self._delete(context, normalized)
+            self._conn.commit()
+            return None
+        self._conn.execute(
+            "UPDATE answers SET accessed = ? WHERE context = ? AND question = ?", (now, context, normalized)
+        )
+        self._conn.commit()
+        return row[0]
+
+    def put(self, question, answer, context=""):
+        """
+        Store an answer and evict expired / least recently used entries.
+        """
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)", (context, normalized, answer, now, now)
+            )
+            if self.semantic:
+                self._index(context, normalized)
+            self._evict(now)
+            self._conn.commit()
+
+    def _delete(self, context, normalized):
+        self._conn.execute("DELETE FROM answers WHERE context = ? AND question = ?", (context, normalized))
+        features = self._vectors.get(context, {}).pop(normalized, None)
+        if features is not None:
+            by_word = self._by_word[context]
+            for word in features[0][2]:
+                by_word[word].discard(normalized)
+                if not by_word[word]:
+                    del by_word[word]
+
+    def _evict(self, now):
+        stale = self._conn.execute("""
+            SELECT context, question FROM answers WHERE created < ?
+            UNION
+            SELECT context, question FROM (
+                SELECT context, question FROM answers ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (now - self.ttl_seconds, self.max_entries)).fetchall()
+        for context, normalized in stale:
+            self._delete(context, normalized)
+
+    def contains(self, question, context=""):
+        """
+        True if there's an exact (normalized) answer cached, without counting a hit.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM answers WHERE context = ? AND question = ? AND created >= ?",
+                (context, normalize_question(question), time.time() - self.ttl_seconds)
+            ).fetchone() is not None
+
+    def stats(self):
+        return {"entries": len(self), "hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._vectors.clear()
+            self._by_word.clear()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+# ----------------------------------
+# Shared Answer Cache
+# ----------------------------------
+class SharedAnswerCache:
+    """
+    AnswerCache on a shared state store (shared_state.py), for several app
+    workers to share.
+
+    Each answer is a JSON value that expires after ttl_seconds, under a
+    hash of its context and normalized question. A hash per context lists
+    its questions for the semantic lookup; each worker reads that list at
+    most every refresh_seconds, and works out and remembers the vectors
+    itself. A sorted set of entries by last use finds the least recently
+    used ones to drop past max_entries, and one by when they were stored
+    finds the ones that have expired.
+    """
+
+    def __init__(self, state, max_entries=2000, ttl_seconds=7 * 24 * 3600, semantic=True, similarity=0.85,
+                 prefix="answers", vocabulary=None, refresh_seconds=5.0):
+        self.state = state
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.similarity = similarity
+        self.vocabulary = vocabulary
+        self.prefix = prefix
+        self.refresh_seconds = refresh_seconds
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._used = f"{prefix}:used"
+        self._created = f"{prefix}:created"
+        self._contexts = f"{prefix}:contexts"
+        # normalized question -> (question_guard(), question_vector()), whichever worker cached it
+        self._vectors = {}
+        # context -> (when it was read, its cached questions)
+        self._listed = {}
+
+    def _entry(self, context, normalized):
+        digest = hashlib.blake2b(f"{context}\x1f{normalized}".encode(), digest_size=16).hexdigest()
+        return digest, f"{self.prefix}:{digest}"
+
+    def _questions(self, context):
+        return f"{self.prefix}:questions:{context}"
+
+    def _features(self, normalized):
+        features = self._vectors.get(normalized)
+        if features is None:
+            if len(self._vectors) > 4 * self.max_entries:
+                self._vectors.clear()
+            features = self._vectors[normalized] = (
+                question_guard(normalized, self.vocabulary), question_vector(normalized)
+            )
+        return features
+
+    def _listing(self, context):
+        now = time.monotonic()
+        listed = self._listed.get(context)
+        if listed is None or now - listed[0] > self.refresh_seconds:
+            if len(self._listed) > self.max_entries:
+                self._listed.clear()
+            questions = [question.decode() for question in self.state.hkeys(self._questions(context))]
+            listed = self._listed[context] = (now, questions)
+        return listed[1]
+
+    def _closest(self, context, normalized):
+        words = set(content_words(normalized))
+        candidates = [
+            question for question in self._listing(context)
+            if not words.isdisjoint(self._features(question)[0][2])
+        ]
+        return closest_question(normalized, candidates, self._features, self.similarity, self.vocabulary)
+
+    def get(self, question, context=""):
+        """
+        Return the cached answer to question about context, or None.
+        """
+        normalized = normalize_question(question)
+        answer = self._fetch(context, normalized)
+        if answer is None and self.semantic:
+            closest = self._closest(context, normalized)
+            if closest is not None:
+                answer = self._fetch(context, closest)
+                if answer is not None:
+                    self.semantic_hits += 1
+
+        if answer is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return answer
+
+    def _fetch(self, context, normalized):
+        digest, key = self._entry(context, normalized)
+        raw = self.state.get(key)
+        if raw is None:
+            # Expired; stop offering it to the semantic lookup
+            if self.state.hdel(self._questions(context), normalized):
+                self._listed.pop(context, None)
+            return None
+        self.state.zadd(self._used, {digest: time.time()})
+        return json.loads(raw)["answer"]
+
+    def put(self, question, answer, context=""):
+        """
+        Store an answer and drop expired / least recently used entries.
+        """
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        now = time.time()
+        digest, key = self._entry(context, normalized)
+        entry = {"context": context, "question": normalized, "answer": answer}
+        self.state.set(key, json.dumps(entry), ex=self.ttl_seconds)
+        self.state.hset(self._questions(context), normalized, digest)
+        self.state.hset(self._contexts, context, 1)
+        self.state.zadd(self._used, {digest: now})
+        self.state.zadd(self._created, {digest: now})
+        self._listed.pop(context, None)
+        self._evict(now)
+
+    def _expire(self, now):
+        # Answers expire ttl_seconds after they were stored, however recently they were used
+        self.state.zremrangebyscore(self._used, "-inf", now - self.ttl_seconds)
+        expired = self.state.zrangebyscore(self._created, "-inf", now - self.ttl_seconds)
+        if expired:
+            self.state.zrem(self._used, *expired)
+            self.state.zrem(self._created, *expired)
+
+    def _evict(self, now):
+        self._expire(now)
+        excess = self.state.zcard(self._used) - self.max_entries
+        if excess <= 0:
+            return
+        for digest in self.state.zrange(self._used, 0, excess - 1):
+            key = f"{self.prefix}:{digest.decode()}"
+            raw = self.state.get(key)
+            if raw is not None:
+                entry = json.loads(raw)
+                self.state.hdel(self._questions(entry["context"]), entry["question"])
+                self.state.delete(key)
+            self.state.zrem(self._used, digest)
+            self.state.zrem(self._created, digest)
+
+    def contains(self, question, context=""):
+        """
+        True if there's an exact (normalized) answer cached, without counting a hit.
+        """
+        return bool(self.state.exists(self._entry(context, normalize_question(question))[1]))
+
+    def stats(self):
+        return {"entries": len(self), "hits": self.hits, "semantic_hits": self.semantic_hits, "misses": self.misses}
+
+    def clear(self):
+        digests = self.state.zrange(self._used, 0, -1)
+        contexts = [self._questions(context.decode()) for context in self.state.hkeys(self._contexts)]
+        self.state.delete(
+            *[f"{self.prefix}:{digest.decode()}" for digest in digests], self._used, self._created, self._contexts,
+            *contexts
+        )
+        self._vectors.clear()
+        self._listed.clear()
+
+    def __len__(self):
+        self._expire(time.time())
+        return self.state.zcard(self._used)
@@ -0,0 +1,172 @@
+import io
+import os
+import threading
+from .explorer import build_explorer
+from .models import CHAT_MODELS, VISION_MODELS
+from .rate_limit import ModelRateLimiter
+from .shared_state import connect_state
+
+# The app's limits (app.py), so a script sharing the API key doesn't use more than its share
+MODEL_CALLS_PER_MINUTE = 60
+MODEL_CALL_BURST = 10
+TOTAL_CALLS_PER_MINUTE = 120
+TOTAL_CALLS_PER_HOUR = 3000
+
+NOT_A_PICTURE_MESSAGE = "Not a picture that can be opened"
+
+
+class IdentifyError(Exception):
+    """
+    Raised by identify() when a photo couldn't be identified; result is the
+    error dict the explorer returned.
+    """
+
+    def __init__(self, result):
+        super().__init__(result.get("message", "Couldn't identify the photo"))
+        self.result = result
+
+
+def load_image(source):
+    """
+    Open a photo from a path, bytes, a file object or a PIL image.
+
+    Returns (image, size of the file in bytes, or None for a PIL image).
+    """
+    from PIL import Image
+
+    if isinstance(source, Image.Image):
+        return source, None
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            data = f.read()
+    elif isinstance(source, bytes):
+        data = source
+    else:
+        data = source.read()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image, len(data)
+
+
+# ----------------------------------
+# Animal Explorer API
+# ----------------------------------
+class AnimalAPI:
+    """
+    The app's "what animal is this?" and "ask the expert", for scripts,
+    workers and the command line (cli.py), with no Streamlit anywhere.
+
+    identify() returns the fact sheet (a dict with the ANIMAL_INFO_SCHEMA
+    fields, see fact_parser.py) and ask() the answer text. Both go through
+    the same AnimalExplorer as the app, so with the app's cache_dir or
+    state_url they share its caches. Use connect() to make one.
+    """
+
+    def __init__(self, explorer):
+        self.explorer = explorer
+
+    @property
+    def metrics(self):
+        return self.explorer.metrics
+
+    def identify_result(self, image):
+        """
+        The explorer's full result for a photo: the fact sheet plus caption,
+        model used and whether it came from the cache. Errors (including a
+        file that isn't a picture) are returned as {"error": True,
+        "message": ...} rather than raised.
+        """
+        from PIL import UnidentifiedImageError
+
+        try:
+            image, original_bytes = load_image(image)
+        except UnidentifiedImageError:
+            return {"error": True, "message": NOT_A_PICTURE_MESSAGE}
+        return self.explorer.identify(image, original_bytes)
+
+    def identify(self, image):
+        """
+        The fact sheet for the animal in a photo (path, bytes, file or PIL image).
+
+        Raises IdentifyError if it couldn't be identified.
+        """
+        result = self.identify_result(image)
+        if result.get("error"):
+            raise IdentifyError(result)
+        return result["animal_info"]
+
+    def ask(self, question, context=None, history=None):
+        """
+        Answer a question, about the animal in context (a fact sheet) if given.
+        """
+        return self.explorer.ask(question, context, history)
+
+
+def connect(api_key=None, base_url=None, cache_dir=None, state_url=None, calls_per_hour=None,
+            vision_models=VISION_MODELS, chat_models=CHAT_MODELS, **options):
+    """
+    An AnimalAPI set up like the app, from arguments or else the same
+    settings as environment variables: HF_API_KEY, HF_API_URL, CACHE_DIR
+    (default .cache), STATE_URL and HF_CALLS_PER_HOUR.
+
+    Calls are paced with the app's limits; with a state_url the limits,
+    caches and single-flight locks are shared with the app workers using
+    it. Other options go to build_explorer().
+    """
+    environ = os.environ
+    api_key = api_key if api_key is not None else environ.get("HF_API_KEY", "")
+    base_url = base_url or environ.get("HF_API_URL")
+    cache_dir = cache_dir if cache_dir is not None else environ.get("CACHE_DIR", ".cache")
+    state_url = state_url if state_url is not None else environ.get("STATE_URL", "")
+    calls_per_hour = calls_per_hour or int(environ.get("HF_CALLS_PER_HOUR", TOTAL_CALLS_PER_HOUR))
+
+    state = connect_state(state_url) if state_url else None
+    rate_limiter = ModelRateLimiter(
+        default_per_minute=MODEL_CALLS_PER_MINUTE,
+        burst=MODEL_CALL_BURST,
+        global_per_minute=TOTAL_CALLS_PER_MINUTE,
+        quota_per_hour=calls_per_hour,
+        state=state
+    )
+    if base_url:
+        options["base_url"] = base_url
+    # Scripts wait for the whole answer, so there's nothing for the async pipeline to show early
+    options.setdefault("async_pipeline", False)
+    explorer = build_explorer(
+        api_key, vision_models, chat_models, cache_dir=cache_dir or None,
+        rate_limiter=rate_limiter, state=state, **options
+    )
+    return AnimalAPI(explorer)
+
+
+# ----------------------------------
+# Module-Level Shortcuts
+# ----------------------------------
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_api():
+    """
+    The AnimalAPI that identify() and ask() use, connected from the
+    environment on first use.
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = connect()
+        return _default
+
+
+def identify(image):
+    """
+    The fact sheet for the animal in a photo; see AnimalAPI.identify().
+    """
+    return default_api().identify(image)
+
+
+def ask(question, context=None):
+    """
+    Answer a question about animals; see AnimalAPI.ask().
+    """
+    return default_api().ask(question, context)
@@ -0,0 +1,363 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+import httpx
+from .health import PROBE_CHAT
+from .metrics import Metrics
+from .rate_limit import RateLimited, caller, current_caller
+from .vocabulary import normalize_name
+from .prompts import ENRICHMENT_PARAMETERS, NAP_MESSAGE, enrichment_prompt, fallback_fact_sheet, generated_text
+
+# ----------------------------------
+# Background Event Loop
+# ----------------------------------
+class BackgroundLoop:
+    """
+    An asyncio event loop running forever in a daemon thread, so blocking
+    code (like a Streamlit script) can hand it coroutines.
+    """
+
+    def __init__(self, name="async-pipeline"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+# ----------------------------------
+# Async Hugging Face Client
+# ----------------------------------
+class AsyncHFClient:
+    """
+    httpx version of HFClient.post() for use on a BackgroundLoop.
+
+    Shares the URL, API key, retry settings and circuit breakers of the sync
+    client it wraps, so both paths agree on which models are healthy.
+    """
+
+    def __init__(self, client, pool_size=16):
+        self.client = client
+        self.pool_size = pool_size
+        self._http = None
+
+    def _get_http(self):
+        # httpx clients belong to the loop they were first used on
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                headers={"Authorization": self.client.session.headers["Authorization"]},
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+        return self._http
+
+    async def post(self, model, timeout=30, **kwargs):
+        breaker = self.client.start_call(model)
+        http = self._get_http()
+        url = self.client.model_url(model)
+        try:
+            for attempt in range(self.client.max_retries + 1):
+                waited = None
+                if self.client.rate_limiter is not None:
+                    # Waits in the shared fair queue on a worker thread (which keeps the caller tag)
+                    waited = await asyncio.to_thread(self.client.rate_limiter.acquire, model)
+                started = time.monotonic()
+                try:
+                    response = await http.post(url, timeout=timeout, **kwargs)
+                except httpx.TimeoutException:
+                    self.client.call_timed_out(model, breaker, waited)
+                    raise
+                except httpx.TransportError:
+                    wait = self.client.connection_failed(model, breaker, attempt, waited)
+                    if wait is None:
+                        raise
+                    await asyncio.sleep(wait)
+                    continue
+                except asyncio.CancelledError:
+                    self.client.note_attempt(model, "cancelled", waited)
+                    raise
+
+                wait = self.client.call_answered(model, response, attempt, waited, latency=time.monotonic() - started)
+                if wait is None:
+                    break
+                await asyncio.sleep(wait)
+        except BaseException:
+            # Cancelled (lost a race) while queued, calling or backing off: that says
+            # nothing about the model's health, but mustn't keep its trial call forever
+            breaker.release()
+            raise
+
+        self.client.end_call(breaker, response)
+        return response
+
+
+# ----------------------------------
+# Racing Models
+# ----------------------------------
+async def _timed(call, model, stats):
+    started = time.monotonic()
+    try:
+        result = await call(model)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        result = None
+    if stats is not None:
+        stats.record(model, time.monotonic() - started, bool(result))
+    return result
+
+
+async def race(models, call, hedge_delay=None, stats=None):
+    """
+    Async version of hedging.hedged_call(): the first good answer wins and
+    every other call still running is cancelled.
+
+    Returns (model, result), or (None, None) if every model failed.
+    """
+    waiting = list(models)
+    running = {}
+
+    def launch():
+        model = waiting.pop(0)
+        running[asyncio.ensure_future(_timed(call, model, stats))] = model
+
+    if waiting:
+        launch()
+
+    try:
+        while running:
+            timeout = hedge_delay if waiting else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                launch()
+                continue
+
+            for task in done:
+                model = running.pop(task)
+                if task.result():
+                    return model, task.result()
+                if waiting:
+                    launch()
+
+        return None, None
+    finally:
+        for task in running:
+            task.cancel()
+
+
+# ----------------------------------
+# Identification Jobs
+# ----------------------------------
+class IdentifyJob:
+    """
+    Handle for an identification running in the background.
+
+    caption resolves as soon as a vision model has described the photo (to
+    None if none could), result resolves to the same dict that
+    identify_animal_with_hf() returns once the fact sheet is ready.
+    """
+
+    def __init__(self):
+        self.caption = Future()
+        self.result = Future()
+        self.started = time.monotonic()
+
+    @classmethod
+    def finished(cls, result):
+        job = cls()
+        job.caption.set_result(result.get("caption"))
+        job.result.set_result(result)
+        return job
+
+    def done(self):
+        return self.result.done()
+
+
+class IdentifyPipeline:
+    """
+    Caption a photo and write its fact sheet without blocking the caller.
+
+    While the vision models are racing, the likeliest chat model gets a
+    health probe (HFClient.probe()) if the client's health table hasn't
+    heard from it lately, so it's loaded by the time the caption arrives;
+    HealthProber keeps the others warm. The chat models are then raced as
+    well instead of being tried one after another.
+    parse turns the fact sheet text into the animal_info dict. If a
+    vision_backend (e.g. LocalBlipBackend) is given it makes the caption on
+    a worker thread instead of racing the remote vision models. With a
+    knowledge_base (AnimalKnowledgeBase) the chat models are only asked
+    about animals it doesn't know yet, and their answers are saved to it.
+    A vocabulary (AnimalVocabulary) names the animal in the caption, so the
+    fallback fact sheet has a real name when every chat model fails.
+    timeout is the seconds each remote call may take. The caption, each
+    vision and chat call, the parsing and the whole run are timed as spans
+    on metrics.
+    """
+
+    def __init__(self, client, vision_models, chat_models, parse, vision_stats=None, chat_stats=None,
+                 hedge_delay=4.0, chat_hedge_delay=8.0, loop=None, vision_backend=None,
+                 knowledge_base=None, vocabulary=None, timeout=30, metrics=None):
+        self.client = client
+        self.async_client = AsyncHFClient(client)
+        self.vision_models = vision_models
+        self.chat_models = chat_models
+        self.parse = parse
+        self.vision_stats = vision_stats
+        self.chat_stats = chat_stats
+        self.hedge_delay = hedge_delay
+        self.chat_hedge_delay = chat_hedge_delay
+        self.loop = loop or BackgroundLoop()
+        self.vision_backend = vision_backend
+        self.knowledge_base = knowledge_base
+        self.vocabulary = vocabulary
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else Metrics()
+        # model -> its warm-up task while it runs (the loop only keeps weak references)
+        self._warming = {}
+
+    def start(self, image_bytes, on_result=None):
+        """
+        Start identifying image_bytes and return an IdentifyJob right away.
+
+        on_result(result) is called just before job.result resolves, e.g. to
+        add details or cache the answer.
+        """
+        job = IdentifyJob()
+        self.loop.submit(self._run_as(current_caller(), self._run(job, image_bytes, on_result)))
+        return job
+
+    async def _run_as(self, who, coro):
+        # The loop thread doesn't know who asked; keep the caller's rate limit tag
+        with caller(*who):
+            return await coro
+
+    def _ordered(self, models, stats):
+        if stats is not None:
+            models = stats.ordered(models)
+        return self.client.available(models)
+
+    async def _caption(self, model, image_bytes):
+        with self.metrics.span("vision_call", model=model) as span:
+            response = await self.async_client.post(model, content=image_bytes, timeout=self.timeout)
+            caption = generated_text(response.json()) if response.status_code == 200 else None
+            if not caption:
+                span.fail()
+            return caption
+
+    async def _enrich(self, model, prompt):
+        with self.metrics.span("chat_call", model=model, task="fact_sheet") as span:
+            response = await self.async_client.post(
+                model, json={"inputs": prompt, "parameters": ENRICHMENT_PARAMETERS}, timeout=self.timeout
+            )
+            text = generated_text(response.json(), prompt) if response.status_code == 200 else None
+            if not text:
+                span.fail()
+            return text
+
+    def _warm_up(self, model):
+        # A model that's up, loading or down won't load any sooner for being asked again
+        health = self.client.health
+        if health is None or model in self._warming or health.state(model) != "unknown":
+            return
+        task = self._warming[model] = asyncio.ensure_future(self._warm(model))
+        task.add_done_callback(lambda _: self._warming.pop(model, None))
+
+    async def _warm(self, model):
+        try:
+            # One try, with the app's upkeep priority, and failures don't count against the model
+            await asyncio.to_thread(self.client.probe, model, json=PROBE_CHAT, timeout=self.timeout)
+        except RateLimited:
+            pass
+        except Exception as e:
+            self.metrics.error("warm_up", e, model=model)
+
+    async def _run(self, job, image_bytes, on_result):
+        with self.metrics.span("identify", path="pipeline") as span:
+            result = await self._identify(job, image_bytes)
+            if result.get("error"):
+                span.fail()
+
+        if on_result is not None:
+            try:
+                on_result(result)
+            except Exception as e:
+                self.metrics.error("identify_on_result", e)
+        job.result.set_result(result)
+
+    async def _identify(self, job, image_bytes):
+        try:
+            chat_models = self._ordered(self.chat_models, self.chat_stats)
+            if chat_models:
+                self._warm_up(chat_models[0])
+
+            backend = self.vision_backend.name if self.vision_backend is not None else "remote"
+            with self.metrics.span("caption", backend=backend) as span:
+                if self.vision_backend is not None:
+                    model_used, caption = await asyncio.get_running_loop().run_in_executor(
+                        None, self.vision_backend.caption, image_bytes
+                    )
+                else:
+                    vision_model, caption = await race(
+                        self._ordered(self.vision_models, self.vision_stats),
+                        lambda model: self._caption(model, image_bytes),
+                        self.hedge_delay,
+                        self.vision_stats
+                    )
+                    model_used = f"Hugging Face ({vision_model})"
+                if not caption:
+                    span.fail()
+            job.caption.set_result(caption)
+
+            known = animal_name = None
+            if caption and self.vocabulary is not None:
+                animal_name = self.vocabulary.extract(caption)
+            if caption and self.knowledge_base is not None:
+                known = self.knowledge_base.lookup(caption)
+
+            if not caption:
+                result = {"error": True, "message": NAP_MESSAGE}
+            elif known is not None:
+                result = {
+                    "error": False,
+                    "text": json.dumps(known, ensure_ascii=False, indent=2),
+                    "caption": caption,
+                    "animal_info": known,
+                    "model_used": f"{model_used} + Animal Fact Book",
+                    "animal_key": normalize_name(known["animal_name"]),
+                    "cached": False,
+                    "enriched": True
+                }
+            else:
+                prompt = enrichment_prompt(caption)
+                _, enhanced_text = await race(
+                    chat_models,
+                    lambda model: self._enrich(model, prompt),
+                    self.chat_hedge_delay,
+                    self.chat_stats
+                )
+
+                enriched = bool(enhanced_text and len(enhanced_text) > 50)
+                text = enhanced_text if enriched else fallback_fact_sheet(caption, animal_name)
+                with self.metrics.span("parse"):
+                    animal_info = self.parse(text)
+                if enriched and self.knowledge_base is not None:
+                    self.knowledge_base.add(animal_info, aliases=[animal_name] if animal_name else ())
+                result = {
+                    "error": False,
+                    "text": text,
+                    "caption": caption,
+                    "animal_info": animal_info,
+                    "model_used": model_used,
+                    "animal_key": normalize_name(animal_name or (animal_info["animal_name"] if enriched else "")),
+                    "cached": False,
+                    "enriched": enriched
+                }
+        except Exception as e:
+            self.metrics.error("identify", e, path="pipeline")
+            if not job.caption.done():
+                job.caption.set_result(None)
+            result = {"error": True, "message": f"Oops! Something went wrong: {str(e)}"}
+        return result
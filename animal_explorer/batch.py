@@ -0,0 +1,159 @@
+import contextvars
+import csv
+import hashlib
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SUMMARY_FIELDS = [
+    "file", "status", "animal_name", "scientific_name", "animal_type",
+    "seconds", "cached", "duplicate_of", "message"
+]
+
+# ----------------------------------
+# Dedupe Uploads
+# ----------------------------------
+def dedupe_files(files):
+    """
+    Split a list of (name, bytes) into unique photos and duplicates.
+
+    Returns (unique, duplicates): unique is a list of (index, name, bytes,
+    sha256) and duplicates maps the index of each repeated file to the index
+    of the first file with the same content.
+    """
+    unique = []
+    duplicates = {}
+    first_by_hash = {}
+
+    for index, (name, data) in enumerate(files):
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in first_by_hash:
+            duplicates[index] = first_by_hash[digest]
+        else:
+            first_by_hash[digest] = index
+            unique.append((index, name, data, digest))
+
+    return unique, duplicates
+
+
+# ----------------------------------
+# Run a Batch
+# ----------------------------------
+def _summary_row(name, result, seconds):
+    row = dict.fromkeys(SUMMARY_FIELDS, "")
+    row.update(file=name, seconds=round(seconds, 2))
+    if result.get("error"):
+        row.update(status="error", message=result.get("message", ""))
+    else:
+        info = result["animal_info"]
+        row.update(
+            status="done",
+            animal_name=info.get("animal_name", ""),
+            scientific_name=info.get("scientific_name", ""),
+            animal_type=info.get("animal_type", ""),
+            cached=bool(result.get("cached"))
+        )
+    return row
+
+
+def run_batch(files, identify, concurrency=4, progress=None):
+    """
+    Identify many photos at once with at most `concurrency` in flight.
+
+    files is a list of (name, bytes). identify(name, data) returns the same
+    dict as identify_animal_with_hf(). Identical files are only identified
+    once. progress(rows), if given, is called with the summary rows every
+    time a photo finishes, so a UI can show them as they come in.
+
+    Returns (rows, stats) where stats holds the throughput and latencies.
+    """
+    unique, duplicates = dedupe_files(files)
+    started = time.monotonic()
+
+    rows = []
+    for index, (name, _) in enumerate(files):
+        row = dict.fromkeys(SUMMARY_FIELDS, "")
+        row.update(file=name, status="waiting")
+        if index in duplicates:
+            row.update(status="duplicate", duplicate_of=files[duplicates[index]][0])
+        rows.append(row)
+
+    lock = threading.Lock()
+
+    def identify_one(index, name, data):
+        with lock:
+            rows[index]["status"] = "working"
+        item_started = time.monotonic()
+        try:
+            result = identify(name, data)
+        except Exception as e:
+            result = {"error": True, "message": str(e)}
+        return index, result, time.monotonic() - item_started
+
+    def report():
+        if progress is not None:
+            with lock:
+                snapshot = [dict(row) for row in rows]
+            progress(snapshot)
+
+    report()
+    latencies = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        # Each photo keeps the caller's context (e.g. its rate limit tag)
+        futures = [
+            executor.submit(contextvars.copy_context().run, identify_one, index, name, data)
+            for index, name, data, _ in unique
+        ]
+        for future in as_completed(futures):
+            index, result, seconds = future.result()
+            latencies.append(seconds)
+            with lock:
+                rows[index] = _summary_row(files[index][0], result, seconds)
+                for duplicate, original in duplicates.items():
+                    if original == index:
+                        rows[duplicate] = dict(
+                            rows[index], file=files[duplicate][0], duplicate_of=files[index][0], seconds=0.0
+                        )
+            report()
+
+    elapsed = time.monotonic() - started
+    return rows, batch_stats(latencies, elapsed, len(files))
+
+
+def batch_stats(latencies, elapsed, total_files):
+    """
+    Throughput and per-photo latency numbers for a finished (or running) batch.
+    """
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "files": total_files,
+        "identified": len(ordered),
+        "elapsed_seconds": elapsed,
+        "images_per_minute": total_files / elapsed * 60 if elapsed > 0 else 0.0,
+        "mean_seconds": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p50_seconds": percentile(50),
+        "p95_seconds": percentile(95)
+    }
+
+
+# ----------------------------------
+# Export
+# ----------------------------------
+def rows_to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def rows_to_json(rows, stats=None):
+    return json.dumps({"stats": stats or {}, "results": rows}, indent=2, ensure_ascii=False)
@@ -0,0 +1,201 @@
+"""
+Identify photos and ask questions from the command line, without the app.
+
+    python -m animal_explorer identify PHOTOS_DIR [-o results.jsonl] [--workers 4]
+    python -m animal_explorer ask "What do otters eat?" [--animal "Sea Otter"]
+
+identify walks a directory (and its subdirectories) for photos and writes
+one JSON line per photo to the output as each one finishes. Run it again
+with the same output to pick up where it stopped: photos already done are
+skipped and failed ones are tried again. Settings come from the options or
+the app's environment variables (HF_API_KEY, HF_API_URL, CACHE_DIR,
+STATE_URL, HF_CALLS_PER_HOUR).
+"""
+import argparse
+import contextvars
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .api import connect
+from .batch import batch_stats
+from .rate_limit import caller
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# ----------------------------------
+# Finding Photos
+# ----------------------------------
+def find_images(root, recursive=True):
+    """
+    Yield the path (relative to root) of every photo under root, in a stable order.
+    """
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        if not recursive:
+            subdirectories.clear()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(directory, name), root)
+
+
+def read_done(path):
+    """
+    The photos a previous run already wrote to the output at path as done.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # Cut off when the last run was stopped
+                continue
+            if row.get("status") == "done":
+                done.add(row["file"])
+    return done
+
+
+# ----------------------------------
+# Identifying Photos
+# ----------------------------------
+def _row(name, result, seconds):
+    row = {"file": name, "seconds": round(seconds, 2)}
+    if result.get("error"):
+        row.update(status="error", message=result.get("message", ""))
+    else:
+        row.update(
+            status="done", cached=bool(result.get("cached")), caption=result.get("caption"),
+            model_used=result.get("model_used"), animal_info=result["animal_info"]
+        )
+    return row
+
+
+def identify_files(api, root, names, workers=4):
+    """
+    Identify the photos named (relative to root) with `workers` at a time
+    and yield a row for each as it finishes, in whatever order they do.
+
+    names can be a generator; only a few more than `workers` are taken
+    from it at once, so a huge archive is never listed in memory.
+    """
+    def identify_one(name):
+        started = time.monotonic()
+        try:
+            result = api.identify_result(os.path.join(root, name))
+        except Exception as e:
+            result = {"error": True, "message": str(e)}
+        return _row(name, result, time.monotonic() - started)
+
+    names = iter(names)
+    pending = set()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cli")
+    try:
+        while True:
+            for name in names:
+                # Each photo keeps the caller's context (its rate limit tag)
+                pending.add(executor.submit(contextvars.copy_context().run, identify_one, name))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def run_identify(args):
+    api = connect_from_args(args)
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = read_done(args.output)
+    names = (name for name in find_images(args.directory, not args.no_recursive) if name not in done)
+    if done:
+        print(f"Resuming: {len(done)} photos already done", file=sys.stderr)
+
+    started = time.monotonic()
+    latencies = []
+    counts = {"done": 0, "error": 0}
+    with open(args.output, "a", encoding="utf-8") as out:
+        # Finish a line cut off when the last run was stopped
+        if out.tell() > 0:
+            with open(args.output, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+        try:
+            # Let kids using the app at the same time go first
+            with caller("cli", "batch"):
+                for row in identify_files(api, args.directory, names, args.workers):
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    out.flush()
+                    latencies.append(row["seconds"])
+                    counts[row["status"]] += 1
+                    name = row["animal_info"]["animal_name"] if row["status"] == "done" else row["message"]
+                    print(f"[{sum(counts.values())}] {row['file']}: {name} ({row['seconds']:.1f}s)", file=sys.stderr)
+        except KeyboardInterrupt:
+            print("Stopped; run the same command again to carry on", file=sys.stderr)
+            return 130
+
+    stats = batch_stats(latencies, time.monotonic() - started, len(latencies))
+    print(
+        f"{counts['done']} identified, {counts['error']} failed, {len(done)} skipped in "
+        f"{stats['elapsed_seconds']:.0f}s ({stats['images_per_minute']:.1f}/min, "
+        f"p95 {stats['p95_seconds']:.1f}s) -> {args.output}",
+        file=sys.stderr
+    )
+    return 1 if counts["error"] else 0
+
+
+# ----------------------------------
+# Asking Questions
+# ----------------------------------
+def run_ask(args):
+    api = connect_from_args(args)
+    context = {"animal_name": args.animal} if args.animal else None
+    print(api.ask(args.question, context))
+    return 0
+
+
+# ----------------------------------
+# Command Line
+# ----------------------------------
+def connect_from_args(args):
+    return connect(
+        api_key=args.api_key, base_url=args.api_url, cache_dir=args.cache_dir,
+        state_url=args.state, calls_per_hour=args.calls_per_hour
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m animal_explorer", description=__doc__.splitlines()[1])
+    parser.add_argument("--api-key", help="Hugging Face API key (default: $HF_API_KEY)")
+    parser.add_argument("--api-url", help="Hugging Face API address (default: $HF_API_URL or the real one)")
+    parser.add_argument("--cache-dir", help="the app's cache directory, shared with it (default: $CACHE_DIR or .cache)")
+    parser.add_argument("--state", help="shared state store, as the app's STATE_URL (default: $STATE_URL)")
+    parser.add_argument("--calls-per-hour", type=int, help="hourly API quota (default: $HF_CALLS_PER_HOUR or 3000)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    identify = commands.add_parser("identify", help="identify every photo in a directory")
+    identify.add_argument("directory")
+    identify.add_argument("-o", "--output", default="results.jsonl", help="JSON lines file (default: results.jsonl)")
+    identify.add_argument("--workers", type=int, default=4, help="photos identified at once (default: 4)")
+    identify.add_argument("--no-recursive", action="store_true", help="skip subdirectories")
+    identify.add_argument("--restart", action="store_true", help="start over instead of resuming")
+    identify.set_defaults(run=run_identify)
+
+    ask = commands.add_parser("ask", help="ask the animal expert a question")
+    ask.add_argument("question")
+    ask.add_argument("--animal", help="the animal the question is about")
+    ask.set_defaults(run=run_ask)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.run(args)
@@ -0,0 +1,108 @@
+from collections import OrderedDict, deque
+
+# Who said what, as the chat models see it
+SPEAKERS = {"user": "Kid", "assistant": "Expert"}
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about 4 characters each), close enough for budgeting prompts
+    """
+    return (len(text) + 3) // 4
+
+
+def _shorten(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+# ----------------------------------
+# Conversation
+# ----------------------------------
+class Conversation:
+    """
+    One session's chat: a bounded ring of recent turns plus a running summary.
+
+    Turns are dicts like {'role': 'user', 'content': ...}. Only the newest
+    max_turns are kept; older ones are folded into the summary, which
+    remembers the last few earlier questions and the animals talked about
+    (found with an AnimalVocabulary, if one is given). So memory use,
+    render time and prompt size stay flat however long a chat runs.
+    """
+
+    def __init__(self, max_turns=20, summary_tokens=80, vocabulary=None, max_topics=8, max_questions=4):
+        self.turns = deque(maxlen=max_turns)
+        self.summary_tokens = summary_tokens
+        self.vocabulary = vocabulary
+        self.max_topics = max_topics
+        self.total = 0
+        self._questions = deque(maxlen=max_questions)
+        self._topics = OrderedDict()
+
+    def add(self, role, content):
+        if len(self.turns) == self.turns.maxlen:
+            self._fold(self.turns[0])
+        self.turns.append({'role': role, 'content': content})
+        self.total += 1
+
+    def _fold(self, turn):
+        if turn['role'] == 'user':
+            self._questions.append(_shorten(turn['content'], 80))
+        if self.vocabulary is not None:
+            for name, _ in self.vocabulary.find(turn['content']):
+                self._topics[name] = True
+                self._topics.move_to_end(name)
+                while len(self._topics) > self.max_topics:
+                    self._topics.popitem(last=False)
+
+    def summary(self):
+        """
+        A sentence or two about the turns that no longer fit, within summary_tokens.
+        """
+        topics = f"Animals we talked about: {', '.join(self._topics)}." if self._topics else ""
+        questions = list(self._questions)
+        while True:
+            asked = f"Earlier the kid asked: {' '.join(questions)}" if questions else ""
+            text = " ".join(part for part in (asked, topics) if part)
+            if not questions or estimate_tokens(text) <= self.summary_tokens:
+                return text
+            questions.pop(0)
+
+    def window(self, max_tokens):
+        """
+        The chat so far as prompt text: the summary, then as many of the
+        newest turns as fit in max_tokens. Empty if there's nothing to send.
+        """
+        summary = self.summary()
+        budget = max_tokens - estimate_tokens(summary)
+        lines = []
+        for turn in reversed(self.turns):
+            line = f"{SPEAKERS.get(turn['role'], turn['role'])}: {' '.join(turn['content'].split())}"
+            cost = estimate_tokens(line) + 1
+            if cost > budget:
+                break
+            lines.append(line)
+            budget -= cost
+        lines.reverse()
+        return "\n".join(([summary] if summary else []) + lines)
+
+    def visible(self, count):
+        """
+        The newest count turns, the only ones worth drawing.
+        """
+        return list(self.turns)[-count:] if count else []
+
+    def hidden(self, count):
+        """
+        How many turns aren't shown when only the newest count are.
+        """
+        return max(self.total - count, 0)
+
+    def clear(self):
+        self.turns.clear()
+        self._questions.clear()
+        self._topics.clear()
+        self.total = 0
+
+    def __len__(self):
+        return self.total
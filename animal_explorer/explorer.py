@@ -0,0 +1,586 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .answer_cache import AnswerCache, SharedAnswerCache, normalize_question
+from .async_pipeline import IdentifyJob, IdentifyPipeline
+from .fact_parser import parse_animal_info
+from .hedging import ModelStats
+from .hf_client import HF_API_URL, HFClient
+from .knowledge_base import AnimalKnowledgeBase
+from .metrics import Metrics
+from .phash import PerceptualIndex, dhash
+from .preprocess import prepare_image_for_upload
+from .result_cache import ResultCache, SharedResultCache, image_cache_key
+from .single_flight import SingleFlight
+from .vision_backends import RemoteHFBackend
+from .vocabulary import load_vocabulary, normalize_name
+from .prompts import (
+    CHAT_FALLBACK_MESSAGE, CHAT_RESTING_MESSAGE, ENRICHMENT_PARAMETERS, NAP_MESSAGE, NO_API_KEY_MESSAGE,
+    PROMPT_VERSION, chat_prompt, enrichment_prompt, fallback_fact_sheet, generated_text
+)
+
+DEFAULT_CHAT_PARAMETERS = {"max_new_tokens": 250, "temperature": 0.7, "top_p": 0.9}
+# phash_index is rebuilt from the result cache once it's this much bigger than the cache can hold
+PHASH_SLACK = 1.25
+
+
+def chat_cache_context(context):
+    """
+    The part of the chat context that changes the answer: which animal we're talking about
+    """
+    if not context:
+        return ""
+    return normalize_name(context.get('animal_name', ''))
+
+
+def chat_key(user_message, context=None, history=None):
+    """
+    What makes two chat questions the same question
+    """
+    return chat_cache_context(context), normalize_question(user_message), history
+
+
+def _oops(e):
+    return {"error": True, "message": f"Oops! Something went wrong: {str(e)}"}
+
+
+def _flag(value):
+    return "yes" if value else "no"
+
+
+# ----------------------------------
+# Animal Explorer
+# ----------------------------------
+class AnimalExplorer:
+    """
+    Everything behind "what animal is this?" and "ask the expert", with no
+    Streamlit in it, so the app, benchmarks and scripts share one code path.
+
+    client is an HFClient and vision_backend makes captions. The caches and
+    helpers are all optional: result_cache with phash_index (same or
+    similar photos), knowledge_base (fact sheets without a chat model),
+    vocabulary (the animal named in a caption), answer_cache (chat answers),
+    single_flight (identical requests share one call) and pipeline (an
+    IdentifyPipeline for start_identification). answer_models and
+    prompt_version go into result cache keys. Each step (encode, caption,
+    every model call, parse, the whole request) is timed as a span on
+    metrics, along with near-duplicate lookups ("phash_lookups_total") and
+    the failures that get worked around.
+    When several app workers share the result cache, phash_sync_seconds
+    sets how often phash_index picks up the photos the others stored.
+    """
+
+    def __init__(self, client, vision_backend, chat_models, answer_models=None, prompt_version=PROMPT_VERSION,
+                 result_cache=None, phash_index=None, phash_namespace="", knowledge_base=None,
+                 vocabulary=None, answer_cache=None, single_flight=None, pipeline=None,
+                 upload_max_side=512, upload_format="JPEG", upload_quality=85,
+                 chat_parameters=None, stream_stop_chars=400, timeout=30, metrics=None, phash_sync_seconds=None):
+        self.client = client
+        self.vision_backend = vision_backend
+        self.chat_models = list(chat_models)
+        self.answer_models = list(answer_models or self.chat_models)
+        self.prompt_version = prompt_version
+        self.result_cache = result_cache
+        self.phash_index = phash_index
+        self.phash_namespace = phash_namespace
+        self.knowledge_base = knowledge_base
+        self.vocabulary = vocabulary
+        self.answer_cache = answer_cache
+        self.pipeline = pipeline
+        self.upload_max_side = upload_max_side
+        self.upload_format = upload_format
+        self.upload_quality = upload_quality
+        self.chat_parameters = chat_parameters or DEFAULT_CHAT_PARAMETERS
+        self.stream_stop_chars = stream_stop_chars
+        self.timeout = timeout
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.single_flight = single_flight or SingleFlight(metrics=self.metrics)
+        self.phash_sync_seconds = phash_sync_seconds
+        self._phash_synced = time.time()
+        self._phash_sync_lock = threading.Lock()
+        self._phash_trim_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        """
+        False until there's an API key to call the models with.
+        """
+        return bool(self.client.api_key)
+
+    # ----------------------------------
+    # Result Cache
+    # ----------------------------------
+    def cache_key(self, image):
+        return image_cache_key(image, self.answer_models, self.prompt_version)
+
+    def find_cached_result(self, image, cache_key=None):
+        """
+        Look a photo up in the result cache, first exactly and then by perceptual hash
+
+        Returns (cached result or None, cache key, perceptual hash)
+        """
+        if cache_key is None:
+            cache_key = self.cache_key(image)
+        if self.result_cache is None:
+            return None, cache_key, None
+        cached = self.result_cache.get(cache_key)
+
+        # Not exactly the same? Maybe it's a resized or recompressed copy of one we've seen
+        # (Flat photos have no hash: they'd all look like each other)
+        phash = dhash(image)
+        if not cached and self.phash_index is not None and phash is not None:
+            self._sync_phashes()
+            match = self.phash_index.lookup(phash)
+            outcome = "miss"
+            if match:
+                cached = self.result_cache.get(match[0])
+                outcome = "hit" if cached else "expired"
+                if not cached:
+                    # Its result expired or was evicted
+                    self.phash_index.remove(match[0])
+            self.metrics.inc("phash_lookups_total", outcome=outcome)
+
+        if not cached:
+            return None, cache_key, phash
+
+        return {
+            "error": False,
+            "text": cached["text"],
+            "caption": cached["caption"],
+            "animal_info": cached["animal_info"],
+            "model_used": cached["model_used"],
+            "animal_key": normalize_name(cached["animal_info"].get("animal_name", "")),
+            "cached": True
+        }, cache_key, phash
+
+    def _sync_phashes(self):
+        """
+        Add the perceptual hashes other workers stored since the last look,
+        at most every phash_sync_seconds
+        """
+        if self.phash_sync_seconds is None:
+            return
+        now = time.time()
+        with self._phash_sync_lock:
+            if now - self._phash_synced < self.phash_sync_seconds:
+                return
+            # A little overlap, for results stored while we last looked
+            since, self._phash_synced = self._phash_synced - 1.0, now
+        for phash, key in self.result_cache.iter_phashes(self.phash_namespace, since=since):
+            self.phash_index.add(phash, key)
+
+    def remember_result(self, cache_key, phash, result):
+        """
+        Save a finished identification so the same (or a similar) photo is instant next time
+        """
+        if self.result_cache is None:
+            return
+        self.result_cache.put(
+            cache_key, result["caption"], result["text"], result["animal_info"], result["model_used"],
+            phash=phash, namespace=self.phash_namespace
+        )
+        if self.phash_index is not None and phash is not None:
+            self.phash_index.add(phash, cache_key)
+            self._trim_phashes()
+
+    def _trim_phashes(self):
+        """
+        Start phash_index over from the result cache once it holds well
+        more entries than the cache can, so evicted results don't pile up
+        """
+        max_entries = getattr(self.result_cache, "max_entries", None)
+        if not max_entries or len(self.phash_index) <= max_entries * PHASH_SLACK:
+            return
+        if not self._phash_trim_lock.acquire(blocking=False):
+            return
+        try:
+            self.phash_index.rebuild(self.result_cache.iter_phashes(self.phash_namespace))
+        finally:
+            self._phash_trim_lock.release()
+
+    def _prepare(self, image, original_bytes):
+        # Shrink the photo and convert it to small JPEG bytes
+        with self.metrics.span("encode"):
+            return prepare_image_for_upload(
+                image,
+                max_side=self.upload_max_side,
+                format=self.upload_format,
+                quality=self.upload_quality,
+                original_bytes=original_bytes
+            )
+
+    # ----------------------------------
+    # Identifying Photos
+    # ----------------------------------
+    def identify(self, image, original_bytes=None):
+        """
+        Caption a photo and write its kid-friendly fact sheet.
+
+        original_bytes is the uploaded file's size, used to report upload
+        savings. If the same photo is already being identified for someone
+        else, this waits for that answer instead of asking the AI again.
+        """
+        if not self.ready:
+            return {"error": True, "message": NO_API_KEY_MESSAGE}
+
+        with self.metrics.span("identify", path="sync") as span:
+            try:
+                cache_key = self.cache_key(image)
+                result = self.single_flight.do(
+                    "identify", cache_key, self.identify_photo, image, original_bytes, cache_key
+                )
+            except Exception as e:
+                self.metrics.error("identify", e, path="sync")
+                result = _oops(e)
+            span.labels["cached"] = _flag(result.get("cached"))
+            if result.get("error"):
+                span.fail()
+            return dict(result)
+
+    def identify_photo(self, image, original_bytes=None, cache_key=None):
+        """
+        The actual work behind identify: cache, caption, fact sheet
+        """
+        try:
+            # Same photo as before? Answer straight from the cache
+            cached, cache_key, phash = self.find_cached_result(image, cache_key)
+            if cached:
+                return cached
+
+            img_byte_arr, upload_stats = self._prepare(image, original_bytes)
+            with self.metrics.span("caption", backend=self.vision_backend.name) as span:
+                model_used, caption = self.vision_backend.caption(img_byte_arr)
+                if not caption:
+                    span.fail()
+            if not caption:
+                return {"error": True, "message": NAP_MESSAGE}
+
+            # The animal the caption talks about, e.g. "a dog sitting on a couch" -> Dog
+            animal_name = self.vocabulary.extract(caption) if self.vocabulary is not None else None
+
+            # Animals we already know don't need a chat model at all
+            known = self.knowledge_base.lookup(caption) if self.knowledge_base is not None else None
+            if known is not None:
+                result = {
+                    "error": False,
+                    "text": json.dumps(known, ensure_ascii=False, indent=2),
+                    "caption": caption,
+                    "animal_info": known,
+                    "model_used": f"{model_used} + Animal Fact Book",
+                    "animal_key": normalize_name(known["animal_name"]),
+                    "cached": False,
+                    "upload_stats": upload_stats
+                }
+                self.remember_result(cache_key, phash, result)
+                return result
+
+            # Try to enhance with chat model
+            enhanced_text = None
+            prompt = enrichment_prompt(caption)
+            for chat_model in self.client.available(self.chat_models):
+                with self.metrics.span("chat_call", model=chat_model, task="fact_sheet") as span:
+                    try:
+                        chat_response = self.client.post(
+                            chat_model,
+                            json={"inputs": prompt, "parameters": ENRICHMENT_PARAMETERS},
+                            timeout=self.timeout
+                        )
+
+                        if chat_response.status_code == 200:
+                            enhanced_text = generated_text(chat_response.json(), prompt)
+                            if enhanced_text:
+                                break
+                        span.fail()
+
+                    except Exception as e:
+                        span.fail()
+                        self.metrics.error("chat_call", e, model=chat_model)
+                        continue
+
+            # Use enhanced text if available, otherwise create simple response
+            enriched = bool(enhanced_text and len(enhanced_text) > 50)
+            response_text = enhanced_text if enriched else fallback_fact_sheet(caption, animal_name)
+            with self.metrics.span("parse"):
+                animal_info = parse_animal_info(response_text)
+
+            # New animal: keep its fact sheet so the next one is instant
+            if enriched and self.knowledge_base is not None:
+                self.knowledge_base.add(animal_info, aliases=[animal_name] if animal_name else ())
+
+            result = {
+                "error": False,
+                "text": response_text,
+                "caption": caption,
+                "animal_info": animal_info,
+                "model_used": model_used,
+                "animal_key": normalize_name(animal_name or (animal_info["animal_name"] if enriched else "")),
+                "cached": False,
+                "upload_stats": upload_stats
+            }
+
+            # Only cache full answers, so a fallback fact sheet gets another chance next time
+            if enriched:
+                self.remember_result(cache_key, phash, result)
+
+            return result
+
+        except Exception as e:
+            self.metrics.error("identify", e, path="sync")
+            return _oops(e)
+
+    def start_identification(self, image, original_bytes=None):
+        """
+        Start identifying a photo on the pipeline and return its IdentifyJob
+
+        Cached photos come back as an already finished job, and a photo
+        that's already being identified for someone else shares that job.
+        """
+        if not self.ready:
+            return IdentifyJob.finished({"error": True, "message": NO_API_KEY_MESSAGE})
+
+        try:
+            cache_key = self.cache_key(image)
+        except Exception as e:
+            self.metrics.error("identify", e, path="pipeline")
+            return IdentifyJob.finished(_oops(e))
+
+        return self.single_flight.share(
+            "identify_job", cache_key,
+            lambda: self.begin_identification(image, original_bytes, cache_key),
+            lambda job: job.result
+        )
+
+    def begin_identification(self, image, original_bytes=None, cache_key=None):
+        """
+        The actual work behind start_identification: cache lookup, then the async pipeline
+        """
+        try:
+            cached, cache_key, phash = self.find_cached_result(image, cache_key)
+            if cached:
+                return IdentifyJob.finished(cached)
+            img_byte_arr, upload_stats = self._prepare(image, original_bytes)
+        except Exception as e:
+            self.metrics.error("identify", e, path="pipeline")
+            return IdentifyJob.finished(_oops(e))
+
+        def on_result(result):
+            if result.get("error"):
+                return
+            result["upload_stats"] = upload_stats
+            # Only cache full answers, so a fallback fact sheet gets another chance next time
+            if result.pop("enriched", False):
+                self.remember_result(cache_key, phash, result)
+
+        return self.pipeline.start(img_byte_arr, on_result=on_result)
+
+    # ----------------------------------
+    # Asking the Expert
+    # ----------------------------------
+    def ask(self, user_message, context=None, history=None):
+        """
+        Answer a kid's question, about the animal in context if there is one
+
+        Someone already asking the same thing? Wait for their answer instead
+        """
+        with self.metrics.span("chat", stream="no", follow_up=_flag(history)):
+            return self.single_flight.do(
+                "chat", chat_key(user_message, context, history), self.ask_chat_models, user_message, context, history
+            )
+
+    def ask_chat_models(self, user_message, context=None, history=None):
+        """
+        The actual work behind ask: the answer cache, then each chat model in turn
+
+        Follow-ups (with history) depend on the chat so far, so they skip the shared cache
+        """
+        if not self.ready:
+            return NO_API_KEY_MESSAGE
+
+        try:
+            # Asked before (by anyone)? No need to bother the AI
+            cached = self._cached_answer(user_message, context, history)
+            if cached:
+                return cached
+
+            prompt = chat_prompt(user_message, context, history)
+
+            # Try multiple chat models, skipping any known to be down
+            for chat_model in self.client.available(self.chat_models):
+                with self.metrics.span("chat_call", model=chat_model, task="answer") as span:
+                    try:
+                        response = self.client.post(
+                            chat_model,
+                            json={
+                                "inputs": prompt,
+                                "parameters": self.chat_parameters
+                            },
+                            timeout=self.timeout
+                        )
+
+                        if response.status_code == 200:
+                            # Extract only the response part (remove the prompt)
+                            text = generated_text(response.json(), prompt)
+                            if text and len(text) > 10:
+                                self._remember_answer(user_message, text, context, history)
+                                return text
+                        span.fail()
+
+                    except Exception as e:
+                        span.fail()
+                        self.metrics.error("chat_call", e, model=chat_model)
+                        continue
+
+            # Fallback response
+            self.metrics.error("chat", "every chat model failed", stream="no")
+            return CHAT_FALLBACK_MESSAGE
+
+        except Exception as e:
+            self.metrics.error("chat", e, stream="no")
+            return CHAT_RESTING_MESSAGE
+
+    def ask_stream(self, user_message, context=None, timings=None, history=None):
+        """
+        Same as ask, but yields the answer bit by bit while the model writes it
+
+        If timings (a dict) is given, it gets the model used, the seconds until
+        the first word arrived and the total seconds
+        """
+        started = time.perf_counter()
+        if timings is None:
+            timings = {}
+
+        if not self.ready:
+            yield NO_API_KEY_MESSAGE
+            return
+
+        # Asked before (by anyone)? The whole answer comes at once
+        cached = self._cached_answer(user_message, context, history)
+        if cached:
+            timings["model"] = "answer cache"
+            timings["cached"] = True
+            timings["first_token_seconds"] = timings["total_seconds"] = time.perf_counter() - started
+            yield cached
+            return
+
+        prompt = chat_prompt(user_message, context, history)
+        text = ""
+        complete = False
+
+        # Try multiple chat models until one starts talking
+        for chat_model in self.client.available(self.chat_models):
+            with self.metrics.span("chat_call", model=chat_model, task="stream") as span:
+                tokens = self.client.stream(
+                    chat_model, {"inputs": prompt, "parameters": self.chat_parameters}, timeout=self.timeout
+                )
+                try:
+                    for token in tokens:
+                        if not text:
+                            timings["model"] = chat_model
+                            timings["first_token_seconds"] = time.perf_counter() - started
+                            self.metrics.observe("chat_first_token_seconds", timings["first_token_seconds"])
+                        text += token
+                        yield token
+
+                        # Long enough? Finish the sentence and stop instead of waiting for every token
+                        if len(text) >= self.stream_stop_chars and text.rstrip().endswith((".", "!", "?")):
+                            break
+                    complete = True
+                except Exception as e:
+                    span.fail()
+                    self.metrics.error("chat_call", e, model=chat_model)
+                    # Half an answer is better than starting over with another model
+                    if not text:
+                        continue
+                finally:
+                    tokens.close()
+
+                if not text:
+                    span.fail()
+
+            if text:
+                break
+
+        if not text:
+            self.metrics.error("chat", "every chat model failed", stream="yes")
+            yield CHAT_FALLBACK_MESSAGE
+        elif complete and len(text) > 10:
+            # Only whole answers are shared; a cut-off one gets another try next time
+            self._remember_answer(user_message, text, context, history)
+
+        timings["total_seconds"] = time.perf_counter() - started
+        labels = {"stream": "yes", "follow_up": _flag(history)}
+        self.metrics.observe("chat_seconds", timings["total_seconds"], **labels)
+        self.metrics.inc("chat_total", outcome="ok" if text else "error", **labels)
+
+    def _cached_answer(self, user_message, context, history):
+        if history or self.answer_cache is None:
+            return None
+        return self.answer_cache.get(user_message, chat_cache_context(context))
+
+    def _remember_answer(self, user_message, text, context, history):
+        if not history and self.answer_cache is not None:
+            self.answer_cache.put(user_message, text, chat_cache_context(context))
+
+
+# ----------------------------------
+# Building One Without the App
+# ----------------------------------
+def build_explorer(api_key, vision_models, chat_models, base_url=HF_API_URL, cache_dir=None,
+                   rate_limiter=None, async_pipeline=True, hedge_delay=4.0, timeout=30, metrics=None, health=None,
+                   state=None, **options):
+    """
+    An AnimalExplorer wired up the way app.py does it, for scripts and benchmarks.
+
+    With a cache_dir the result, answer and fact book caches are kept there;
+    without one nothing is cached. Everything shares one Metrics (a new one
+    if none is given), found at explorer.metrics. A ModelHealth table, if
+    given, steers every call away from models it knows are down. With a
+    shared state store (shared_state.py) the result and answer caches and
+    the single-flight locks live there instead, as with several app
+    workers. Other options go to AnimalExplorer.
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    client = HFClient(api_key, base_url=base_url, rate_limiter=rate_limiter, metrics=metrics, health=health)
+    vision_stats = ModelStats()
+    vision_backend = RemoteHFBackend(
+        client, vision_models, ThreadPoolExecutor(max_workers=8, thread_name_prefix="vision"),
+        stats=vision_stats, hedge_delay=hedge_delay, timeout=timeout, metrics=metrics
+    )
+    vocabulary = load_vocabulary()
+
+    result_cache = phash_index = knowledge_base = answer_cache = None
+    # The same namespace app.py uses, so a cache_dir can be shared with the app
+    prompt_version = options.get("prompt_version", PROMPT_VERSION)
+    phash_namespace = "|".join(list(vision_models) + list(chat_models)) + f"|{prompt_version}"
+    if state is not None:
+        result_cache = SharedResultCache(state)
+        answer_cache = SharedAnswerCache(state, vocabulary=vocabulary)
+        options.setdefault("single_flight", SingleFlight(state=state, metrics=metrics))
+        options.setdefault("phash_sync_seconds", 10.0)
+    elif cache_dir:
+        result_cache = ResultCache(os.path.join(cache_dir, "results.sqlite3"))
+        answer_cache = AnswerCache(os.path.join(cache_dir, "answers.sqlite3"), vocabulary=vocabulary)
+    if result_cache is not None:
+        phash_index = PerceptualIndex()
+        for phash, key in result_cache.iter_phashes(phash_namespace):
+            phash_index.add(phash, key)
+    if cache_dir:
+        knowledge_base = AnimalKnowledgeBase(os.path.join(cache_dir, "animal_facts.sqlite3"))
+
+    pipeline = None
+    if async_pipeline:
+        pipeline = IdentifyPipeline(
+            client, vision_models, chat_models, parse=parse_animal_info,
+            vision_stats=vision_stats, chat_stats=ModelStats(), hedge_delay=hedge_delay,
+            knowledge_base=knowledge_base, vocabulary=vocabulary, timeout=timeout, metrics=metrics
+        )
+
+    return AnimalExplorer(
+        client, vision_backend, chat_models,
+        answer_models=list(vision_models) + list(chat_models),
+        result_cache=result_cache, phash_index=phash_index, phash_namespace=phash_namespace,
+        knowledge_base=knowledge_base, vocabulary=vocabulary, answer_cache=answer_cache,
+        pipeline=pipeline, timeout=timeout, metrics=metrics, **options
+    )
@@ -0,0 +1,193 @@
+import json
+import re
+
+# ----------------------------------
+# Fact Sheet Schema
+# ----------------------------------
+# Field name -> type; facts is a list of strings, everything else a string
+ANIMAL_INFO_SCHEMA = {
+    "animal_name": str,
+    "scientific_name": str,
+    "animal_type": str,
+    "habitat": str,
+    "diet": str,
+    "conservation": str,
+    "facts": list,
+    "characteristics": str
+}
+
+# Other names models use for the same fields, in JSON keys and text labels
+FIELD_ALIASES = {
+    "animal_name": ["animal name", "common name", "name"],
+    "scientific_name": ["scientific name", "science name"],
+    "animal_type": ["animal type", "type", "class"],
+    "habitat": ["where they live", "habitat", "home"],
+    "diet": ["what they eat", "diet", "food"],
+    "conservation": ["are they safe", "conservation status", "conservation", "status"],
+    "facts": ["cool facts", "fun facts", "interesting facts", "facts"],
+    "characteristics": ["what they look like", "physical description", "description", "looks"]
+}
+
+_FIELD_BY_ALIAS = {
+    re.sub(r"\W+", "_", alias): field
+    for field, aliases in FIELD_ALIASES.items()
+    for alias in aliases + [field]
+}
+
+
+def empty_animal_info():
+    return {
+        'animal_name': 'Mystery Animal',
+        'scientific_name': 'N/A',
+        'animal_type': 'N/A',
+        'habitat': 'N/A',
+        'diet': 'N/A',
+        'conservation': 'N/A',
+        'facts': [],
+        'characteristics': 'N/A'
+    }
+
+
+# ----------------------------------
+# JSON Answers
+# ----------------------------------
+_DECODER = json.JSONDecoder()
+
+
+def validate_animal_info(data):
+    """
+    Check a decoded JSON answer against ANIMAL_INFO_SCHEMA.
+
+    Keys are matched case-insensitively and through FIELD_ALIASES. Returns a
+    complete animal_info dict, or None if the answer has no usable name or a
+    field has the wrong type.
+    """
+    if not isinstance(data, dict):
+        return None
+
+    animal_info = empty_animal_info()
+    for key, value in data.items():
+        field = _FIELD_BY_ALIAS.get(re.sub(r"\W+", "_", str(key).strip().lower()))
+        if field is None or value is None:
+            continue
+
+        if ANIMAL_INFO_SCHEMA[field] is list:
+            if isinstance(value, str):
+                value = [value]
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                return None
+            animal_info[field] = [item.strip() for item in value if item.strip()]
+        else:
+            if isinstance(value, (int, float)):
+                value = str(value)
+            if not isinstance(value, str):
+                return None
+            if value.strip():
+                animal_info[field] = value.strip()
+
+    if animal_info["animal_name"] == "Mystery Animal":
+        return None
+    return animal_info
+
+
+def parse_json_fact_sheet(text):
+    """
+    Parse a JSON fact sheet, even if the model wrapped it in prose or a
+    ```json fence. Returns None if there is no valid JSON object.
+    """
+    start = text.find("{")
+    while start != -1:
+        try:
+            animal_info = validate_animal_info(_DECODER.raw_decode(text, start)[0])
+        except ValueError:
+            animal_info = None
+        if animal_info is not None:
+            return animal_info
+        start = text.find("{", start + 1)
+    return None
+
+
+# ----------------------------------
+# Plain Text Answers
+# ----------------------------------
+def _label_pattern():
+    # Longest labels first, so "Scientific Name" wins over "Name"
+    labels = sorted(
+        (alias for aliases in FIELD_ALIASES.values() for alias in aliases),
+        key=len, reverse=True
+    )
+    return "|".join(re.escape(label).replace(r"\ ", r"\s+") for label in labels)
+
+
+# Every line is exactly one of: "Label: value", a bullet / numbered item, or other text.
+# Labels must start the line, so "Scientific Name:" never counts as "Name:".
+_LINE = re.compile(
+    r"^[ \t]*(?:"
+    r"(?:[*\-•→][ \t]+)?\**(?P<label>" + _label_pattern() + r")\??\**[ \t]*:[ \t]*\**[ \t]*(?P<value>.*?)"
+    r"|(?:[*\-•→]|\d+[.)])[ \t]*(?P<bullet>.*?)"
+    r"|(?P<text>.*?)"
+    r")[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+
+_FIELD_BY_LABEL = {
+    re.sub(r"\s+", " ", alias): field
+    for field, aliases in FIELD_ALIASES.items()
+    for alias in aliases
+}
+
+
+def parse_text_fact_sheet(text):
+    """
+    Parse a "Label: value" fact sheet in one pass over the text.
+
+    Bullets (or numbered lines) under a facts label become facts; bullets
+    and plain lines under "What They Look Like" are added to characteristics.
+    """
+    animal_info = empty_animal_info()
+    section = None
+
+    for match in _LINE.finditer(text):
+        label = match.group("label")
+        if label is not None:
+            field = _FIELD_BY_LABEL[re.sub(r"\s+", " ", label.lower())]
+            value = match.group("value").rstrip("*").strip()
+            section = field if field in ("facts", "characteristics") else None
+            if field == "facts":
+                if value:
+                    animal_info["facts"].append(value)
+            elif value:
+                animal_info[field] = value
+            elif field == "characteristics":
+                animal_info[field] = ""
+            continue
+
+        line = match.group("bullet")
+        if line is None:
+            line = match.group("text")
+            if section != "characteristics":
+                continue
+        line = line.strip().strip("*").strip()
+        if not line:
+            continue
+
+        if section == "facts":
+            animal_info["facts"].append(line)
+        elif section == "characteristics":
+            current = animal_info["characteristics"]
+            animal_info["characteristics"] = f"{current} {line}".strip() if current != "N/A" else line
+
+    if not animal_info["characteristics"]:
+        animal_info["characteristics"] = "N/A"
+    return animal_info
+
+
+# ----------------------------------
+# Either Kind
+# ----------------------------------
+def parse_animal_info(response_text):
+    """
+    Pull the animal fact sheet fields out of the AI's answer: JSON first,
+    then the "Label: value" text format
+    """
+    return parse_json_fact_sheet(response_text) or parse_text_fact_sheet(response_text)
@@ -0,0 +1,323 @@
+import datetime
+import io
+import threading
+import time
+from .metrics import Metrics
+from .rate_limit import RateLimited, caller
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# What a probe sends: a tiny picture, or a one-token chat
+PROBE_IMAGE_SIZE = (32, 32)
+PROBE_CHAT = {"inputs": "Hi", "parameters": {"max_new_tokens": 1}, "options": {"wait_for_model": False}}
+# Seconds a model is assumed to need when it says it's loading without saying how long
+DEFAULT_LOADING_SECONDS = 20.0
+
+_probe_image = None
+
+
+def probe_image():
+    """
+    A tiny JPEG for probing the captioning models, made once.
+    """
+    global _probe_image
+    if _probe_image is None:
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new("RGB", PROBE_IMAGE_SIZE, (200, 120, 60)).save(buffer, format="JPEG")
+        _probe_image = buffer.getvalue()
+    return _probe_image
+
+
+# ----------------------------------
+# Class Hours
+# ----------------------------------
+def _parse_days(text):
+    text = text.lower()
+    if text in ("daily", "every day"):
+        return set(range(7))
+    first, _, last = text.partition("-")
+    start = DAYS.index(first[:3])
+    end = DAYS.index(last[:3]) if last else start
+    return {day % 7 for day in range(start, end + 1 if end >= start else end + 8)}
+
+
+def _parse_time(text):
+    hours, minutes = text.split(":")
+    return datetime.time(int(hours), int(minutes))
+
+
+class ClassHours:
+    """
+    When kids are using the app, e.g. "Mon-Fri 08:00-15:30; Sat 09:00-12:00".
+
+    Times are the server's local time. An empty spec means always. The
+    lead_minutes before a window opens already count as inside it, so the
+    models are warm by the first lesson.
+    """
+
+    def __init__(self, spec="", lead_minutes=10):
+        self.spec = spec
+        self.lead = datetime.timedelta(minutes=lead_minutes)
+        self.windows = []
+        for part in spec.split(";"):
+            if not part.strip():
+                continue
+            try:
+                days, hours = part.split()
+                start, end = hours.split("-")
+                self.windows.append((_parse_days(days), _parse_time(start), _parse_time(end)))
+            except ValueError:
+                raise ValueError(f"Can't read class hours {part.strip()!r}, expected e.g. 'Mon-Fri 08:00-15:30'")
+
+    def active(self, when=None):
+        if not self.windows:
+            return True
+        when = when or datetime.datetime.now()
+        for moment in (when, when + self.lead):
+            for days, start, end in self.windows:
+                if moment.weekday() in days and start <= moment.time() < end:
+                    return True
+        return False
+
+
+# ----------------------------------
+# Health Table
+# ----------------------------------
+class ModelHealth:
+    """
+    The live health of every model: "unknown", "up", "loading" or "down".
+
+    Fed with the outcome of every call (HFClient.note_attempt), both health
+    probes and real ones. A 200 means up; a 503 means loading, for as long
+    as the API estimated; failure_threshold timeouts or errors in a row mean
+    down until a call works again. 429s say nothing about the model itself
+    and are ignored. Latency is a moving average of successful calls.
+    """
+
+    def __init__(self, failure_threshold=2, alpha=0.3):
+        self.failure_threshold = failure_threshold
+        self.alpha = alpha
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, model):
+        entry = self._models.get(model)
+        if entry is None:
+            entry = self._models[model] = {
+                "state": "unknown", "latency": None, "failures": 0, "last_status": None,
+                "checked": None, "last_ok": None, "loading_until": None
+            }
+        return entry
+
+    def observe(self, model, status, latency=None, eta=None):
+        if status in ("429", "cancelled", "circuit_open"):
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._entry(model)
+            entry["checked"] = now
+            entry["last_status"] = status
+            if status == "200":
+                entry["state"] = "up"
+                entry["failures"] = 0
+                entry["last_ok"] = now
+                entry["loading_until"] = None
+                if latency is not None:
+                    previous = entry["latency"]
+                    entry["latency"] = latency if previous is None else previous + self.alpha * (latency - previous)
+            elif status == "503":
+                entry["state"] = "loading"
+                entry["loading_until"] = now + (eta if eta is not None else DEFAULT_LOADING_SECONDS)
+            else:
+                entry["failures"] += 1
+                if entry["failures"] >= self.failure_threshold:
+                    entry["state"] = "down"
+
+    def _state(self, entry, now):
+        if entry["state"] == "loading" and now >= entry["loading_until"]:
+            # Should have loaded by now; worth a try again
+            return "unknown"
+        return entry["state"]
+
+    def state(self, model):
+        with self._lock:
+            entry = self._models.get(model)
+            return self._state(entry, time.time()) if entry else "unknown"
+
+    def get(self, model):
+        """
+        A copy of model's entry, with its current state.
+        """
+        with self._lock:
+            entry = dict(self._entry(model))
+            entry["state"] = self._state(entry, time.time())
+            return entry
+
+    def usable(self, models):
+        """
+        The models not known to be down or loading, in the same order; all of
+        them if that would leave none.
+        """
+        up = [model for model in models if self.state(model) not in ("down", "loading")]
+        return up or list(models)
+
+    def snapshot(self, models=None):
+        """
+        [{model, state, latency, failures, last_status, checked, last_ok}] for the admin page.
+        """
+        with self._lock:
+            now = time.time()
+            names = list(models) if models is not None else sorted(self._models)
+            rows = []
+            for model in names:
+                entry = dict(self._entry(model))
+                entry["state"] = self._state(entry, now)
+                entry.pop("loading_until")
+                rows.append(dict(entry, model=model))
+            return rows
+
+
+# ----------------------------------
+# Health Probes
+# ----------------------------------
+class HealthProber:
+    """
+    Background thread that probes every model with a tiny request.
+
+    The probes keep the models loaded during class hours and keep the
+    ModelHealth table fresh, so identify and chat calls skip models that are
+    down instead of finding out the slow way. How often a model is probed
+    adapts to what's going on:
+
+    - during class hours every warm_interval seconds, but a model that a
+      real call reached in that time doesn't need one;
+    - outside them every idle_interval seconds (never, if it's None);
+    - a model that's down is retried after retry_interval seconds, doubling
+      up to idle_interval, and a loading one once it should have loaded;
+    - all of that is stretched quota_stretch times while less than
+      quota_reserve of the hourly quota is left.
+
+    Probes wait for the rate limiter behind every kid and batch, and are
+    skipped rather than waiting more than max_wait seconds.
+    """
+
+    def __init__(self, client, vision_models, chat_models, health, class_hours=None,
+                 warm_interval=240.0, idle_interval=1800.0, retry_interval=30.0,
+                 quota_reserve=0.2, quota_stretch=4, timeout=10, max_wait=5.0, metrics=None):
+        self.client = client
+        self.models = {model: "vision" for model in vision_models}
+        self.models.update({model: "chat" for model in chat_models})
+        self.health = health
+        self.class_hours = class_hours or ClassHours()
+        self.warm_interval = warm_interval
+        self.idle_interval = idle_interval
+        self.retry_interval = retry_interval
+        self.quota_reserve = quota_reserve
+        self.quota_stretch = quota_stretch
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._next = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def interval(self, model):
+        """
+        Seconds between probes of model right now, or None for no probes.
+        """
+        entry = self.health.get(model)
+        if entry["state"] == "down":
+            extra = entry["failures"] - self.health.failure_threshold
+            interval = self.retry_interval * 2 ** max(extra, 0)
+            if self.idle_interval is not None:
+                interval = min(interval, self.idle_interval)
+        elif entry["state"] == "loading":
+            interval = max(entry["loading_until"] - entry["checked"], 1.0)
+        elif self.class_hours.active():
+            interval = self.warm_interval
+        else:
+            interval = self.idle_interval
+        if interval is None:
+            return None
+
+        rate_limiter = self.client.rate_limiter
+        if rate_limiter is not None and rate_limiter.quota_left() < self.quota_reserve:
+            interval *= self.quota_stretch
+        return interval
+
+    def due(self, model):
+        """
+        When model should next be probed (a time.time()), or None if it shouldn't.
+        """
+        interval = self.interval(model)
+        if interval is None:
+            return None
+        checked = self.health.get(model)["checked"]
+        due = checked + interval if checked is not None else 0.0
+        return max(due, self._next.get(model, 0.0))
+
+    def probe(self, model):
+        """
+        Probe one model and return its status ("200", "503", "skipped"...).
+        """
+        payload = {"data": probe_image()} if self.models[model] == "vision" else {"json": PROBE_CHAT}
+        try:
+            with caller("health", "background"):
+                status = self.client.probe(model, timeout=self.timeout, max_wait=self.max_wait, **payload)
+        except RateLimited:
+            # Busy with real work; come back later instead of adding to the queue
+            status = "skipped"
+            self._next[model] = time.time() + self.retry_interval
+        self.metrics.inc("health_probes_total", model=model, status=status)
+        return status
+
+    def run_once(self):
+        """
+        Probe every model that's due and return {model: status}.
+        """
+        probed = {}
+        for model in self.models:
+            if self._stop.is_set():
+                break
+            due = self.due(model)
+            if due is not None and time.time() >= due:
+                probed[model] = self.probe(model)
+        return probed
+
+    def status(self):
+        """
+        The health table for this prober's models, with their kind and
+        seconds until the next probe (None if none is planned).
+        """
+        now = time.time()
+        rows = self.health.snapshot(self.models)
+        for row in rows:
+            due = self.due(row["model"])
+            row["kind"] = self.models[row["model"]]
+            row["next_probe"] = max(due - now, 0.0) if due is not None else None
+        return rows
+
+    # ----------------------------------
+    # Background Thread
+    # ----------------------------------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.metrics.error("health_probe", e)
+            dues = [due for due in map(self.due, self.models) if due is not None]
+            # Wake up at least every minute, so class hours starting are noticed
+            sleep = min(dues) - time.time() if dues else 60.0
+            self._stop.wait(min(max(sleep, 1.0), 60.0))
@@ -0,0 +1,123 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# ----------------------------------
+# Per-Model Latency and Success Stats
+# ----------------------------------
+class ModelStats:
+    """
+    Running latency and success rate for each model.
+
+    Both are exponentially weighted moving averages, so a model that was slow
+    or broken an hour ago can win its place back. Models that were never tried
+    are assumed to take prior_latency seconds and to work.
+    """
+
+    def __init__(self, alpha=0.3, prior_latency=5.0):
+        self.alpha = alpha
+        self.prior_latency = prior_latency
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, latency, ok):
+        with self._lock:
+            stats = self._stats.setdefault(model, {
+                "latency": latency if ok else self.prior_latency,
+                "success_rate": 1.0,
+                "calls": 0,
+                "failures": 0
+            })
+            stats["calls"] += 1
+            if ok:
+                stats["latency"] += self.alpha * (latency - stats["latency"])
+            else:
+                stats["failures"] += 1
+            stats["success_rate"] += self.alpha * ((1.0 if ok else 0.0) - stats["success_rate"])
+
+    def score(self, model):
+        """
+        Expected seconds until a good answer; lower is better.
+        """
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                return self.prior_latency
+            return stats["latency"] / max(stats["success_rate"], 0.05)
+
+    def ordered(self, models):
+        """
+        Return models sorted fastest healthy first, keeping the configured
+        order for ties (so the primary model stays first until measured).
+        """
+        return sorted(models, key=self.score)
+
+    def snapshot(self):
+        with self._lock:
+            return {model: dict(stats) for model, stats in self._stats.items()}
+
+
+# ----------------------------------
+# Hedged Requests
+# ----------------------------------
+def _timed_call(call, model, stats):
+    started = time.monotonic()
+    result = None
+    try:
+        result = call(model)
+        return result
+    finally:
+        if stats is not None:
+            stats.record(model, time.monotonic() - started, bool(result))
+
+
+def hedged_call(models, call, executor, hedge_delay=None, stats=None):
+    """
+    Ask several models for the same thing and keep the first good answer.
+
+    call(model) is started on the first model straight away. The next model
+    is started when hedge_delay seconds pass without an answer, or as soon as
+    a running call fails; with hedge_delay=None models are only tried after a
+    failure, like a plain fallback loop. Empty results and exceptions count
+    as failures. Calls that haven't started yet are cancelled once a winner
+    is found; calls already in flight finish in the background and still
+    update stats.
+
+    Returns (model, result), or (None, None) if every model failed.
+    """
+    waiting = list(models)
+    running = {}
+
+    def launch():
+        model = waiting.pop(0)
+        # copy_context() so the call keeps the caller's context (e.g. its rate limit tag)
+        running[executor.submit(contextvars.copy_context().run, _timed_call, call, model, stats)] = model
+
+    if waiting:
+        launch()
+
+    while running:
+        timeout = hedge_delay if waiting else None
+        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            launch()
+            continue
+
+        for future in done:
+            model = running.pop(future)
+            try:
+                result = future.result()
+            except Exception:
+                result = None
+
+            if result:
+                for other in running:
+                    other.cancel()
+                return model, result
+
+            if waiting:
+                launch()
+
+    return None, None
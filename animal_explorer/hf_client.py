@@ -0,0 +1,362 @@
+import json
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+HF_API_URL = "https://api-inference.huggingface.co/models"
+
+# Status codes worth waiting for: rate limited, model loading, overloaded
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ModelUnavailable(Exception):
+    """
+    Raised instead of calling a model whose circuit breaker is open.
+    """
+
+
+# ----------------------------------
+# Circuit Breaker
+# ----------------------------------
+class CircuitBreaker:
+    """
+    Stops calling a model after failure_threshold failures in a row.
+
+    Once open, calls are refused for reset_timeout seconds. After that a
+    single trial call is let through (half-open): success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        """
+        Give up a trial call without counting it either way (e.g. cancelled).
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+# ----------------------------------
+# Shared Hugging Face Client
+# ----------------------------------
+class HFClient:
+    """
+    Pooled, keep-alive client for the Hugging Face inference API.
+
+    All calls share one requests.Session, so connections (and their TLS
+    handshakes) are reused. Connection errors, 429s and 5xx responses are
+    retried with jittered exponential backoff; when the API says how long to
+    wait (Retry-After, or estimated_time while a model is loading) that hint
+    is used instead, as long as it's under max_wait. Every model has its own
+    circuit breaker, and an optional ModelRateLimiter paces every attempt.
+    With a Metrics object every attempt is counted by model and status
+    ("hf_responses_total"), along with time spent waiting for the rate limiter.
+    With a ModelHealth table every attempt also updates the model's health,
+    and available() leaves out models the table says are down.
+    """
+
+    def __init__(self, api_key, base_url=HF_API_URL, pool_size=16, max_retries=2,
+                 backoff_base=0.5, backoff_cap=8.0, max_wait=20.0,
+                 failure_threshold=3, reset_timeout=60.0, rate_limiter=None, metrics=None, health=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.health = health
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model):
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[model]
+
+    def available(self, models):
+        """
+        The models whose circuit isn't open and that aren't known to be down
+        or loading, in the same order. If the health table rules out every
+        one of them, they're all still tried.
+        """
+        models = [model for model in models if self.breaker(model).state != "open"]
+        if self.health is not None:
+            models = self.health.usable(models)
+        return models
+
+    def model_url(self, model):
+        return f"{self.base_url}/{model}"
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def retry_hint(self, response):
+        """
+        Seconds the API asked us to wait, or None.
+        """
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        try:
+            estimated_time = response.json().get("estimated_time")
+        except (ValueError, AttributeError):
+            return None
+        return float(estimated_time) if estimated_time is not None else None
+
+    def note_attempt(self, model, status, waited=None, latency=None, eta=None):
+        """
+        Count one attempt at calling model ("timeout", an HTTP status...)
+
+        latency is how long the model took to answer, and eta how long it
+        said it still needs to load (on a 503).
+        """
+        if self.health is not None:
+            self.health.observe(model, status, latency=latency, eta=eta)
+        if self.metrics is None:
+            return
+        self.metrics.inc("hf_responses_total", model=model, status=status)
+        if waited is not None:
+            self.metrics.observe("rate_limit_wait_seconds", waited, model=model)
+
+    def _note_rate_limit(self, response, attempt):
+        """
+        On a 429, hold back every caller sharing the rate limiter, not just
+        this one. Returns True if the limiter will do the waiting.
+        """
+        if response.status_code != 429 or self.rate_limiter is None:
+            return False
+        wait = self.retry_hint(response)
+        self.rate_limiter.pause(wait if wait is not None else self.backoff(attempt))
+        return True
+
+    # ----------------------------------
+    # Retry Decisions
+    # ----------------------------------
+    # post() and async_pipeline.AsyncHFClient.post() make the same calls in
+    # the same order, so both agree on what's retried and how a model's
+    # circuit breaker hears about it:
+    #
+    #     breaker = start_call(model)
+    #     for attempt ...:
+    #         timeout              -> call_timed_out(), raise
+    #         connection error     -> wait = connection_failed(); raise if None, else sleep and retry
+    #         response             -> wait = call_answered(); stop if None, else sleep and retry
+    #     end_call(breaker, response), or breaker.release() if abandoned
+
+    def start_call(self, model):
+        """
+        The breaker for a call to model, or ModelUnavailable if its circuit is open.
+        """
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            self.note_attempt(model, "circuit_open")
+            raise ModelUnavailable(model)
+        return breaker
+
+    def call_timed_out(self, model, breaker, waited=None):
+        """
+        Count a timed-out attempt. Timeouts are not retried: they already
+        used up the whole time budget.
+        """
+        self.note_attempt(model, "timeout", waited)
+        breaker.record_failure()
+
+    def connection_failed(self, model, breaker, attempt, waited=None):
+        """
+        Count an attempt that couldn't connect. Returns the seconds to back
+        off before trying again, or None if that was the last attempt.
+        """
+        self.note_attempt(model, "connection_error", waited)
+        if attempt == self.max_retries:
+            breaker.record_failure()
+            return None
+        return self.backoff(attempt)
+
+    def call_answered(self, model, response, attempt, waited=None, latency=None):
+        """
+        Count a response and decide what's next: None to keep it, or the
+        seconds to wait before trying again (0 when the rate limiter will
+        hold the next attempt back itself, after a 429).
+        """
+        eta = self.retry_hint(response) if response.status_code == 503 else None
+        self.note_attempt(model, str(response.status_code), waited, latency=latency, eta=eta)
+
+        if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+            self._note_rate_limit(response, attempt)
+            return None
+
+        wait = self.retry_hint(response)
+        if wait is None:
+            wait = self.backoff(attempt)
+        elif wait > self.max_wait:
+            # Too long to keep a kid waiting; let the next model have a go
+            self._note_rate_limit(response, attempt)
+            return None
+        return 0.0 if self._note_rate_limit(response, attempt) else wait
+
+    def end_call(self, breaker, response):
+        """
+        Tell the breaker how the call with this final response went.
+        """
+        if response.status_code == 200:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+    def post(self, model, timeout=30, **kwargs):
+        """
+        POST to a model (data= for images, json= for text) with retries.
+
+        Returns the final response, whatever its status. Raises
+        ModelUnavailable if the model's circuit is open, or the last
+        connection error if every attempt failed to connect. Timeouts are not
+        retried: they already used up the whole time budget.
+        """
+        breaker = self.start_call(model)
+        url = self.model_url(model)
+        try:
+            for attempt in range(self.max_retries + 1):
+                waited = None
+                if self.rate_limiter is not None:
+                    waited = self.rate_limiter.acquire(model)
+                started = time.monotonic()
+                try:
+                    response = self.session.post(url, timeout=timeout, **kwargs)
+                except requests.Timeout:
+                    self.call_timed_out(model, breaker, waited)
+                    raise
+                except requests.ConnectionError:
+                    wait = self.connection_failed(model, breaker, attempt, waited)
+                    if wait is None:
+                        raise
+                    time.sleep(wait)
+                    continue
+
+                wait = self.call_answered(model, response, attempt, waited, latency=time.monotonic() - started)
+                if wait is None:
+                    break
+                response.close()
+                time.sleep(wait)
+        except BaseException:
+            # Anything not counted above (e.g. the shared rate limiter failing) says
+            # nothing about the model, but mustn't keep its trial call forever
+            breaker.release()
+            raise
+
+        self.end_call(breaker, response)
+        return response
+
+    def probe(self, model, timeout=10, max_wait=5.0, **kwargs):
+        """
+        Call a model once to see how it's doing, for health probes.
+
+        No retries, and the call goes through even when the model's circuit
+        is open, since that's how a model is found to be back (a 200 closes
+        the circuit). It waits for the rate limiter as a "background" call
+        and raises RateLimited rather than wait longer than max_wait.
+        Returns the status ("200", "503", "timeout"...).
+        """
+        waited = None
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire(model, priority="background", max_wait=max_wait)
+        started = time.monotonic()
+        try:
+            response = self.session.post(self.model_url(model), timeout=timeout, **kwargs)
+        except requests.Timeout:
+            status = "timeout"
+        except requests.ConnectionError:
+            status = "connection_error"
+        else:
+            status = str(response.status_code)
+            eta = self.retry_hint(response) if response.status_code == 503 else None
+            self._note_rate_limit(response, 0)
+            response.close()
+            self.note_attempt(model, status, waited, latency=time.monotonic() - started, eta=eta)
+            if status == "200":
+                self.breaker(model).record_success()
+            return status
+        self.note_attempt(model, status, waited)
+        return status
+
+    def stream(self, model, payload, timeout=30):
+        """
+        Stream generated tokens from a text model as they are produced.
+
+        Sends payload with "stream": true and yields each token's text from
+        the server-sent events. Raises requests.HTTPError if the model
+        doesn't answer with 200. Closing the generator early closes the
+        connection, which stops the server generating.
+        """
+        response = self.post(model, json=dict(payload, stream=True), timeout=timeout, stream=True)
+        try:
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if event.get("error"):
+                    raise requests.HTTPError(event["error"], response=response)
+                token = event.get("token") or {}
+                if token.get("text") and not token.get("special"):
+                    yield token["text"]
+        finally:
+            response.close()
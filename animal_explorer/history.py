@@ -0,0 +1,275 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from .vocabulary import normalize_name
+
+# ----------------------------------
+# Thumbnails
+# ----------------------------------
+def make_thumbnail(image, size=96, quality=70):
+    """
+    A small square-ish JPEG of a photo for the history page, a few KB at most.
+    """
+    # Only needed here, so counting someone's animals doesn't wait for PIL to load
+    from PIL import Image
+
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+# ----------------------------------
+# Detection History
+# ----------------------------------
+class DetectionHistory:
+    """
+    Every animal a user has found, stored in SQLite so it survives refreshes.
+
+    Rows are indexed by user and time (for paging), user and animal (for
+    filtering and counts) and session. Pages and counts are read straight
+    from SQL, so a long history costs nothing until it's looked at, and only
+    the thumbnails on the current page are loaded. One instance can be
+    shared between sessions (threads).
+    """
+
+    def __init__(self, path, thumbnail_size=96):
+        self.path = path
+        self.thumbnail_size = thumbnail_size
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS detections (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                created REAL NOT NULL,
+                animal_key TEXT NOT NULL,
+                animal_name TEXT NOT NULL,
+                animal_type TEXT NOT NULL,
+                scientific_name TEXT NOT NULL,
+                caption TEXT,
+                source TEXT NOT NULL,
+                thumbnail BLOB
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS detections_user_time ON detections (user_id, created)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS detections_user_animal ON detections (user_id, animal_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS detections_session ON detections (session_id)")
+        self._conn.commit()
+
+    def add(self, user_id, session_id, result, image=None, source="single", thumbnail=None, created=None):
+        """
+        Record a finished identification (the dict from identify_animal_with_hf)
+        and return its id. thumbnail is ready-made image bytes; otherwise
+        image, if given, is shrunk to one. created defaults to now.
+        """
+        info = result["animal_info"]
+        if thumbnail is None and image is not None:
+            thumbnail = make_thumbnail(image, self.thumbnail_size)
+        animal_key = result.get("animal_key") or normalize_name(info.get("animal_name", ""))
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO detections (user_id, session_id, created, animal_key, animal_name, animal_type, "
+                "scientific_name, caption, source, thumbnail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_id, session_id, created or time.time(), animal_key,
+                    info.get("animal_name", "Mystery Animal"), info.get("animal_type", "N/A"),
+                    info.get("scientific_name", "N/A"), result.get("caption"), source, thumbnail
+                )
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def count(self, user_id, animal_key=None):
+        with self._lock:
+            if animal_key is None:
+                return self._conn.execute(
+                    "SELECT COUNT(*) FROM detections WHERE user_id = ?", (user_id,)
+                ).fetchone()[0]
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM detections WHERE user_id = ? AND animal_key = ?", (user_id, animal_key)
+            ).fetchone()[0]
+
+    def summary(self, user_id, top=10):
+        """
+        Totals for a user: detections, different animals, the most found
+        animals as (key, name, count) and counts per animal type.
+        """
+        with self._lock:
+            total, different = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT animal_key) FROM detections WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            animals = self._conn.execute("""
+                SELECT animal_key, MAX(animal_name), COUNT(*) AS found FROM detections
+                WHERE user_id = ? GROUP BY animal_key ORDER BY found DESC, MAX(created) DESC LIMIT ?
+            """, (user_id, top)).fetchall()
+            types = self._conn.execute("""
+                SELECT animal_type, COUNT(*) AS found FROM detections
+                WHERE user_id = ? GROUP BY animal_type ORDER BY found DESC
+            """, (user_id,)).fetchall()
+        return {"total": total, "different": different, "animals": animals, "types": types}
+
+    def page(self, user_id, page=0, per_page=12, animal_key=None):
+        """
+        One page of a user's detections, newest first, as dicts with their thumbnails.
+        """
+        query = (
+            "SELECT id, created, animal_name, animal_type, scientific_name, caption, source, thumbnail "
+            "FROM detections WHERE user_id = ?"
+        )
+        params = [user_id]
+        if animal_key is not None:
+            query += " AND animal_key = ?"
+            params.append(animal_key)
+        query += " ORDER BY created DESC LIMIT ? OFFSET ?"
+        params += [per_page, page * per_page]
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        columns = ("id", "created", "animal_name", "animal_type", "scientific_name", "caption", "source", "thumbnail")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def clear(self, user_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM detections WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+
+
+# ----------------------------------
+# Shared Detection History
+# ----------------------------------
+class SharedDetectionHistory:
+    """
+    DetectionHistory on a shared state store (shared_state.py), for several
+    app workers to share.
+
+    Each detection is a hash under "<prefix>:item:<id>" holding its details
+    and thumbnail. Per user, sorted sets of detection ids by time (one for
+    everything, one per animal) give the pages and counts, and hashes keep
+    the counts per animal and per type for the summary, so nothing needs
+    reading every detection.
+    """
+
+    def __init__(self, state, thumbnail_size=96, prefix="history"):
+        self.state = state
+        self.thumbnail_size = thumbnail_size
+        self.prefix = prefix
+
+    def _user(self, user_id, part=None):
+        # Braces keep a user's keys apart from another's whatever the id, and together on a Redis cluster
+        return f"{self.prefix}:user:{{{user_id}}}" + (f":{part}" if part else "")
+
+    def add(self, user_id, session_id, result, image=None, source="single", thumbnail=None, created=None):
+        """
+        Record a finished identification and return its id, like DetectionHistory.add().
+        """
+        info = result["animal_info"]
+        if thumbnail is None and image is not None:
+            thumbnail = make_thumbnail(image, self.thumbnail_size)
+        animal_key = result.get("animal_key") or normalize_name(info.get("animal_name", ""))
+        animal_name = info.get("animal_name", "Mystery Animal")
+        animal_type = info.get("animal_type", "N/A")
+        created = created or time.time()
+
+        detection_id = self.state.incr(f"{self.prefix}:ids")
+        details = {
+            "session_id": session_id, "created": created, "animal_name": animal_name, "animal_type": animal_type,
+            "scientific_name": info.get("scientific_name", "N/A"), "caption": result.get("caption"), "source": source
+        }
+        self.state.hset(
+            f"{self.prefix}:item:{detection_id}",
+            mapping={"details": json.dumps(details), "thumbnail": thumbnail or b""}
+        )
+        self.state.zadd(self._user(user_id), {detection_id: created})
+        self.state.zadd(self._user(user_id, f"animal:{animal_key}"), {detection_id: created})
+        self.state.hincrby(self._user(user_id, "animals"), animal_key)
+        self.state.hincrby(self._user(user_id, "types"), animal_type)
+        self.state.hset(self._user(user_id, "names"), animal_key, json.dumps([animal_name, created]))
+        return detection_id
+
+    def count(self, user_id, animal_key=None):
+        if animal_key is None:
+            return self.state.zcard(self._user(user_id))
+        return self.state.zcard(self._user(user_id, f"animal:{animal_key}"))
+
+    def summary(self, user_id, top=10):
+        """
+        Totals for a user: detections, different animals, the most found
+        animals as (key, name, count) and counts per animal type.
+        """
+        def read(part, convert):
+            items = self.state.hgetall(self._user(user_id, part)).items()
+            return {key.decode(): convert(value) for key, value in items}
+
+        counts = read("animals", int)
+        # Most found first, then the most recently found
+        names = read("names", json.loads)
+        found = sorted(counts, key=lambda key: (counts[key], names.get(key, ["", 0])[1]), reverse=True)
+        types = sorted(read("types", int).items(), key=lambda item: item[1], reverse=True)
+        return {
+            "total": self.state.zcard(self._user(user_id)),
+            "different": len(counts),
+            "animals": [(key, names.get(key, [key])[0], counts[key]) for key in found[:top]],
+            "types": types
+        }
+
+    def page(self, user_id, page=0, per_page=12, animal_key=None):
+        """
+        One page of a user's detections, newest first, as dicts with their thumbnails.
+        """
+        timeline = self._user(user_id) if animal_key is None else self._user(user_id, f"animal:{animal_key}")
+        start = page * per_page
+        rows = []
+        for member in self.state.zrange(timeline, start, start + per_page - 1, desc=True):
+            item = self.state.hgetall(f"{self.prefix}:item:{member.decode()}")
+            if not item:
+                continue
+            details = json.loads(item[b"details"])
+            rows.append({
+                "id": int(member), "created": details["created"], "animal_name": details["animal_name"],
+                "animal_type": details["animal_type"], "scientific_name": details["scientific_name"],
+                "caption": details["caption"], "source": details["source"], "thumbnail": item[b"thumbnail"] or None
+            })
+        return rows
+
+    def clear(self, user_id):
+        ids = self.state.zrange(self._user(user_id), 0, -1)
+        animal_keys = self.state.hkeys(self._user(user_id, "animals"))
+        animals = [self._user(user_id, f"animal:{key.decode()}") for key in animal_keys]
+        self.state.delete(
+            *[f"{self.prefix}:item:{member.decode()}" for member in ids], *animals, self._user(user_id),
+            self._user(user_id, "animals"), self._user(user_id, "types"), self._user(user_id, "names")
+        )
+
+
+def copy_history(path, history):
+    """
+    Add every detection in the DetectionHistory file at path to history
+    (e.g. a SharedDetectionHistory), keeping their times. Returns how many.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT user_id, session_id, created, animal_key, animal_name, animal_type, scientific_name, caption, "
+            "source, thumbnail FROM detections ORDER BY created"
+        ).fetchall()
+    finally:
+        conn.close()
+    for user_id, session_id, created, animal_key, name, animal_type, scientific, caption, source, thumbnail in rows:
+        result = {
+            "animal_key": animal_key, "caption": caption,
+            "animal_info": {"animal_name": name, "animal_type": animal_type, "scientific_name": scientific}
+        }
+        history.add(user_id, session_id, result, source=source, thumbnail=thumbnail, created=created)
+    return len(rows)
@@ -0,0 +1,273 @@
+import contextlib
+import hashlib
+import io
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from PIL import Image, ImageOps
+
+# ----------------------------------
+# Content Hashes
+# ----------------------------------
+def content_hash(data):
+    """
+    The name a photo is stored under: a hash of the uploaded file's bytes
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+# ----------------------------------
+# Content-Addressed Image Store
+# ----------------------------------
+class ImageStore:
+    """
+    Uploaded photos on local disk, stored once per content hash.
+
+    Each photo is kept as the original file plus WebP thumbnails at every
+    size in `sizes`, all made when the photo is first stored, so showing a
+    photo again never needs the original. Files live under
+    root/<first two hash characters>/ and are read through mmap. A small
+    SQLite index tracks sizes and last use, and once the store is over
+    max_bytes the least recently used photos are deleted.
+
+    Decoded originals are kept in memory (the last max_decoded of them), so
+    a photo is decoded at most once while it's in use, however many reruns
+    or batch rows ask for it. One instance can be shared between sessions
+    (threads); treat the images it hands out as read-only.
+    """
+
+    def __init__(self, root, sizes=(96, 256, 768), max_bytes=500 * 1024 * 1024, quality=80, max_decoded=8):
+        self.root = root
+        self.sizes = tuple(sorted(sizes))
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.max_decoded = max_decoded
+        self.decodes = 0
+        self.decoded_hits = 0
+        self.evicted = 0
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per hash being stored or decoded, so two sessions with
+        # the same photo do the work once
+        self._hash_locks = {}
+
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                bytes INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)")
+        self._conn.commit()
+
+    # ----------------------------------
+    # Paths
+    # ----------------------------------
+    def _path(self, digest, size=None):
+        name = digest if size is None else f"{digest}.{size}.webp"
+        return os.path.join(self.root, digest[:2], name)
+
+    def _size_for(self, size):
+        """
+        The smallest stored thumbnail at least `size` pixels, else the biggest one
+        """
+        for stored in self.sizes:
+            if stored >= size:
+                return stored
+        return self.sizes[-1]
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+        return len(data)
+
+    @contextlib.contextmanager
+    def _hash_lock(self, digest):
+        with self._lock:
+            lock = self._hash_locks.setdefault(digest, [threading.Lock(), 0])
+            lock[1] += 1
+        try:
+            with lock[0]:
+                yield
+        finally:
+            with self._lock:
+                lock[1] -= 1
+                if not lock[1]:
+                    del self._hash_locks[digest]
+
+    # ----------------------------------
+    # Storing
+    # ----------------------------------
+    def put(self, data, digest=None):
+        """
+        Store a photo's file bytes and return its content hash.
+
+        Storing a photo that's already here only marks it as used. Raises
+        PIL's UnidentifiedImageError if data isn't an image.
+        """
+        digest = digest or content_hash(data)
+        with self._hash_lock(digest):
+            if self.has(digest):
+                self._touch(digest)
+                return digest
+
+            image = self._remember(digest, self._decode(data))
+            total = self._write(self._path(digest), data)
+            thumbnail = ImageOps.exif_transpose(image)
+            if thumbnail.mode not in ("RGB", "RGBA"):
+                thumbnail = thumbnail.convert("RGBA" if thumbnail.has_transparency_data else "RGB")
+            # Biggest first, each one shrunk from the last
+            for size in reversed(self.sizes):
+                thumbnail = thumbnail.copy()
+                thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                thumbnail.save(buffer, format="WEBP", quality=self.quality, method=4)
+                total += self._write(self._path(digest, size), buffer.getvalue())
+
+            now = time.time()
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                    (digest, total, image.size[0], image.size[1], now, now)
+                )
+                self._conn.commit()
+        self._evict(keep=digest)
+        return digest
+
+    def has(self, digest):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone() is not None
+
+    def _touch(self, digest):
+        # Only write when it changes the eviction order meaningfully
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET accessed = ? WHERE hash = ? AND accessed < ?", (now, digest, now - 60))
+            self._conn.commit()
+
+    # ----------------------------------
+    # Reading
+    # ----------------------------------
+    @contextlib.contextmanager
+    def open(self, digest, size=None):
+        """
+        Memory-map a stored file (the original, or the thumbnail for size).
+
+        Yields an mmap that works as bytes or as a file, or None if the
+        photo isn't stored (e.g. it was evicted).
+        """
+        path = self._path(digest, None if size is None else self._size_for(size))
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            yield None
+            return
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+    def thumbnail(self, digest, size):
+        """
+        WebP bytes of the stored thumbnail closest to size, or None.
+        """
+        with self.open(digest, size) as mapped:
+            if mapped is None:
+                return None
+            data = mapped[:]
+        self._touch(digest)
+        return data
+
+    def image(self, digest):
+        """
+        The decoded original, decoded at most once while it's kept in memory.
+
+        Returns None if the photo isn't stored.
+        """
+        with self._lock:
+            image = self._decoded.get(digest)
+            if image is not None:
+                self._decoded.move_to_end(digest)
+                self.decoded_hits += 1
+                return image
+
+        with self._hash_lock(digest):
+            with self._lock:
+                image = self._decoded.get(digest)
+                if image is not None:
+                    self.decoded_hits += 1
+                    return image
+            with self.open(digest) as mapped:
+                if mapped is None:
+                    return None
+                image = self._remember(digest, self._decode(mapped))
+        self._touch(digest)
+        return image
+
+    def _decode(self, source):
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        image.load()
+        with self._lock:
+            self.decodes += 1
+        return image
+
+    def _remember(self, digest, image):
+        with self._lock:
+            self._decoded[digest] = image
+            self._decoded.move_to_end(digest)
+            while len(self._decoded) > self.max_decoded:
+                self._decoded.popitem(last=False)
+        return image
+
+    # ----------------------------------
+    # Disk Quota
+    # ----------------------------------
+    def _evict(self, keep=None):
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            oldest = self._conn.execute("SELECT hash, bytes FROM blobs ORDER BY accessed").fetchall()
+
+        for digest, size in oldest:
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            self.delete(digest)
+            self.evicted += 1
+            total -= size
+
+    def delete(self, digest):
+        with self._lock:
+            self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            self._conn.commit()
+            self._decoded.pop(digest, None)
+        for size in (None,) + self.sizes:
+            try:
+                os.remove(self._path(digest, size))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM blobs").fetchone()
+        return {
+            "entries": entries, "bytes": total, "decodes": self.decodes,
+            "decoded_hits": self.decoded_hits, "evicted": self.evicted
+        }
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
@@ -0,0 +1,121 @@
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """
+    Raised when a session already has as many jobs waiting as it's allowed.
+    """
+
+
+# ----------------------------------
+# Jobs
+# ----------------------------------
+class Job:
+    """
+    One piece of background work and everything known about it so far.
+
+    status goes queued -> running -> done (or failed). partial is a dict the
+    job function can fill in while it runs (e.g. a caption or the tokens
+    streamed so far) so the UI can show progress before the result is ready.
+    """
+
+    def __init__(self, job_id, session_id, kind):
+        self.id = job_id
+        self.session_id = session_id
+        self.kind = kind
+        self.status = "queued"
+        self.partial = {}
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    @property
+    def seconds(self):
+        """
+        Time from submission to finishing (or until now, if still going).
+        """
+        return (self.finished or time.time()) - self.submitted
+
+
+# ----------------------------------
+# Scheduler
+# ----------------------------------
+class JobScheduler:
+    """
+    Runs jobs on a bounded thread pool and keeps a table of them by id.
+
+    Meant to be created once per process (e.g. with st.cache_resource) so
+    jobs keep running across Streamlit reruns and their results can be picked
+    up later by id. Each session may have at most max_per_session jobs that
+    haven't finished; finished jobs are forgotten after keep_seconds.
+    """
+
+    def __init__(self, max_workers=4, max_per_session=3, keep_seconds=600):
+        self.max_per_session = max_per_session
+        self.keep_seconds = keep_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self._jobs = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, kind, fn, *args, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs); its return value becomes job.result.
+
+        Raises QueueFull if the session already has too many unfinished jobs.
+        """
+        with self._lock:
+            self._forget_old()
+            pending = sum(
+                1 for job in self._jobs.values()
+                if job.session_id == session_id and not job.done
+            )
+            if pending >= self.max_per_session:
+                raise QueueFull(f"{pending} jobs already waiting")
+
+            job = Job(f"{next(self._counter)}-{uuid.uuid4().hex[:8]}", session_id, kind)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+
+    def _forget_old(self):
+        cutoff = time.time() - self.keep_seconds
+        for job_id in [job.id for job in self._jobs.values() if job.done and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self, session_id=None):
+        """
+        Number of unfinished jobs, for one session or overall.
+        """
+        with self._lock:
+            return sum(
+                1 for job in self._jobs.values()
+                if not job.done and (session_id is None or job.session_id == session_id)
+            )
@@ -0,0 +1,201 @@
+import difflib
+import json
+import os
+import sqlite3
+import threading
+import time
+from .vocabulary import DEFAULT_SEED_PATH, AnimalVocabulary, name_variants, normalize_name
+
+# Captions that mention an animal word without showing a real animal
+NOT_AN_ANIMAL = ("hot dog", "teddy bear", "stuffed", "toy", "statue", "figurine", "plush", "cartoon")
+
+# ----------------------------------
+# Fact Sheets
+# ----------------------------------
+def is_complete(animal_info):
+    """
+    True if a fact sheet is good enough to keep: a real name, a scientific name and some facts
+    """
+    return (
+        animal_info.get("animal_name", "Mystery Animal") != "Mystery Animal"
+        and animal_info.get("scientific_name", "N/A") != "N/A"
+        and bool(animal_info.get("facts"))
+    )
+
+
+# ----------------------------------
+# Animal Fact Book
+# ----------------------------------
+class AnimalKnowledgeBase:
+    """
+    Local store of kid-friendly fact sheets, so the chat model is only asked
+    about animals we haven't met before.
+
+    Entries live in SQLite keyed by normalized common name, with a table of
+    synonyms ("puppy", "golden retriever" -> dog). It starts from the seed
+    file shipped in animal_explorer/data and grows with every new fact sheet
+    passed to add(). lookup() finds the animal a caption talks about: exact
+    name / synonym matches first through an AnimalVocabulary trie (longest
+    phrase wins), then close spellings with difflib. One instance can be shared between sessions (threads).
+    """
+
+    def __init__(self, path, seed_path=DEFAULT_SEED_PATH, fuzzy_cutoff=0.85, max_words=3):
+        self.path = path
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.max_words = max_words
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS animals (
+                name TEXT PRIMARY KEY,
+                animal_info TEXT NOT NULL,
+                source TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS aliases (
+                alias TEXT PRIMARY KEY,
+                name TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+        if seed_path and os.path.exists(seed_path):
+            self._load_seed(seed_path)
+
+        # Every alias in memory, so matching a caption never touches the disk
+        self._aliases = dict(self._conn.execute("SELECT alias, name FROM aliases").fetchall())
+        self._vocabulary = AnimalVocabulary()
+        for alias, name in self._aliases.items():
+            self._vocabulary.add(alias, name)
+
+    def _load_seed(self, seed_path):
+        with open(seed_path, encoding="utf-8") as f:
+            seed = json.load(f)
+
+        version = str(seed.get("version", 1))
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'seed_version'").fetchone()
+        if row is not None and row[0] == version:
+            return
+
+        with self._lock:
+            now = time.time()
+            # Synonyms dropped from the seed shouldn't linger
+            self._conn.execute("DELETE FROM aliases WHERE name IN (SELECT name FROM animals WHERE source = 'seed')")
+            for entry in seed["animals"]:
+                entry = dict(entry)
+                aliases = entry.pop("aliases", [])
+                name = normalize_name(entry["animal_name"])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO animals VALUES (?, ?, 'seed', ?)",
+                    (name, json.dumps(entry, ensure_ascii=False), now)
+                )
+                for alias in [entry["animal_name"]] + aliases:
+                    for variant in name_variants(alias):
+                        self._conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?)", (variant, name))
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('seed_version', ?)", (version,))
+            self._conn.commit()
+
+    # ----------------------------------
+    # Matching Captions
+    # ----------------------------------
+    def match(self, caption):
+        """
+        Return (entry name, matched phrase, exact?) for the animal a caption
+        mentions, or None.
+        """
+        padded = f" {normalize_name(caption)} "
+        if not padded.strip() or any(f" {phrase} " in padded for phrase in NOT_AN_ANIMAL):
+            return None
+
+        found = self._vocabulary.find(caption)
+        if found:
+            return found[0][0], found[0][1], True
+
+        # Nothing exact: allow a small spelling slip in longer words ("girafe")
+        words = padded.split()
+        known = list(self._aliases)
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                phrase = " ".join(words[start:start + size])
+                if len(phrase) < 5:
+                    continue
+                close = difflib.get_close_matches(phrase, known, n=1, cutoff=self.fuzzy_cutoff)
+                if close:
+                    return self._aliases[close[0]], close[0], False
+        return None
+
+    def lookup(self, caption):
+        """
+        Return a copy of the fact sheet for the animal in a caption, or None on a miss.
+        """
+        match = self.match(caption)
+        info = self.get(match[0]) if match else None
+        with self._lock:
+            if info is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return info
+
+    def get(self, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT animal_info FROM animals WHERE name = ?", (normalize_name(name),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ----------------------------------
+    # Learning New Animals
+    # ----------------------------------
+    def add(self, animal_info, aliases=(), source="llm"):
+        """
+        Store a new fact sheet, e.g. one the chat model just wrote.
+
+        Incomplete fact sheets are ignored, and names that already point at
+        an entry are left alone so the seed data is never overwritten.
+        Returns True if anything new was saved.
+        """
+        if not is_complete(animal_info):
+            return False
+
+        name = normalize_name(animal_info["animal_name"])
+        variants = set()
+        for alias in [animal_info["animal_name"]] + list(aliases):
+            variants |= name_variants(alias)
+
+        with self._lock:
+            if not name or name in self._aliases:
+                return False
+
+            self._conn.execute(
+                "INSERT OR IGNORE INTO animals VALUES (?, ?, ?, ?)",
+                (name, json.dumps(animal_info, ensure_ascii=False), source, time.time())
+            )
+            for variant in variants:
+                if variant not in self._aliases:
+                    self._conn.execute("INSERT OR IGNORE INTO aliases VALUES (?, ?)", (variant, name))
+                    self._aliases[variant] = name
+                    self._vocabulary.add(variant, name)
+            self._conn.commit()
+        return True
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT source, COUNT(*) FROM animals GROUP BY source").fetchall())
+        return {"entries": sum(counts.values()), "by_source": counts, "aliases": len(self._aliases),
+                "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM animals").fetchone()[0]
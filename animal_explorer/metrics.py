@@ -0,0 +1,239 @@
+import bisect
+import contextlib
+import threading
+import time
+import traceback
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds, from a fast cache hit to a model
+# that has to load first
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+# ----------------------------------
+# Histograms
+# ----------------------------------
+class Histogram:
+    """
+    Counts of observed durations per bucket, plus their sum, Prometheus style.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimate the q-th quantile (0-1) by interpolating inside its bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else lower * 2 or 1.0
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Span:
+    """
+    What a Metrics.span() block can tell the span: extra labels, or that it failed.
+    """
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.outcome = "ok"
+
+    def fail(self, outcome="error"):
+        self.outcome = outcome
+
+
+# ----------------------------------
+# Metrics Registry
+# ----------------------------------
+class Metrics:
+    """
+    Counters, latency histograms and recent errors for the whole app.
+
+    span(name, **labels) times a block into the histogram "<name>_seconds"
+    and counts it in "<name>_total" with an outcome label: "ok", "error"
+    (an exception, or span.fail()) or "cancelled" (a hedged call that lost
+    its race). error() records a failure that was handled, so it isn't lost
+    silently. One instance is shared by every session (thread).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_errors=50):
+        self.buckets = buckets
+        self.started = time.time()
+        self._counters = {}
+        self._histograms = {}
+        self._errors = deque(maxlen=max_errors)
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        span = Span(labels)
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.fail()
+            self.error(name, e, **span.labels)
+            raise
+        except BaseException:
+            span.fail("cancelled")
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - started, **span.labels)
+            self.inc(f"{name}_total", outcome=span.outcome, **span.labels)
+
+    def error(self, where, error, **labels):
+        """
+        Count a handled failure and keep it (with its traceback, if it's an
+        exception) in the recent errors list.
+        """
+        kind = type(error).__name__ if isinstance(error, BaseException) else "failure"
+        self.inc("errors_total", where=where, type=kind, **labels)
+        details = "".join(traceback.format_exception(error)) if isinstance(error, BaseException) else ""
+        with self._lock:
+            self._errors.append({
+                "time": time.time(), "where": where, "type": kind, "message": str(error),
+                "labels": dict(labels), "traceback": details
+            })
+
+    # ----------------------------------
+    # Reading
+    # ----------------------------------
+    def counters(self):
+        """
+        [(name, labels dict, value)], sorted by name.
+        """
+        with self._lock:
+            items = sorted(self._counters.items())
+        return [(name, dict(labels), value) for (name, labels), value in items]
+
+    def histograms(self):
+        """
+        [(name, labels dict, {count, sum, p50, p95, p99})] with quantiles in seconds.
+        """
+        with self._lock:
+            items = sorted(self._histograms.items())
+            rows = [
+                (name, dict(labels), {
+                    "count": histogram.count, "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95), "p99": histogram.quantile(0.99)
+                })
+                for (name, labels), histogram in items
+            ]
+        return rows
+
+    def recent_errors(self):
+        with self._lock:
+            return list(reversed(self._errors))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._errors.clear()
+            self.started = time.time()
+
+    def render_prometheus(self, prefix="animal_explorer"):
+        """
+        Everything in the Prometheus text exposition format.
+        """
+        lines = [f"# TYPE {prefix}_uptime_seconds gauge", f"{prefix}_uptime_seconds {time.time() - self.started:.3f}"]
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, list(histogram.counts), histogram.sum, histogram.count)
+                for key, histogram in self._histograms.items()
+            )
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                typed.add(name)
+            lines.append(f"{prefix}_{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), counts, total, count in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(f"{prefix}_{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{prefix}_{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{prefix}_{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# ----------------------------------
+# Prometheus Endpoint
+# ----------------------------------
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    """
+    Serve metrics.render_prometheus() at http://host:port/metrics from a
+    daemon thread, for a Prometheus scraper. Returns the server.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
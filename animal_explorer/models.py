@@ -0,0 +1,16 @@
+# ----------------------------------
+# Hugging Face Models
+# ----------------------------------
+# Multiple model options for reliability, tried fastest-healthy first.
+# Shared by the app and the command line, so both build the same cache keys
+VISION_MODELS = [
+    "Salesforce/blip-image-captioning-base",
+    "nlpconnect/vit-gpt2-image-captioning",
+    "Salesforce/blip-image-captioning-large"
+]
+
+CHAT_MODELS = [
+    "mistralai/Mixtral-8x7B-Instruct-v0.1",
+    "meta-llama/Meta-Llama-3-8B-Instruct",
+    "HuggingFaceH4/zephyr-7b-beta"
+]
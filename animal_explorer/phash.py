@@ -0,0 +1,179 @@
+import threading
+from array import array
+from PIL import Image
+
+HASH_BITS = 64
+CHUNK_BITS = 8
+CHUNKS = HASH_BITS // CHUNK_BITS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Flat photos (dark, blurred, one colour) hash to nearly all 0s or 1s and
+# would all match each other, so they get no hash: below this much
+# brightness range in the thumbnail, or with this few bits set or clear
+MIN_CONTRAST = 12
+MIN_BITS = 3
+
+# ----------------------------------
+# Difference Hash
+# ----------------------------------
+def dhash(image):
+    """
+    64-bit difference hash of an image, or None if it's too flat to tell
+    apart from other flat images.
+
+    Each bit says whether a pixel of a 9x8 grayscale thumbnail is brighter than
+    its right-hand neighbour, so resizing, recompression and small colour
+    changes only flip a few bits.
+    """
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    pixels = image.resize((9, 8), Image.Resampling.BOX).convert("L").tobytes()
+    if max(pixels) - min(pixels) < MIN_CONTRAST:
+        return None
+
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value if distinctive(value) else None
+
+
+def distinctive(phash):
+    """
+    False for hashes that are (nearly) all 0s or all 1s, which flat images share.
+    """
+    return MIN_BITS <= phash.bit_count() <= HASH_BITS - MIN_BITS
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+# ----------------------------------
+# Near-Duplicate Index
+# ----------------------------------
+class PerceptualIndex:
+    """
+    Nearest-neighbour index over 64-bit perceptual hashes.
+
+    Uses multi-index hashing: every hash is split into 8 chunks of 8 bits and
+    each chunk gets its own lookup table. Two hashes within distance 7 must
+    share at least one chunk exactly, so a lookup only checks the few entries
+    that share a chunk instead of scanning everything. Hashes live in a flat
+    array, which keeps tens of thousands of entries to a few hundred KB.
+    Hashes that aren't distinctive() are never stored or matched. Removed
+    entries are skipped, and packed away once they're half the array.
+    """
+
+    def __init__(self, threshold=6):
+        if not 0 <= threshold < CHUNKS:
+            raise ValueError(f"threshold must be between 0 and {CHUNKS - 1}")
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        # How far away each hit was, to help pick a good threshold
+        self.hit_distances = [0] * (threshold + 1)
+
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._hashes = array("Q")
+        self._keys = []
+        self._positions = {}
+        self._tables = [{} for _ in range(CHUNKS)]
+
+    def _add(self, phash, key):
+        if key in self._positions or not distinctive(phash):
+            return
+        position = len(self._hashes)
+        self._hashes.append(phash)
+        self._keys.append(key)
+        self._positions[key] = position
+        for chunk, table in enumerate(self._tables):
+            value = (phash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            table.setdefault(value, array("I")).append(position)
+
+    def add(self, phash, key):
+        """
+        Remember that the image with this hash was stored under key.
+        """
+        with self._lock:
+            self._add(phash, key)
+
+    def remove(self, key):
+        """
+        Forget key, e.g. once its result has left the cache.
+        """
+        with self._lock:
+            position = self._positions.pop(key, None)
+            if position is None:
+                return
+            self._keys[position] = None
+            if len(self._positions) < len(self._keys) // 2:
+                live = [(self._hashes[position], key) for key, position in self._positions.items()]
+                self._clear()
+                for phash, key in live:
+                    self._add(phash, key)
+
+    def rebuild(self, items):
+        """
+        Replace everything with the (phash, key) pairs in items, e.g. a
+        result cache's iter_phashes().
+        """
+        items = list(items)
+        with self._lock:
+            self._clear()
+            for phash, key in items:
+                self._add(phash, key)
+
+    def lookup(self, phash):
+        """
+        Return (key, distance) of the closest stored hash within the
+        threshold, or None. Updates the hit/miss counters.
+        """
+        best_key = None
+        best_distance = self.threshold + 1
+        if phash is None or not distinctive(phash):
+            self.misses += 1
+            return None
+
+        with self._lock:
+            seen = set()
+            for chunk, table in enumerate(self._tables):
+                value = (phash >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+                for position in table.get(value, ()):
+                    if position in seen or self._keys[position] is None:
+                        continue
+                    seen.add(position)
+                    distance = hamming(phash, self._hashes[position])
+                    if distance < best_distance:
+                        best_key = self._keys[position]
+                        best_distance = distance
+                        if distance == 0:
+                            break
+                if best_distance == 0:
+                    break
+
+            if best_key is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.hit_distances[best_distance] += 1
+
+        return best_key, best_distance
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._positions),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "hit_distances": list(self.hit_distances)
+        }
+
+    def __len__(self):
+        return len(self._positions)
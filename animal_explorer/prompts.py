@@ -0,0 +1,106 @@
+# Bump whenever the enrichment prompt or parsing changes so old cached results are ignored
+PROMPT_VERSION = 2
+
+# ----------------------------------
+# Fact Sheet Prompt
+# ----------------------------------
+ENRICHMENT_PARAMETERS = {"max_new_tokens": 400, "temperature": 0.7}
+
+NAP_MESSAGE = "Hmm, the AI is taking a nap right now. Please wait a moment and try again! 😴"
+NO_API_KEY_MESSAGE = "Oops! We need to set up the AI first. Ask a grown-up to add the API key!"
+
+
+def enrichment_prompt(caption):
+    """
+    Ask a chat model to turn an image caption into a kid-friendly fact sheet
+
+    The answer is requested as JSON so fact_parser can read it reliably; the
+    text parser still handles models that answer in "Label: value" lines.
+    """
+    return f"""Based on this image description: "{caption}"
+
+Provide animal information in a fun, kid-friendly way for children ages 6-12.
+Answer with ONLY a JSON object in exactly this shape:
+
+{{
+  "animal_name": "Common name",
+  "scientific_name": "Scientific name",
+  "animal_type": "Mammal/Bird/Reptile/Fish/Insect",
+  "habitat": "Where they live",
+  "diet": "What they eat",
+  "conservation": "Conservation status",
+  "facts": ["Fact 1", "Fact 2", "Fact 3"],
+  "characteristics": "What they look like"
+}}
+
+Keep it fun and simple!"""
+
+
+def fallback_fact_sheet(caption, animal_name=None):
+    """
+    A simple fact sheet built from the caption alone, for when no chat model answers
+
+    animal_name is the animal found in the caption (see vocabulary.py); the
+    whole caption is used as the name if there isn't one.
+    """
+    return f"""Animal Name: {animal_name or caption.strip()}
+Scientific Name: Scientific classification varies
+Animal Type: Based on the image
+Where They Live: Various habitats
+What They Eat: Depends on the species
+Are They Safe?: Status varies by species
+Cool Facts:
+- This animal was identified from your photo!
+- Every animal is unique and special!
+- Animals help keep nature balanced!
+What They Look Like: {caption}"""
+
+
+def generated_text(result, prompt=None):
+    """
+    Pull the generated text out of an inference API JSON response, minus the prompt
+    """
+    if isinstance(result, list) and len(result) > 0:
+        text = result[0].get('generated_text', '')
+    elif isinstance(result, dict):
+        text = result.get('generated_text', '')
+    else:
+        text = ''
+
+    if prompt and text and prompt in text:
+        text = text.replace(prompt, '').strip()
+    return text
+
+
+# ----------------------------------
+# Chat Prompt
+# ----------------------------------
+CHAT_FALLBACK_MESSAGE = "That's a great question! Animals are amazing creatures. Try asking again in a moment! 🐾"
+CHAT_RESTING_MESSAGE = "Oops! The AI is resting right now. Please try again! 😊"
+
+
+def chat_prompt(user_message, context=None, history=None):
+    """
+    Build the kid-friendly expert prompt, mentioning the current animal if there is one
+
+    history is the chat so far (see Conversation.window), for follow-up questions
+    """
+    chat = f"""Our chat so far:
+{history}
+
+""" if history else ""
+
+    if context:
+        return f"""You are a super friendly animal expert talking to kids in grades 1-6 (ages 6-12).
+
+Current animal: {context.get('animal_name', 'Unknown')}
+Type: {context.get('animal_type', 'N/A')}
+Where it lives: {context.get('habitat', 'N/A')}
+
+{chat}Answer this question in a fun, exciting way using simple words: {user_message}
+
+Keep your answer short (2-3 sentences), fun, and easy to understand for kids!"""
+
+    return f"""You are a super friendly animal expert talking to kids ages 6-12. {chat}Answer this question about animals in a fun, exciting way using simple words: {user_message}
+
+Keep your answer short (2-3 sentences), fun, and easy to understand for kids! Use emojis if it helps! 🐾"""
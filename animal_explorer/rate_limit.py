@@ -0,0 +1,387 @@
+import contextlib
+import contextvars
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from .shared_state import locked
+
+# Served in this order: kids waiting on an answer first, then batches, then
+# the app's own upkeep (model health probes)
+PRIORITIES = ("interactive", "batch", "background")
+
+# ----------------------------------
+# Who Is Calling
+# ----------------------------------
+_caller = contextvars.ContextVar("rate_limit_caller", default=("", "interactive"))
+
+
+@contextlib.contextmanager
+def caller(session_id, priority="interactive"):
+    """
+    Tag every rate-limited call made inside the block with a session and priority.
+
+    The tag is a context variable, so it follows the code into threads
+    started with contextvars.copy_context().run, asyncio tasks and
+    asyncio.to_thread().
+    """
+    token = _caller.set((session_id or "", priority))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def current_caller():
+    """
+    (session_id, priority) of the code running now.
+    """
+    return _caller.get()
+
+
+class RateLimited(Exception):
+    """
+    Raised instead of queueing when the wait would be longer than allowed.
+
+    eta is roughly how many seconds until there would be room.
+    """
+
+    def __init__(self, eta):
+        super().__init__(f"Too many AI calls right now, try again in about {eta:.0f}s")
+        self.eta = eta
+
+
+# ----------------------------------
+# Token Buckets
+# ----------------------------------
+class TokenBucket:
+    """
+    Classic token bucket: rate tokens per second, holding at most burst.
+
+    reserve() always hands out a token but may put the bucket into debt, and
+    returns how long the caller has to wait before using it. That way callers
+    queue up in order without holding a lock while they sleep.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens and return the seconds to wait before using them.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def level(self):
+        """
+        Tokens in the bucket right now (negative while it's in debt).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+    def wait_time(self, tokens=1):
+        """
+        Seconds until tokens would be available, without taking them.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = tokens - self.tokens
+            return max(missing, 0) / self.rate
+
+    def pause(self, seconds):
+        """
+        Hand out nothing for the next `seconds`, e.g. after the API said 429.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A TokenBucket kept in a shared state store (see shared_state.py), so
+    every app worker takes its tokens from the same bucket.
+
+    The level and when it was last topped up are stored under key, and
+    changed while holding the store's lock for it. Times are wall-clock,
+    since each process has its own monotonic clock. A full bucket's key
+    expires, and a missing key means full.
+    """
+
+    def __init__(self, state, key, rate, burst):
+        super().__init__(rate, burst)
+        self.state = state
+        self.key = key
+
+    def _load(self, now):
+        raw = self.state.get(self.key)
+        if raw is None:
+            return self.burst
+        tokens, updated = map(float, raw.split())
+        return min(self.burst, tokens + max(now - updated, 0) * self.rate)
+
+    def _change(self, change):
+        """
+        Set the level to change(level) and return the new level.
+        """
+        with locked(self.state, f"{self.key}:lock"):
+            now = time.time()
+            tokens = change(self._load(now))
+            refill = math.ceil((self.burst - tokens) / self.rate) + 1
+            self.state.set(self.key, f"{tokens!r} {now!r}", ex=refill)
+        return tokens
+
+    def reserve(self, tokens=1):
+        left = self._change(lambda level: level - tokens)
+        return 0.0 if left >= 0 else -left / self.rate
+
+    def level(self):
+        return self._load(time.time())
+
+    def wait_time(self, tokens=1):
+        return max(tokens - self._load(time.time()), 0) / self.rate
+
+    def pause(self, seconds):
+        self._change(lambda level: min(level, -seconds * self.rate))
+
+
+class _Waiter:
+    __slots__ = ("model", "session_id", "priority", "owed")
+
+    def __init__(self, model, session_id, priority):
+        self.model = model
+        self.session_id = session_id
+        self.priority = priority
+        self.owed = 0.0
+
+
+# ----------------------------------
+# Shared Rate Limiter
+# ----------------------------------
+class ModelRateLimiter:
+    """
+    Paces every call made with one API key.
+
+    Each model has its own token bucket (limits maps model names to calls
+    per minute; others get default_per_minute). On top of those, every call
+    also needs a token from the global buckets: global_per_minute for the
+    key as a whole and quota_per_hour as an overall budget.
+
+    Callers that can't go yet wait in a queue. "interactive" callers are
+    always offered the next free slot before "batch" ones, and those before
+    "background" ones. Within a priority sessions take turns, so one
+    teacher's batch of 200 photos can't starve everyone else. Session and
+    priority come from caller() unless passed to acquire().
+
+    With a shared state store the buckets live there (SharedTokenBucket,
+    under prefix), so several app workers together stay within the limits.
+    The queue is still per worker.
+    """
+
+    def __init__(self, default_per_minute=30, burst=5, limits=None,
+                 global_per_minute=None, global_burst=None, quota_per_hour=None, state=None, prefix="rate"):
+        self.default_per_minute = default_per_minute
+        self.burst = burst
+        self.limits = dict(limits or {})
+        self.state = state
+        self.prefix = prefix
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+        self._global = []
+        self._quota = None
+        if global_per_minute:
+            self._global.append(self._new_bucket("global", global_per_minute / 60.0, global_burst or burst))
+        if quota_per_hour:
+            self._quota = self._new_bucket("quota", quota_per_hour / 3600.0, quota_per_hour)
+            self._global.append(self._quota)
+
+        # priority -> session -> waiters, in turn order
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._cond = threading.Condition()
+        self.served = {priority: 0 for priority in PRIORITIES}
+        self.shed = 0
+
+    def _new_bucket(self, name, rate, burst):
+        if self.state is None:
+            return TokenBucket(rate, burst)
+        return SharedTokenBucket(self.state, f"{self.prefix}:{name}", rate, burst)
+
+    def bucket(self, model):
+        with self._lock:
+            if model not in self._buckets:
+                per_minute = self.limits.get(model, self.default_per_minute)
+                self._buckets[model] = self._new_bucket(f"model:{model}", per_minute / 60.0, self.burst)
+            return self._buckets[model]
+
+    def reserve(self, model):
+        """
+        Take a token straight away and return the seconds to wait, skipping the queue.
+        """
+        wait = self.bucket(model).reserve()
+        for bucket in self._global:
+            wait = max(wait, bucket.reserve())
+        return wait
+
+    def _wait_for(self, model):
+        return max([self.bucket(model).wait_time()] + [bucket.wait_time() for bucket in self._global])
+
+    def _next_turn(self, waiter):
+        """
+        With the condition held: take a token for waiter and return 0 if it's
+        its turn, else return how long to sleep before checking again.
+        """
+        sleep = None
+        for priority in PRIORITIES:
+            for session_id, queue in self._queues[priority].items():
+                head = queue[0]
+                wait = self._wait_for(head.model)
+                if wait > 0:
+                    sleep = wait if sleep is None else min(sleep, wait)
+                    continue
+                if head is not waiter:
+                    # Someone else's turn; let them know and check back soon
+                    self._cond.notify_all()
+                    return 0.05
+
+                # Another worker may have taken the token just now; then ours comes a little later
+                waiter.owed = self.reserve(waiter.model)
+                queue.popleft()
+                if queue:
+                    self._queues[priority].move_to_end(session_id)
+                else:
+                    del self._queues[priority][session_id]
+                self.served[priority] += 1
+                return 0
+        return sleep if sleep is not None else 0.05
+
+    def acquire(self, model, session_id=None, priority=None, max_wait=None):
+        """
+        Block until model may be called and return the seconds spent waiting.
+
+        Raises RateLimited instead of queueing if the estimated wait is
+        longer than max_wait seconds.
+        """
+        default_session, default_priority = current_caller()
+        session_id = default_session if session_id is None else session_id
+        priority = priority or default_priority
+        if priority not in self._queues:
+            priority = PRIORITIES[-1]
+
+        started = time.monotonic()
+        with self._cond:
+            if max_wait is not None:
+                eta = max(self._wait_for(model), self._eta(priority))
+                if eta > max_wait:
+                    self.shed += 1
+                    raise RateLimited(eta)
+
+            waiter = _Waiter(model, session_id, priority)
+            self._queues[priority].setdefault(session_id, deque()).append(waiter)
+            try:
+                while True:
+                    sleep = self._next_turn(waiter)
+                    if sleep == 0:
+                        ready = time.monotonic() + waiter.owed
+                        while time.monotonic() < ready:
+                            self._cond.wait(ready - time.monotonic())
+                        return time.monotonic() - started
+                    self._cond.wait(sleep)
+            except BaseException:
+                queue = self._queues[priority].get(session_id)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[priority][session_id]
+                raise
+            finally:
+                self._cond.notify_all()
+
+    # ----------------------------------
+    # Load Shedding
+    # ----------------------------------
+    def _eta(self, priority, ahead=None):
+        if ahead is None:
+            ahead = 0
+            for other in PRIORITIES[:PRIORITIES.index(priority) + 1]:
+                ahead += sum(len(queue) for queue in self._queues[other].values())
+        if self._global:
+            return max(bucket.wait_time(ahead + 1) for bucket in self._global)
+        return ahead / (self.default_per_minute / 60.0)
+
+    def eta(self, priority="interactive"):
+        """
+        Roughly how many seconds a new call at this priority would wait.
+        """
+        with self._cond:
+            return self._eta(priority)
+
+    def pause(self, seconds, model=None):
+        """
+        Stop handing out tokens for a while after the API pushed back (429).
+
+        Without a model every call is paused, since the limit is usually on
+        the API key. The hourly quota is never paused: emptying it would
+        hold the app to the trickle of an hour's budget long after the API
+        is happy again.
+        """
+        if model:
+            buckets = [self.bucket(model)]
+        else:
+            buckets = [bucket for bucket in self._global if bucket is not self._quota]
+            if not buckets:
+                with self._lock:
+                    buckets = list(self._buckets.values())
+        for bucket in buckets:
+            bucket.pause(seconds)
+
+    def quota_left(self):
+        """
+        Fraction (0-1) of the hourly quota that's unused; 1.0 without a quota.
+        """
+        if self._quota is None:
+            return 1.0
+        return max(self._quota.level(), 0) / self._quota.burst
+
+    def status(self, session_id):
+        """
+        How a session is doing in the queue: waiting calls, place in line and
+        an estimated wait in seconds (0 if nothing is waiting).
+        """
+        with self._cond:
+            waiting = 0
+            ahead = None
+            seen = 0
+            for priority in PRIORITIES:
+                for other, queue in self._queues[priority].items():
+                    if other == session_id:
+                        waiting += len(queue)
+                        if ahead is None:
+                            ahead = seen
+                    seen += len(queue)
+            if not waiting:
+                return {"waiting": 0, "position": 0, "eta": 0.0}
+            return {"waiting": waiting, "position": ahead + 1, "eta": self._eta(PRIORITIES[0], ahead)}
+
+    def stats(self):
+        with self._cond:
+            queued = {
+                priority: sum(len(queue) for queue in self._queues[priority].values())
+                for priority in PRIORITIES
+            }
+        return {"queued": queued, "served": dict(self.served), "shed": self.shed}
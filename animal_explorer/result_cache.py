@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ----------------------------------
+# Cache Keys
+# ----------------------------------
+def image_cache_key(image, models, prompt_version):
+    """
+    Build a content hash for an image plus everything that changes the answer.
+
+    The pixels are hashed rather than the uploaded file, so the same photo
+    saved twice (or re-clicked) always lands on the same key.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}|{image.size[0]}x{image.size[1]}|".encode())
+    digest.update(image.tobytes())
+    digest.update(f"|{'|'.join(models)}|{prompt_version}".encode())
+    return digest.hexdigest()
+
+
+# ----------------------------------
+# Persistent Result Cache
+# ----------------------------------
+class ResultCache:
+    """
+    SQLite-backed cache of identification results, keyed by image_cache_key().
+
+    Entries expire after ttl_seconds and the least recently used ones are
+    dropped once there are more than max_entries. One instance can be shared
+    between Streamlit sessions (threads).
+    """
+
+    def __init__(self, path, max_entries=5000, ttl_seconds=30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                caption TEXT NOT NULL,
+                text TEXT NOT NULL,
+                animal_info TEXT NOT NULL,
+                model_used TEXT,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS phashes (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                phash TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS results_evict_phash AFTER DELETE ON results
+            BEGIN
+                DELETE FROM phashes WHERE key = old.key;
+            END
+        """)
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Return the cached result for key, or None if missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT caption, text, animal_info, model_used, created FROM results WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None or now - row[4] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        return {
+            "caption": row[0],
+            "text": row[1],
+            "animal_info": json.loads(row[2]),
+            "model_used": row[3]
+        }
+
+    def put(self, key, caption, text, animal_info, model_used=None, phash=None, namespace=""):
+        """
+        Store a result and evict expired / least recently used entries.
+
+        If a perceptual hash is given it is saved too, so the near-duplicate
+        index can be rebuilt with iter_phashes() after a restart.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, caption, text, json.dumps(animal_info), model_used, now, now)
+            )
+            if phash is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO phashes VALUES (?, ?, ?)",
+                    (key, namespace, format(phash, "016x"))
+                )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl_seconds,))
+        self._conn.execute("""
+            DELETE FROM results WHERE key IN (
+                SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def iter_phashes(self, namespace="", since=None):
+        """
+        Yield (phash, key) for every cached result stored under namespace
+        (only those stored at or after the time.time() since, if given).
+        """
+        with self._lock:
+            if since is None:
+                rows = self._conn.execute(
+                    "SELECT phash, key FROM phashes WHERE namespace = ?", (namespace,)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT phashes.phash, phashes.key FROM phashes JOIN results ON results.key = phashes.key "
+                    "WHERE phashes.namespace = ? AND results.created >= ?", (namespace, since)
+                ).fetchall()
+        for phash, key in rows:
+            yield int(phash, 16), key
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+# ----------------------------------
+# Shared Result Cache
+# ----------------------------------
+class SharedResultCache:
+    """
+    ResultCache on a shared state store (shared_state.py), for several app
+    workers to share.
+
+    Each result is a JSON value under "<prefix>:<key>" that expires after
+    ttl_seconds. A sorted set of keys by last use finds the least recently
+    used ones to drop past max_entries, one by when they were stored finds
+    the ones that have expired, and one per namespace keeps the perceptual
+    hashes by when they were stored.
+    """
+
+    def __init__(self, state, max_entries=5000, ttl_seconds=30 * 24 * 3600, prefix="results"):
+        self.state = state
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._used = f"{prefix}:used"
+        self._created = f"{prefix}:created"
+        self._namespaces = f"{prefix}:namespaces"
+
+    def _phashes(self, namespace):
+        return f"{self.prefix}:phashes:{namespace}"
+
+    def get(self, key):
+        """
+        Return the cached result for key, or None if missing or expired.
+        """
+        raw = self.state.get(f"{self.prefix}:{key}")
+        if raw is None:
+            self.misses += 1
+            return None
+        self.state.zadd(self._used, {key: time.time()})
+        self.hits += 1
+        result = json.loads(raw)
+        return {
+            "caption": result["caption"],
+            "text": result["text"],
+            "animal_info": result["animal_info"],
+            "model_used": result["model_used"]
+        }
+
+    def put(self, key, caption, text, animal_info, model_used=None, phash=None, namespace=""):
+        """
+        Store a result and drop expired / least recently used entries.
+        """
+        now = time.time()
+        result = {"caption": caption, "text": text, "animal_info": animal_info, "model_used": model_used}
+        if phash is not None:
+            result.update(phash=f"{phash:016x}", namespace=namespace)
+            self.state.hset(self._namespaces, namespace, 1)
+            self.state.zadd(self._phashes(namespace), {f"{phash:016x}:{key}": now})
+        self.state.set(f"{self.prefix}:{key}", json.dumps(result), ex=self.ttl_seconds)
+        self.state.zadd(self._used, {key: now})
+        self.state.zadd(self._created, {key: now})
+        self._evict(now)
+
+    def _expire(self, now):
+        # Results expire ttl_seconds after they were stored, however recently they were used
+        self.state.zremrangebyscore(self._used, "-inf", now - self.ttl_seconds)
+        expired = self.state.zrangebyscore(self._created, "-inf", now - self.ttl_seconds)
+        if expired:
+            self.state.zrem(self._used, *expired)
+            self.state.zrem(self._created, *expired)
+
+    def _evict(self, now):
+        self._expire(now)
+        excess = self.state.zcard(self._used) - self.max_entries
+        if excess > 0:
+            keys = [member.decode() for member in self.state.zrange(self._used, 0, excess - 1)]
+            for key in keys:
+                raw = self.state.get(f"{self.prefix}:{key}")
+                result = json.loads(raw) if raw is not None else {}
+                if "phash" in result:
+                    self.state.zrem(self._phashes(result["namespace"]), f"{result['phash']}:{key}")
+            self.state.delete(*[f"{self.prefix}:{key}" for key in keys])
+            self.state.zrem(self._used, *keys)
+            self.state.zrem(self._created, *keys)
+
+    def iter_phashes(self, namespace="", since=None):
+        """
+        Yield (phash, key) for every result stored under namespace (only
+        those stored at or after the time.time() since, if given).
+        """
+        phashes = self._phashes(namespace)
+        self.state.zremrangebyscore(phashes, "-inf", time.time() - self.ttl_seconds)
+        for member in self.state.zrangebyscore(phashes, since if since is not None else "-inf", "+inf"):
+            phash, key = member.decode().split(":", 1)
+            yield int(phash, 16), key
+
+    def clear(self):
+        keys = [member.decode() for member in self.state.zrange(self._used, 0, -1)]
+        namespaces = [self._phashes(namespace.decode()) for namespace in self.state.hkeys(self._namespaces)]
+        self.state.delete(
+            *[f"{self.prefix}:{key}" for key in keys], self._used, self._created, self._namespaces, *namespaces
+        )
+
+    def __len__(self):
+        self._expire(time.time())
+        return self.state.zcard(self._used)
@@ -0,0 +1,566 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# The Redis commands the app uses, and so all a shared state store needs:
+#   values   get, set(ex=, px=, nx=), delete, exists, incr
+#   hashes   hget, hset, hgetall, hkeys, hlen, hdel, hincrby
+#   sorted   zadd, zrem, zcard, zscore, zrange(desc=, withscores=),
+#            zrangebyscore, zremrangebyscore
+#   locks    lock(name, timeout=, sleep=, blocking_timeout=)
+# A redis-py client speaks them as is; SQLiteState and MemoryState below
+# speak them too. Like redis-py, everything stored comes back as bytes.
+
+
+class LockError(Exception):
+    """
+    Raised when a shared lock couldn't be had in time.
+    """
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value).encode()
+    raise TypeError(f"Can't store a {type(value).__name__} in shared state")
+
+
+def _expires(ex, px):
+    if px is not None:
+        return time.time() + px / 1000
+    if ex is not None:
+        return time.time() + ex
+    return None
+
+
+def _bound(value):
+    # Score bounds as redis-py takes them: numbers, "-inf" or "+inf"
+    return float(value)
+
+
+def _indexes(start, end, count):
+    """
+    Redis-style inclusive start/end (negative counts from the end) as a Python slice.
+    """
+    if start < 0:
+        start = max(count + start, 0)
+    if end < 0:
+        end = count + end
+    return start, min(end, count - 1) + 1
+
+
+# ----------------------------------
+# Locks
+# ----------------------------------
+class StateLock:
+    """
+    redis-py's Lock for the stores below: a value set only if absent, with
+    an expiry so a crashed holder can't keep it forever, and deleted only
+    by the holder that set it.
+    """
+
+    def __init__(self, state, name, timeout=None, sleep=0.1, blocking=True, blocking_timeout=None,
+                 thread_local=True):
+        self.state = state
+        self.name = name
+        self.timeout = timeout
+        self.sleep = sleep
+        self.blocking = blocking
+        self.blocking_timeout = blocking_timeout
+        self.token = None
+
+    def acquire(self, blocking=None, blocking_timeout=None):
+        blocking = self.blocking if blocking is None else blocking
+        blocking_timeout = self.blocking_timeout if blocking_timeout is None else blocking_timeout
+        deadline = None if blocking_timeout is None else time.monotonic() + blocking_timeout
+        token = uuid.uuid4().hex
+        px = int(self.timeout * 1000) if self.timeout else None
+        while True:
+            if self.state.set(self.name, token, px=px, nx=True):
+                self.token = token
+                return True
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            time.sleep(self.sleep)
+
+    def release(self):
+        token, self.token = self.token, None
+        if token is None or not self.state.release_lock(self.name, token):
+            raise LockError(f"{self.name} isn't held by this lock any more")
+
+    def __enter__(self):
+        if not self.acquire():
+            raise LockError(f"Couldn't lock {self.name}")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+@contextlib.contextmanager
+def locked(state, name, timeout=5.0, wait=5.0, sleep=0.005):
+    """
+    Hold state's lock `name` for the block: at most timeout seconds, after
+    waiting at most `wait` for it. Raises LockError if it didn't come free.
+    """
+    lock = state.lock(name, timeout=timeout, sleep=sleep, blocking_timeout=wait)
+    if not lock.acquire():
+        raise LockError(f"Couldn't lock {name}")
+    try:
+        yield
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            # It expired during the block; there's nothing left to undo
+            pass
+
+
+# ----------------------------------
+# In-Memory Store
+# ----------------------------------
+class MemoryState:
+    """
+    The shared state commands, kept in this process's memory.
+
+    A local stand-in for Redis: bench/bench_shared_state.py --check plays
+    two app workers on it, and anything written for it works unchanged
+    with a redis-py client. Only threads of one process share it.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._hashes = {}
+        self._zsets = {}
+        self._lock = threading.RLock()
+
+    def _live(self, name):
+        item = self._values.get(name)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del self._values[name]
+            return None
+        return item
+
+    # Values
+    def get(self, name):
+        with self._lock:
+            item = self._live(name)
+            return item[0] if item else None
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        with self._lock:
+            if nx and self._live(name):
+                return None
+            self._values[name] = (_encode(value), _expires(ex, px))
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                for store in (self._values, self._hashes, self._zsets):
+                    removed += store.pop(name, None) is not None
+            return removed
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(
+                bool(self._live(name)) or name in self._hashes or name in self._zsets for name in names
+            )
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            item = self._live(name)
+            value = int(item[0]) + amount if item else amount
+            self._values[name] = (_encode(value), item[1] if item else None)
+            return value
+
+    def release_lock(self, name, token):
+        """
+        Delete lock `name` if it still holds token (what redis-py does with a script).
+        """
+        with self._lock:
+            item = self._live(name)
+            if item is None or item[0] != _encode(token):
+                return False
+            del self._values[name]
+            return True
+
+    def lock(self, name, timeout=None, sleep=0.1, blocking=True, blocking_timeout=None, thread_local=True):
+        return StateLock(self, name, timeout, sleep, blocking, blocking_timeout)
+
+    # Hashes
+    def hget(self, name, key):
+        with self._lock:
+            return self._hashes.get(name, {}).get(_encode(key))
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        with self._lock:
+            fields = self._hashes.setdefault(name, {})
+            added = 0
+            for field, field_value in items.items():
+                field = _encode(field)
+                added += field not in fields
+                fields[field] = _encode(field_value)
+            return added
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._hashes.get(name, {}))
+
+    def hkeys(self, name):
+        with self._lock:
+            return list(self._hashes.get(name, {}))
+
+    def hlen(self, name):
+        with self._lock:
+            return len(self._hashes.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            fields = self._hashes.get(name, {})
+            removed = sum(fields.pop(_encode(key), None) is not None for key in keys)
+            if not fields:
+                self._hashes.pop(name, None)
+            return removed
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            fields = self._hashes.setdefault(name, {})
+            value = int(fields.get(_encode(key), 0)) + amount
+            fields[_encode(key)] = _encode(value)
+            return value
+
+    # Sorted sets
+    def zadd(self, name, mapping):
+        with self._lock:
+            members = self._zsets.setdefault(name, {})
+            added = 0
+            for member, score in mapping.items():
+                member = _encode(member)
+                added += member not in members
+                members[member] = float(score)
+            return added
+
+    def zrem(self, name, *values):
+        with self._lock:
+            members = self._zsets.get(name, {})
+            removed = sum(members.pop(_encode(value), None) is not None for value in values)
+            if not members:
+                self._zsets.pop(name, None)
+            return removed
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._zsets.get(name, {}))
+
+    def zscore(self, name, value):
+        with self._lock:
+            return self._zsets.get(name, {}).get(_encode(value))
+
+    def _sorted(self, name, desc=False):
+        items = sorted(self._zsets.get(name, {}).items(), key=lambda item: (item[1], item[0]))
+        return items[::-1] if desc else items
+
+    def zrange(self, name, start, end, desc=False, withscores=False):
+        with self._lock:
+            items = self._sorted(name, desc)
+        first, stop = _indexes(start, end, len(items))
+        items = items[first:stop]
+        return items if withscores else [member for member, _ in items]
+
+    def zrangebyscore(self, name, min, max, withscores=False):
+        low, high = _bound(min), _bound(max)
+        with self._lock:
+            items = [item for item in self._sorted(name) if low <= item[1] <= high]
+        return items if withscores else [member for member, _ in items]
+
+    def zremrangebyscore(self, name, min, max):
+        low, high = _bound(min), _bound(max)
+        with self._lock:
+            members = self._zsets.get(name, {})
+            stale = [member for member, score in members.items() if low <= score <= high]
+            for member in stale:
+                del members[member]
+            if not members:
+                self._zsets.pop(name, None)
+            return len(stale)
+
+
+# ----------------------------------
+# SQLite Store
+# ----------------------------------
+class SQLiteState:
+    """
+    The shared state commands on a SQLite file in WAL mode.
+
+    Every app worker on one machine can open the same file: writes are
+    short transactions, and a busy database is waited for rather than
+    failed. Expired values are swept out every sweep_every writes.
+    """
+
+    def __init__(self, path, sweep_every=500):
+        self.path = path
+        self.sweep_every = sweep_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        # Switching to WAL doesn't wait for a busy file, so workers starting together try again
+        for attempt in range(100):
+            try:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                break
+            except sqlite3.OperationalError:
+                if attempt == 99:
+                    raise
+                time.sleep(0.05)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires REAL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                key TEXT NOT NULL,
+                field BLOB NOT NULL,
+                value BLOB NOT NULL,
+                PRIMARY KEY (key, field)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS zsets (
+                key TEXT NOT NULL,
+                member BLOB NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (key, member)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS zsets_score ON zsets (key, score, member)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires)")
+        self._conn.execute("COMMIT")
+
+    def _read(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    @contextlib.contextmanager
+    def _write(self):
+        """
+        One write transaction, holding the database lock from the start so
+        read-then-write steps can't interleave with another worker's.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            if self._writes % self.sweep_every == 0:
+                self._conn.execute("DELETE FROM kv WHERE expires <= ?", (time.time(),))
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _value(conn, name):
+        row = conn.execute(
+            "SELECT value, expires FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (name, time.time())
+        ).fetchone()
+        return row
+
+    # Values
+    def get(self, name):
+        rows = self._read(
+            "SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)", (name, time.time())
+        )
+        return bytes(rows[0][0]) if rows else None
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        with self._write() as conn:
+            if nx and self._value(conn, name):
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (name, _encode(value), _expires(ex, px))
+            )
+            return True
+
+    def delete(self, *names):
+        removed = 0
+        with self._write() as conn:
+            for name in names:
+                for table in ("kv", "hashes", "zsets"):
+                    removed += conn.execute(f"DELETE FROM {table} WHERE key = ?", (name,)).rowcount > 0
+        return removed
+
+    def exists(self, *names):
+        count = 0
+        for name in names:
+            count += bool(self.get(name) is not None or self._read(
+                "SELECT 1 FROM hashes WHERE key = ? UNION ALL SELECT 1 FROM zsets WHERE key = ? LIMIT 1", (name, name)
+            ))
+        return count
+
+    def incr(self, name, amount=1):
+        with self._write() as conn:
+            row = self._value(conn, name)
+            value = int(row[0]) + amount if row else amount
+            conn.execute(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (name, _encode(value), row[1] if row else None)
+            )
+            return value
+
+    def release_lock(self, name, token):
+        """
+        Delete lock `name` if it still holds token (what redis-py does with a script).
+        """
+        with self._write() as conn:
+            return conn.execute(
+                "DELETE FROM kv WHERE key = ? AND value = ? AND (expires IS NULL OR expires > ?)",
+                (name, _encode(token), time.time())
+            ).rowcount > 0
+
+    def lock(self, name, timeout=None, sleep=0.1, blocking=True, blocking_timeout=None, thread_local=True):
+        return StateLock(self, name, timeout, sleep, blocking, blocking_timeout)
+
+    # Hashes
+    def hget(self, name, key):
+        rows = self._read("SELECT value FROM hashes WHERE key = ? AND field = ?", (name, _encode(key)))
+        return bytes(rows[0][0]) if rows else None
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        added = 0
+        with self._write() as conn:
+            for field, field_value in items.items():
+                field = _encode(field)
+                added += conn.execute(
+                    "SELECT 1 FROM hashes WHERE key = ? AND field = ?", (name, field)
+                ).fetchone() is None
+                conn.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)", (name, field, _encode(field_value)))
+        return added
+
+    def hgetall(self, name):
+        return {
+            bytes(field): bytes(value)
+            for field, value in self._read("SELECT field, value FROM hashes WHERE key = ?", (name,))
+        }
+
+    def hkeys(self, name):
+        return [bytes(row[0]) for row in self._read("SELECT field FROM hashes WHERE key = ?", (name,))]
+
+    def hlen(self, name):
+        return self._read("SELECT COUNT(*) FROM hashes WHERE key = ?", (name,))[0][0]
+
+    def hdel(self, name, *keys):
+        removed = 0
+        with self._write() as conn:
+            for key in keys:
+                removed += conn.execute(
+                    "DELETE FROM hashes WHERE key = ? AND field = ?", (name, _encode(key))
+                ).rowcount
+        return removed
+
+    def hincrby(self, name, key, amount=1):
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT value FROM hashes WHERE key = ? AND field = ?", (name, _encode(key))
+            ).fetchone()
+            value = int(row[0]) + amount if row else amount
+            conn.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?)", (name, _encode(key), _encode(value)))
+            return value
+
+    # Sorted sets
+    def zadd(self, name, mapping):
+        added = 0
+        with self._write() as conn:
+            for member, score in mapping.items():
+                member = _encode(member)
+                added += conn.execute(
+                    "SELECT 1 FROM zsets WHERE key = ? AND member = ?", (name, member)
+                ).fetchone() is None
+                conn.execute("INSERT OR REPLACE INTO zsets VALUES (?, ?, ?)", (name, member, float(score)))
+        return added
+
+    def zrem(self, name, *values):
+        removed = 0
+        with self._write() as conn:
+            for value in values:
+                removed += conn.execute(
+                    "DELETE FROM zsets WHERE key = ? AND member = ?", (name, _encode(value))
+                ).rowcount
+        return removed
+
+    def zcard(self, name):
+        return self._read("SELECT COUNT(*) FROM zsets WHERE key = ?", (name,))[0][0]
+
+    def zscore(self, name, value):
+        rows = self._read("SELECT score FROM zsets WHERE key = ? AND member = ?", (name, _encode(value)))
+        return rows[0][0] if rows else None
+
+    def zrange(self, name, start, end, desc=False, withscores=False):
+        first, stop = _indexes(start, end, self.zcard(name) if start < 0 or end < 0 else end + 1)
+        if stop <= first:
+            return []
+        order = "DESC" if desc else "ASC"
+        rows = self._read(
+            f"SELECT member, score FROM zsets WHERE key = ? ORDER BY score {order}, member {order} LIMIT ? OFFSET ?",
+            (name, stop - first, first)
+        )
+        return [(bytes(member), score) for member, score in rows] if withscores else [bytes(row[0]) for row in rows]
+
+    def zrangebyscore(self, name, min, max, withscores=False):
+        rows = self._read(
+            "SELECT member, score FROM zsets WHERE key = ? AND score >= ? AND score <= ? ORDER BY score, member",
+            (name, _bound(min), _bound(max))
+        )
+        return [(bytes(member), score) for member, score in rows] if withscores else [bytes(row[0]) for row in rows]
+
+    def zremrangebyscore(self, name, min, max):
+        with self._write() as conn:
+            return conn.execute(
+                "DELETE FROM zsets WHERE key = ? AND score >= ? AND score <= ?", (name, _bound(min), _bound(max))
+            ).rowcount
+
+
+# ----------------------------------
+# Connecting
+# ----------------------------------
+def connect_state(url):
+    """
+    Open the shared state store at url:
+
+    - "redis://host:6379/0" (or rediss://, unix://): a Redis server, through
+      redis-py (pip install -r requirements-redis.txt)
+    - "sqlite:///path/state.sqlite3", or just a path: a SQLite file
+    - "memory://": this process only
+    """
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("Shared state on Redis needs redis-py: pip install -r requirements-redis.txt") from e
+        return redis.Redis.from_url(url)
+    if url.startswith("memory://"):
+        return MemoryState()
+    return SQLiteState(url.removeprefix("sqlite:///") if url.startswith("sqlite:///") else url)
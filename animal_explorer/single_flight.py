@@ -0,0 +1,165 @@
+import hashlib
+import threading
+from concurrent.futures import Future
+
+
+class _Call:
+    def __init__(self, shared):
+        self.future = Future()
+        self.shared = shared
+        self.waiters = 0
+
+
+# ----------------------------------
+# Request Coalescing
+# ----------------------------------
+class SingleFlight:
+    """
+    Lets concurrent identical requests share one piece of work.
+
+    The first caller for a (kind, key) pair does the work; anyone asking
+    for the same pair before it finishes waits for that result instead of
+    starting their own. Once it's done the key is forgotten, so later calls
+    run fresh (caches are what make those fast). Meant to be created once
+    per process and shared by every session thread.
+
+    With a shared state store (shared_state.py) the first caller also takes
+    a lock for the pair there, held for at most lease seconds. A caller in
+    another worker process that finds it taken waits for it to be free and
+    then does the work itself, which by then mostly means finding the answer
+    in the shared caches.
+
+    With a Metrics object every call is counted in "single_flight_calls_total"
+    by kind and role: "leader" (did the work), "joiner" (shared a leader's
+    result) or "waited_remote" (a leader that first waited for another worker).
+    """
+
+    def __init__(self, state=None, lease=120.0, prefix="flight", metrics=None):
+        self.state = state
+        self.metrics = metrics
+        self.lease = lease
+        self.prefix = prefix
+        self._calls = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _join(self, kind, key, shared):
+        with self._lock:
+            counts = self._counts.setdefault(kind, {"calls": 0, "coalesced": 0})
+            call = self._calls.get((kind, key))
+            leader = call is None
+            if leader:
+                call = self._calls[(kind, key)] = _Call(shared)
+                counts["calls"] += 1
+            else:
+                call.waiters += 1
+                counts["coalesced"] += 1
+        self._count(kind, "leader" if leader else "joiner")
+        return call, leader
+
+    def _count(self, kind, role):
+        if self.metrics is not None:
+            self.metrics.inc("single_flight_calls_total", kind=kind, role=role)
+
+    def _forget(self, kind, key, call):
+        with self._lock:
+            if self._calls.get((kind, key)) is call:
+                del self._calls[(kind, key)]
+
+    def _claim(self, kind, key):
+        """
+        Take the other workers' lock for (kind, key), first waiting for
+        whoever has it. Returns the lock, or None without a shared state (or
+        if the wait ran out, when the work just goes ahead).
+        """
+        if self.state is None:
+            return None
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        lock = self.state.lock(
+            f"{self.prefix}:{kind}:{digest}", timeout=self.lease, sleep=0.05, thread_local=False
+        )
+        if lock.acquire(blocking=False):
+            return lock
+        with self._lock:
+            counts = self._counts[kind]
+            counts["waited_remote"] = counts.get("waited_remote", 0) + 1
+        self._count(kind, "waited_remote")
+        return lock if lock.acquire(blocking=True, blocking_timeout=self.lease) else None
+
+    @staticmethod
+    def _release(lock):
+        if lock is None:
+            return
+        try:
+            lock.release()
+        except Exception:
+            # Held past its lease; another worker may be on it already
+            pass
+
+    def do(self, kind, key, fn, *args, shared=None, on_join=None, **kwargs):
+        """
+        Return fn(*args, **kwargs), or the result of an identical call already running.
+
+        shared is something the leader's work updates as it goes (e.g. a
+        dict of partial results); callers that join an existing call get
+        the leader's one passed to on_join(shared) so they can show the same
+        progress. Exceptions reach every caller.
+        """
+        call, leader = self._join(kind, key, shared)
+        if not leader:
+            if on_join is not None:
+                on_join(call.shared)
+            return call.future.result()
+
+        lock = None
+        try:
+            lock = self._claim(kind, key)
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.future.set_exception(e)
+            raise
+        else:
+            call.future.set_result(result)
+            return result
+        finally:
+            self._forget(kind, key, call)
+            self._release(lock)
+
+    def share(self, kind, key, start, done):
+        """
+        Like do(), for work that runs in the background: start() returns a
+        handle (e.g. an IdentifyJob) that every identical caller gets until
+        the future done(handle) resolves. With a shared state it may first
+        wait for another worker, like do().
+        """
+        call, leader = self._join(kind, key, None)
+        if not leader:
+            return call.future.result()
+
+        lock = None
+        try:
+            lock = self._claim(kind, key)
+            handle = start()
+        except BaseException as e:
+            call.future.set_exception(e)
+            self._forget(kind, key, call)
+            self._release(lock)
+            raise
+
+        def finish(_):
+            self._forget(kind, key, call)
+            self._release(lock)
+
+        call.future.set_result(handle)
+        done(handle).add_done_callback(finish)
+        return handle
+
+    def stats(self):
+        """
+        Per kind: upstream calls made and calls that joined one instead, plus what's in flight now.
+        """
+        with self._lock:
+            stats = {kind: dict(counts) for kind, counts in self._counts.items()}
+            for (kind, _), call in self._calls.items():
+                stats[kind]["in_flight"] = stats[kind].get("in_flight", 0) + 1
+        return stats
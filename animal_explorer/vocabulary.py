@@ -0,0 +1,146 @@
+import json
+import os
+import re
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_NAMES_PATH = os.path.join(DATA_DIR, "animal_names.txt")
+DEFAULT_SEED_PATH = os.path.join(DATA_DIR, "animal_facts.json")
+
+# Phrases that contain an animal word but aren't animals; matching them
+# first stops "hot dog" from being read as a dog
+NOT_ANIMALS = ("hot dog", "corn dog", "teddy bear", "gummy bear", "bull dozer", "bulldozer", "cat walk")
+
+# ----------------------------------
+# Names
+# ----------------------------------
+def normalize_name(text):
+    """
+    Lowercase, drop punctuation and squash spaces: "Red-Panda!" -> "red panda"
+    """
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def singular(word):
+    """
+    A rough singular for plain English plurals, good enough for animal names
+    """
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def name_variants(name):
+    """
+    The normalized name plus its singular form, e.g. "brown bears" -> {"brown bears", "brown bear"}
+    """
+    name = normalize_name(name)
+    if not name:
+        return set()
+    return {name, " ".join(singular(word) for word in name.split())}
+
+
+def _words(text):
+    return [singular(word) for word in normalize_name(text).split()]
+
+
+# ----------------------------------
+# Vocabulary Trie
+# ----------------------------------
+_END = ""  # never a real word, so it can't clash with a child
+
+
+class AnimalVocabulary:
+    """
+    Word-level trie of animal names, plurals and synonyms.
+
+    find() walks a caption once, taking the longest name that starts at
+    each word ("polar bear" beats "bear"), so pulling the animal out of a
+    caption costs microseconds. Each phrase maps to a display name, or to
+    None for phrases that look like animals but aren't ("hot dog").
+    """
+
+    def __init__(self):
+        self._root = {}
+        self.size = 0
+
+    def add(self, phrase, name):
+        words = _words(phrase)
+        if not words:
+            return
+        node = self._root
+        for word in words:
+            node = node.setdefault(word, {})
+        if _END not in node:
+            self.size += 1
+        node[_END] = name
+
+    def find(self, text):
+        """
+        Return every animal mentioned in text as (display name, matched phrase), in order.
+        """
+        words = _words(text)
+        found = []
+        start = 0
+        while start < len(words):
+            node = self._root
+            end = None
+            for position in range(start, len(words)):
+                node = node.get(words[position])
+                if node is None:
+                    break
+                if _END in node:
+                    end, name = position + 1, node[_END]
+
+            if end is None:
+                start += 1
+                continue
+            if name is not None:
+                found.append((name, " ".join(words[start:end])))
+            start = end
+        return found
+
+    def extract(self, text):
+        """
+        The display name of the first animal in text, or None.
+        """
+        found = self.find(text)
+        return found[0][0] if found else None
+
+    def __len__(self):
+        return self.size
+
+
+def load_vocabulary(names_path=DEFAULT_NAMES_PATH, seed_path=DEFAULT_SEED_PATH):
+    """
+    Build the vocabulary from the fact book seed and the animal names list.
+
+    The names list is read last, so its more specific names win: a "jaguar"
+    is a Jaguar even if the fact book files it under a close relative.
+    """
+    vocabulary = AnimalVocabulary()
+    for phrase in NOT_ANIMALS:
+        vocabulary.add(phrase, None)
+
+    if seed_path and os.path.exists(seed_path):
+        with open(seed_path, encoding="utf-8") as f:
+            for entry in json.load(f)["animals"]:
+                for phrase in [entry["animal_name"]] + entry.get("aliases", []):
+                    vocabulary.add(phrase, entry["animal_name"])
+
+    if names_path and os.path.exists(names_path):
+        with open(names_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                name, _, synonyms = line.partition("|")
+                name = name.strip()
+                for phrase in [name] + synonyms.split(","):
+                    if phrase.strip():
+                        vocabulary.add(phrase, name)
+
+    return vocabulary
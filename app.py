@@ -1,10 +1,29 @@
 import streamlit as st
-import requests
 import json
 import base64
-from PIL import Image
-import io
+import hashlib
+import hmac
+import os
+import uuid
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from animal_explorer.result_cache import ResultCache, SharedResultCache
+from animal_explorer.hedging import ModelStats
+from animal_explorer.jobs import JobScheduler, QueueFull
+from animal_explorer.rate_limit import ModelRateLimiter, caller
+from animal_explorer.history import DetectionHistory, SharedDetectionHistory, copy_history
+from animal_explorer.batch import batch_stats, rows_to_csv, rows_to_json, run_batch
+from animal_explorer.fact_parser import parse_animal_info
+from animal_explorer.knowledge_base import AnimalKnowledgeBase
+from animal_explorer.answer_cache import AnswerCache, SharedAnswerCache
+from animal_explorer.single_flight import SingleFlight
+from animal_explorer.conversation import Conversation
+from animal_explorer.vocabulary import load_vocabulary
+from animal_explorer.metrics import Metrics, serve_metrics
+from animal_explorer.models import CHAT_MODELS, VISION_MODELS
+from animal_explorer.prompts import PROMPT_VERSION
+# The HTTP clients, the async pipeline and anything using PIL are imported
+# where they're first built, so the first page doesn't wait for them
 
 # ----------------------------------
 # Page Configuration
@@ -19,461 +38,991 @@ st.set_page_config(
 # ----------------------------------
 # Custom CSS - Kid-Friendly Design
 # ----------------------------------
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Comic+Neue:wght@400;700&display=swap');
-    
-    body, p, span, div, li {
-        font-family: 'Comic Neue', cursive, sans-serif !important;
-    }
-    
-    h1, h2, h3 {
-        font-family: 'Comic Neue', cursive, sans-serif !important;
-    }
-    
-    .main {
-        background: linear-gradient(135deg, #fef3c7 0%, #bfdbfe 50%, #ddd6fe 100%);
-    }
-    
-    [data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #10b981 0%, #059669 100%);
-    }
-    
-    [data-testid="stSidebar"] * {
-        color: white !important;
-        font-size: 18px !important;
-    }
-    
-    h1 {
-        color: #dc2626;
-        font-family: 'Comic Neue', cursive !important;
-        font-weight: 700;
-        text-align: center;
-        padding: 20px;
-        font-size: 2.5em !important;
-        text-shadow: 3px 3px 6px rgba(0,0,0,0.2);
-    }
-    
-    h2, h3 {
-        color: #ea580c;
-        font-weight: bold;
-        font-size: 1.3em;
-    }
-    
-    .stButton>button {
-        background: linear-gradient(90deg, #f59e0b 0%, #ef4444 100%);
-        color: white;
-        border: none;
-        padding: 15px 35px;
-        font-size: 18px !important;
-        font-weight: bold;
-        border-radius: 50px;
-        box-shadow: 0 6px 20px rgba(239, 68, 68, 0.4);
-        transition: all 0.3s ease;
-        width: 100%;
-        cursor: pointer;
-    }
-    
-    .stButton>button:hover {
-        transform: scale(1.05) translateY(-3px);
-        box-shadow: 0 8px 25px rgba(239, 68, 68, 0.6);
-        background: linear-gradient(90deg, #ef4444 0%, #f59e0b 100%);
-    }
-    
-    .result-card {
-        background: white;
-        padding: 30px;
-        border-radius: 20px;
-        box-shadow: 0 8px 20px rgba(0,0,0,0.15);
-        margin: 15px 0;
-        color: #2d2d2d;
-        border: 4px solid #fbbf24;
-    }
-    
-    .result-card h2, .result-card h3 {
-        color: #dc2626 !important;
-        font-size: 1.4em !important;
-    }
-    
-    .result-card p, .result-card strong, .result-card li {
-        color: #333333 !important;
-        font-size: 1em !important;
-        line-height: 1.6;
-    }
-    
-    .animal-card {
-        background: linear-gradient(135deg, #34d399 0%, #3b82f6 100%);
-        color: white;
-        padding: 30px;
-        border-radius: 20px;
-        margin: 15px 0;
-        border: 5px solid #fbbf24;
-        box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-    }
-    
-    .animal-card h2, .animal-card h3, .animal-card p, .animal-card strong {
-        color: white !important;
-        font-size: 1.1em !important;
-    }
-    
-    .chat-message {
-        padding: 15px;
-        border-radius: 15px;
-        margin: 15px 0;
-        font-size: 1em;
-        color: #2d2d2d;
-        border: 3px solid transparent;
-    }
-    
-    .chat-message strong {
-        color: #1a1a1a !important;
-        font-size: 1em !important;
-    }
-    
-    .user-message {
-        background: linear-gradient(135deg, #bfdbfe 0%, #93c5fd 100%);
-        margin-left: 15%;
-        color: #1e40af;
-        border-color: #3b82f6;
-    }
-    
-    .user-message strong {
-        color: #1e3a8a !important;
-    }
-    
-    .bot-message {
-        background: linear-gradient(135deg, #d1fae5 0%, #a7f3d0 100%);
-        margin-right: 15%;
-        color: #065f46;
-        border-color: #10b981;
-    }
-    
-    .bot-message strong {
-        color: #064e3b !important;
-    }
-    
-    .feature-card {
-        background: linear-gradient(135deg, #fef3c7 0%, #fde68a 100%);
-        padding: 25px;
-        border-radius: 20px;
-        box-shadow: 0 6px 15px rgba(0,0,0,0.1);
-        text-align: center;
-        transition: transform 0.3s;
-        color: #333333;
-        border: 4px solid #f59e0b;
-        cursor: pointer;
-    }
-    
-    .feature-card:hover {
-        transform: scale(1.1) rotate(2deg);
-    }
-    
-    .feature-card h3 {
-        color: #dc2626 !important;
-        font-size: 1.3em !important;
-    }
-    
-    .feature-card p {
-        color: #555555 !important;
-        font-size: 1em !important;
-    }
+# Kept in static/style.css. With static serving on (.streamlit/config.toml)
+# a rerun only sends a <link>, and the browser keeps the file; without it
+# the styles are inlined.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Bundle the home page photo as static/<HERO_IMAGE> to serve it locally
+HERO_IMAGE = "red_panda.jpg"
+HERO_IMAGE_FALLBACK_URL = "https://images.unsplash.com/photo-1497752531616-c3afd9760a11?w=800"
+
+@st.cache_resource
+def static_asset(name):
+    """
+    A bundled file's bytes and a short content hash for its URL, read once
+    (None, None if it isn't bundled)
+    """
+    path = os.path.join(STATIC_DIR, name)
+    if not os.path.isfile(path):
+        return None, None
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()[:12]
+
+def static_url(name):
+    """
+    Where the browser fetches a bundled file, or None if it can't
     
-    .stat-box {
-        background: linear-gradient(135deg, #fae8ff 0%, #e9d5ff 100%);
-        padding: 25px;
-        border-radius: 20px;
-        text-align: center;
-        box-shadow: 0 6px 15px rgba(0,0,0,0.1);
-        color: #333333;
-        border: 4px solid #a855f7;
-    }
+    The content hash in the URL means a changed file is never read from a stale cache
+    """
+    data, version = static_asset(name)
+    if data is None or not st.get_option("server.enableStaticServing"):
+        return None
+    return f"app/static/{name}?v={version}"
+
+def load_styles():
+    url = static_url("style.css")
+    if url:
+        st.markdown(f'<link rel="stylesheet" href="{url}">', unsafe_allow_html=True)
+    else:
+        st.markdown(f"<style>{static_asset('style.css')[0].decode()}</style>", unsafe_allow_html=True)
+
+load_styles()
+
+# ----------------------------------
+# Initialize Session State
+# ----------------------------------
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = None
+if 'animal_context' not in st.session_state:
+    st.session_state.animal_context = None
+if 'user_id' not in st.session_state:
+    # Kept in the page address, so a refresh or a bookmark finds the same collection
+    user_id = st.query_params.get("user", "")[:64]
+    if not user_id:
+        user_id = uuid.uuid4().hex[:12]
+        st.query_params["user"] = user_id
+    st.session_state.user_id = user_id
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 0
+if 'stored_upload' not in st.session_state:
+    st.session_state.stored_upload = None
+if 'last_chat_timings' not in st.session_state:
+    st.session_state.last_chat_timings = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'identify_job_id' not in st.session_state:
+    st.session_state.identify_job_id = None
+if 'identify_result' not in st.session_state:
+    st.session_state.identify_result = None
+    st.session_state.identify_result_new = False
+if 'chat_job_id' not in st.session_state:
+    st.session_state.chat_job_id = None
+if 'batch_job_id' not in st.session_state:
+    st.session_state.batch_job_id = None
+    st.session_state.batch_result = None
+
+# ----------------------------------
+# API Configuration
+# ----------------------------------
+HF_API_KEY = st.secrets.get("HF_API_KEY", "")
+# Point at a stand-in server (e.g. bench/mock_hf_server.py) to try the app offline
+HF_API_URL = st.secrets.get("HF_API_URL", "")
+
+# Where captions come from: "remote" (VISION_MODELS, in animal_explorer/models.py) or "local"
+# (a BLIP model running on this computer's CPU, see requirements-local.txt)
+VISION_BACKEND = st.secrets.get("VISION_BACKEND", "remote")
+LOCAL_VISION_MODEL = "Salesforce/blip-image-captioning-base"
+LOCAL_VISION_QUANTIZE = True
+LOCAL_VISION_THREADS = 4
+# Only use weights already in the Hugging Face cache, never download them
+LOCAL_VISION_OFFLINE = False
+
+# The models that shape an answer, for cache keys
+if VISION_BACKEND == "local":
+    ANSWER_MODELS = [f"local:{LOCAL_VISION_MODEL}"] + CHAT_MODELS
+else:
+    ANSWER_MODELS = VISION_MODELS + CHAT_MODELS
+
+# ----------------------------------
+# Several App Workers
+# ----------------------------------
+# Leave empty for a single app process. To run several behind a load
+# balancer, point them all at one store: "sqlite:///path/state.sqlite3" for
+# workers on one machine, or "redis://host:6379/0" across machines. The
+# result and answer caches, detection history, rate limits and
+# single-flight locks then live there, so the workers act as one app
+STATE_URL = st.secrets.get("STATE_URL", "")
+# How often each worker picks up the photos the others identified, for near-duplicate matches
+PHASH_SYNC_SECONDS = 10
+
+@st.cache_resource
+def get_shared_state():
+    """
+    The store every app worker shares, or None with just one worker
+    """
+    if not STATE_URL:
+        return None
+    from animal_explorer.shared_state import connect_state
     
-    .stat-number {
-        font-size: 36px;
-        font-weight: bold;
-        color: #7c3aed;
-        text-shadow: 2px 2px 4px rgba(0,0,0,0.1);
-    }
+    return connect_state(STATE_URL)
+
+# ----------------------------------
+# Shared Hugging Face Connection
+# ----------------------------------
+# How often each model may be called, shared by everyone using the app
+MODEL_CALLS_PER_MINUTE = 60
+MODEL_CALL_BURST = 10
+# How often the API key may be used at all, across every model
+TOTAL_CALLS_PER_MINUTE = 120
+TOTAL_CALLS_PER_HOUR = int(st.secrets.get("HF_CALLS_PER_HOUR", 3000))
+# Don't take new work if it would wait longer than this in the queue
+MAX_QUEUE_SECONDS = 60
+
+# ----------------------------------
+# Metrics
+# ----------------------------------
+# Set METRICS_PORT in secrets to serve Prometheus metrics at
+# http://METRICS_HOST:METRICS_PORT/metrics, and ADMIN_TOKEN to open the
+# Grown-Ups page with ?admin=<token>
+METRICS_PORT = st.secrets.get("METRICS_PORT")
+METRICS_HOST = st.secrets.get("METRICS_HOST", "127.0.0.1")
+ADMIN_TOKEN = st.secrets.get("ADMIN_TOKEN", "")
+
+@st.cache_resource
+def get_metrics():
+    """
+    Timings, per-model counters and recent errors shared by every session
+    """
+    metrics = Metrics()
+    if METRICS_PORT:
+        try:
+            serve_metrics(metrics, int(METRICS_PORT), host=METRICS_HOST)
+        except (OSError, ValueError) as e:
+            metrics.error("metrics_endpoint", e)
+    return metrics
+
+def is_admin():
+    """
+    True if the page address carries the right ?admin= token
+    """
+    token = st.query_params.get("admin", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@st.cache_resource
+def get_rate_limiter():
+    """
+    Per-model and whole-key limits, with a fair queue that puts chat ahead of batches
+    """
+    return ModelRateLimiter(
+        default_per_minute=MODEL_CALLS_PER_MINUTE,
+        burst=MODEL_CALL_BURST,
+        global_per_minute=TOTAL_CALLS_PER_MINUTE,
+        quota_per_hour=TOTAL_CALLS_PER_HOUR,
+        state=get_shared_state()
+    )
+
+@st.cache_resource
+def get_hf_client():
+    """
+    One pooled, keep-alive client for every session, with retries, a
+    circuit breaker and the shared rate limiter
+    """
+    from animal_explorer.hf_client import HF_API_URL as DEFAULT_HF_API_URL, HFClient
+    
+    return HFClient(
+        HF_API_KEY,
+        base_url=HF_API_URL or DEFAULT_HF_API_URL,
+        rate_limiter=get_rate_limiter(),
+        metrics=get_metrics(),
+        health=get_model_health()
+    )
+
+def too_busy(priority="interactive"):
+    """
+    Say so and return True if new work would wait too long for the AI
+    """
+    eta = get_rate_limiter().eta(priority)
+    if eta <= MAX_QUEUE_SECONDS:
+        return False
+    st.warning(f"🐢 So many explorers right now! Please try again in about {eta:.0f} seconds.")
+    return True
+
+def show_queue_status():
+    """
+    Tell the kid where they are in line while their AI calls wait their turn
+    """
+    status = get_rate_limiter().status(st.session_state.session_id)
+    if status["waiting"] and status["eta"] >= 1:
+        st.caption(
+            f"🚶 Lots of explorers right now! You're number {status['position']} in line "
+            f"(about {status['eta']:.0f}s)."
+        )
+
+# ----------------------------------
+# Model Health
+# ----------------------------------
+# The free API unloads a model nobody has called for a few minutes, and the
+# next kid waits for it to load again. During class hours (server time, and
+# from 10 minutes before) every model gets a tiny call each
+# MODEL_WARM_SECONDS unless a real call just reached it; outside them only
+# each MODEL_IDLE_SECONDS, to keep the health table fresh
+MODEL_PROBES = True
+CLASS_HOURS = st.secrets.get("CLASS_HOURS", "Mon-Fri 07:45-15:30")
+MODEL_WARM_SECONDS = 240
+MODEL_IDLE_SECONDS = 1800
+# A model that's down is checked again after this, then twice as long each time
+MODEL_RETRY_SECONDS = 30
+# Probe a quarter as often while less than this share of the hourly quota is left
+PROBE_QUOTA_RESERVE = 0.2
+
+@st.cache_resource
+def get_model_health():
+    """
+    Which models are up, loading or down, learned from every call
+    """
+    from animal_explorer.health import ModelHealth
     
-    .stat-box div:not(.stat-number) {
-        color: #6b21a8 !important;
-        font-size: 1em !important;
-        font-weight: bold;
-    }
+    return ModelHealth()
+
+@st.cache_resource
+def get_health_prober():
+    """
+    Start probing the models from a background thread, once for the whole app
+    """
+    from animal_explorer.health import ClassHours, HealthProber
     
-    .fun-emoji {
-        font-size: 2.5em;
-        animation: wiggle 1s ease-in-out infinite;
-    }
+    try:
+        class_hours = ClassHours(CLASS_HOURS)
+    except ValueError as e:
+        get_metrics().error("class_hours", e)
+        class_hours = ClassHours()
+    
+    # Local captioning has nothing to keep warm
+    vision_models = VISION_MODELS if VISION_BACKEND == "remote" else []
+    return HealthProber(
+        get_hf_client(), vision_models, CHAT_MODELS, get_model_health(),
+        class_hours=class_hours,
+        warm_interval=MODEL_WARM_SECONDS,
+        idle_interval=MODEL_IDLE_SECONDS,
+        retry_interval=MODEL_RETRY_SECONDS,
+        quota_reserve=PROBE_QUOTA_RESERVE,
+        metrics=get_metrics()
+    ).start()
+
+# ----------------------------------
+# Request Coalescing
+# ----------------------------------
+@st.cache_resource
+def get_single_flight():
+    """
+    Shared by every session: a whole class sending the same photo or question
+    at once makes one set of AI calls instead of thirty (across every worker,
+    with a shared state)
+    """
+    return SingleFlight(state=get_shared_state(), metrics=get_metrics())
+
+# ----------------------------------
+# Result Cache
+# ----------------------------------
+CACHE_DIR = st.secrets.get("CACHE_DIR", ".cache")
+RESULT_CACHE_MAX_ENTRIES = 5000
+RESULT_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+@st.cache_resource
+def get_result_cache():
+    """
+    One result cache shared by every session, stored on disk so it survives restarts
+    """
+    state = get_shared_state()
+    if state is not None:
+        return SharedResultCache(state, max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_seconds=RESULT_CACHE_TTL_SECONDS)
+    return ResultCache(
+        os.path.join(CACHE_DIR, "results.sqlite3"),
+        max_entries=RESULT_CACHE_MAX_ENTRIES,
+        ttl_seconds=RESULT_CACHE_TTL_SECONDS
+    )
+
+# Photos whose perceptual hashes differ by at most this many bits (out of 64)
+# count as the same picture, e.g. a resized copy or a screenshot of it
+PHASH_THRESHOLD = 6
+PHASH_NAMESPACE = "|".join(ANSWER_MODELS) + f"|{PROMPT_VERSION}"
+
+@st.cache_resource
+def get_phash_index():
+    """
+    Near-duplicate photo index, rebuilt from the result cache on startup
+    """
+    from animal_explorer.phash import PerceptualIndex
     
-    @keyframes wiggle {
-        0%, 100% { transform: rotate(0deg); }
-        25% { transform: rotate(-10deg); }
-        75% { transform: rotate(10deg); }
-    }
+    index = PerceptualIndex(threshold=PHASH_THRESHOLD)
+    for phash, key in get_result_cache().iter_phashes(PHASH_NAMESPACE):
+        index.add(phash, key)
+    return index
+
+# ----------------------------------
+# Animal Fact Book
+# ----------------------------------
+# Fact sheets for animals we already know come from here instead of a chat model
+USE_FACT_BOOK = True
+
+@st.cache_resource
+def get_knowledge_base():
+    """
+    Shared fact book, seeded from animal_explorer/data and grown with every new animal
+    """
+    return AnimalKnowledgeBase(os.path.join(CACHE_DIR, "animal_facts.sqlite3"))
+
+@st.cache_resource
+def get_vocabulary():
+    """
+    Animal names trie, used to pull the animal out of a caption
+    """
+    return load_vocabulary()
+
+# ----------------------------------
+# Detection History
+# ----------------------------------
+HISTORY_PAGE_SIZE = 12
+HISTORY_THUMBNAIL_SIZE = 96
+
+@st.cache_resource
+def get_history():
+    """
+    Everyone's found animals, stored on disk with small thumbnails
     
-    .stAlert {
-        font-size: 1em !important;
-        border-radius: 15px;
-        border: 3px solid;
-    }
+    Moving to a shared state, the first worker to start copies in the
+    history kept on this machine so far
+    """
+    path = os.path.join(CACHE_DIR, "history.sqlite3")
+    state = get_shared_state()
+    if state is None:
+        return DetectionHistory(path, thumbnail_size=HISTORY_THUMBNAIL_SIZE)
+    
+    history = SharedDetectionHistory(state, thumbnail_size=HISTORY_THUMBNAIL_SIZE)
+    if os.path.exists(path) and state.set("history:copied", 1, nx=True):
+        copy_history(path, history)
+    return history
+
+def remember_detection(services, user_id, session_id, result, image, source="single", image_hash=None):
+    """
+    Add a found animal to the user's collection on the My Animals page
     
-    p, li, span, div {
-        font-size: 1em !important;
-        line-height: 1.5;
-    }
+    services comes from job_services(). With an image_hash the ready-made
+    thumbnail from the image store is used
+    """
+    if not user_id or result.get("error"):
+        return
+    try:
+        thumbnail = services["image_store"].thumbnail(image_hash, HISTORY_THUMBNAIL_SIZE) if image_hash else None
+        services["history"].add(user_id, session_id, result, image, source=source, thumbnail=thumbnail)
+    except Exception as e:
+        services["metrics"].error("history", e, source=source)
+
+# ----------------------------------
+# Image Store
+# ----------------------------------
+# Uploaded photos are kept on disk once per content hash, with WebP
+# thumbnails at these sizes; the least recently used go past the quota
+IMAGE_STORE_SIZES = (HISTORY_THUMBNAIL_SIZE, 256, 768)
+IMAGE_STORE_MAX_MB = 500
+PREVIEW_SIZE = 768
+
+@st.cache_resource
+def get_image_store():
+    """
+    Shared by every session, so a photo is decoded once however often it's shown
+    """
+    from animal_explorer.image_store import ImageStore
     
-    .red-panda-container {
-        text-align: center;
-        margin: 30px 0;
-    }
+    return ImageStore(
+        os.path.join(CACHE_DIR, "images"),
+        sizes=IMAGE_STORE_SIZES,
+        max_bytes=IMAGE_STORE_MAX_MB * 1024 * 1024
+    )
+
+def store_upload(uploaded_file):
+    """
+    Put an uploaded file in the image store once and return its content hash
     
-    .red-panda-container img {
-        border-radius: 30px;
-        border: 6px solid #f59e0b;
-        box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-    }
-</style>
-""", unsafe_allow_html=True)
+    Reruns with the same upload reuse the hash instead of reading the file again
+    """
+    stored = st.session_state.stored_upload
+    if stored and stored[0] == uploaded_file.file_id and get_image_store().has(stored[1]):
+        return stored[1]
+    image_hash = get_image_store().put(uploaded_file.getvalue())
+    st.session_state.stored_upload = (uploaded_file.file_id, image_hash)
+    return image_hash
 
 # ----------------------------------
-# Initialize Session State
+# Upload Size
 # ----------------------------------
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-if 'animal_context' not in st.session_state:
-    st.session_state.animal_context = None
-if 'detection_history' not in st.session_state:
-    st.session_state.detection_history = []
+# Photos are shrunk to this longest side and re-encoded before upload;
+# the captioning models never look at more than ~384px anyway
+UPLOAD_MAX_SIDE = 512
+UPLOAD_FORMAT = "JPEG"
+UPLOAD_QUALITY = 85
 
 # ----------------------------------
-# API Configuration
+# Racing the Vision Models
 # ----------------------------------
-HF_API_KEY = st.secrets.get("HF_API_KEY", "")
+# Start the next vision model if the current one hasn't answered after this
+# many seconds. Set to None to only move on when a model fails.
+VISION_HEDGE_DELAY_SECONDS = 4.0
 
-# Multiple model options for reliability
-VISION_MODELS = [
-    "Salesforce/blip-image-captioning-base",
-    "nlpconnect/vit-gpt2-image-captioning",
-    "Salesforce/blip-image-captioning-large"
-]
+@st.cache_resource
+def get_vision_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="vision")
 
-CHAT_MODELS = [
-    "mistralai/Mixtral-8x7B-Instruct-v0.1",
-    "meta-llama/Meta-Llama-3-8B-Instruct",
-    "HuggingFaceH4/zephyr-7b-beta"
-]
+@st.cache_resource
+def get_vision_stats():
+    """
+    Shared latency / success stats used to try the fastest healthy model first
+    """
+    return ModelStats()
+
+@st.cache_resource
+def get_vision_backend():
+    """
+    The captioning backend picked by VISION_BACKEND; local weights load on first use
+    
+    If the local model can't caption (not installed, no weights) the remote
+    models step in
+    """
+    from animal_explorer.vision_backends import FallbackVisionBackend, LocalBlipBackend, RemoteHFBackend
+    
+    remote = RemoteHFBackend(
+        get_hf_client(),
+        VISION_MODELS,
+        get_vision_executor(),
+        stats=get_vision_stats(),
+        hedge_delay=VISION_HEDGE_DELAY_SECONDS,
+        metrics=get_metrics()
+    )
+    if VISION_BACKEND == "local":
+        local = LocalBlipBackend(
+            LOCAL_VISION_MODEL,
+            quantize=LOCAL_VISION_QUANTIZE,
+            num_threads=LOCAL_VISION_THREADS,
+            local_files_only=LOCAL_VISION_OFFLINE
+        )
+        return FallbackVisionBackend(local, remote, metrics=get_metrics())
+    return remote
 
 # ----------------------------------
 # Hugging Face Vision API for Animal Detection
 # ----------------------------------
-def identify_animal_with_hf(image_data):
+def identify_animal_with_hf(image_data, original_bytes=None):
     """
     Identify animal using Hugging Face Vision API with kid-friendly responses
+    
+    original_bytes is the uploaded file's size, used to report upload savings.
+    If the same photo is already being identified for someone else, this
+    waits for that answer instead of asking the AI again.
     """
-    if not HF_API_KEY:
-        return {
-            "error": True,
-            "message": "Oops! We need to set up the AI first. Ask a grown-up to add the API key!"
-        }
+    return get_explorer().identify(image_data, original_bytes)
+
+# ----------------------------------
+# Async Identification Pipeline
+# ----------------------------------
+# Show the caption as soon as it arrives while the fact sheet is still being written
+ASYNC_PIPELINE = True
+
+@st.cache_resource
+def get_chat_stats():
+    return ModelStats()
+
+@st.cache_resource
+def get_identify_pipeline():
+    """
+    Shared async pipeline running on its own background event loop
+    """
+    from animal_explorer.async_pipeline import IdentifyPipeline
+    
+    return IdentifyPipeline(
+        get_hf_client(),
+        VISION_MODELS,
+        CHAT_MODELS,
+        parse=parse_animal_info,
+        vision_stats=get_vision_stats(),
+        chat_stats=get_chat_stats(),
+        hedge_delay=VISION_HEDGE_DELAY_SECONDS,
+        vision_backend=get_vision_backend() if VISION_BACKEND != "remote" else None,
+        knowledge_base=get_knowledge_base() if USE_FACT_BOOK else None,
+        vocabulary=get_vocabulary(),
+        metrics=get_metrics()
+    )
+
+def start_identification(image_data, original_bytes=None):
+    """
+    Start identifying a photo in the background and return its IdentifyJob
     
-    try:
-        # Convert PIL Image to bytes
-        img_byte_arr = io.BytesIO()
-        image_data.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        headers = {"Authorization": f"Bearer {HF_API_KEY}"}
-        
-        caption = None
-        model_used = None
-        
-        # Try multiple vision models
-        for model in VISION_MODELS:
-            try:
-                api_url = f"https://api-inference.huggingface.co/models/{model}"
-                response = requests.post(api_url, headers=headers, data=img_byte_arr, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    if isinstance(result, list) and len(result) > 0:
-                        caption = result[0].get('generated_text', '')
-                    else:
-                        caption = result.get('generated_text', '')
-                    
-                    if caption:
-                        model_used = model
-                        break
-                        
-            except Exception as e:
-                continue
-        
-        if not caption:
-            return {
-                "error": True,
-                "message": "Hmm, the AI is taking a nap right now. Please wait a moment and try again! 😴"
-            }
-        
-        # Create kid-friendly response based on caption
-        animal_name = caption.strip()
-        
-        # Try to enhance with chat model
-        enhanced_text = None
-        for chat_model in CHAT_MODELS:
-            try:
-                prompt = f"""Based on this image description: "{caption}"
-
-Provide animal information in a fun, kid-friendly way for children ages 6-12:
-
-Animal Name: [Common name]
-Scientific Name: [Scientific name]
-Animal Type: [Mammal/Bird/Reptile/Fish/Insect]
-Where They Live: [Habitat]
-What They Eat: [Diet]
-Are They Safe?: [Conservation status]
-Cool Facts:
-- [Fact 1]
-- [Fact 2]
-- [Fact 3]
-What They Look Like: [Description]
-
-Keep it fun and simple!"""
-
-                chat_url = f"https://api-inference.huggingface.co/models/{chat_model}"
-                chat_response = requests.post(
-                    chat_url,
-                    headers=headers,
-                    json={"inputs": prompt, "parameters": {"max_new_tokens": 400, "temperature": 0.7}},
-                    timeout=30
-                )
-                
-                if chat_response.status_code == 200:
-                    chat_result = chat_response.json()
-                    if isinstance(chat_result, list) and len(chat_result) > 0:
-                        enhanced_text = chat_result[0].get('generated_text', '')
-                    else:
-                        enhanced_text = chat_result.get('generated_text', '')
-                    
-                    if enhanced_text:
-                        # Clean up the response
-                        if prompt in enhanced_text:
-                            enhanced_text = enhanced_text.replace(prompt, '').strip()
-                        break
-                        
-            except Exception as e:
-                continue
-        
-        # Use enhanced text if available, otherwise create simple response
-        if enhanced_text and len(enhanced_text) > 50:
-            response_text = enhanced_text
-        else:
-            response_text = f"""Animal Name: {animal_name}
-Scientific Name: Scientific classification varies
-Animal Type: Based on the image
-Where They Live: Various habitats
-What They Eat: Depends on the species
-Are They Safe?: Status varies by species
-Cool Facts:
-- This animal was identified from your photo!
-- Every animal is unique and special!
-- Animals help keep nature balanced!
-What They Look Like: {caption}"""
-        
-        return {
-            "error": False,
-            "text": response_text,
-            "model_used": f"Hugging Face ({model_used})"
-        }
-        
-    except Exception as e:
-        return {
-            "error": True,
-            "message": f"Oops! Something went wrong: {str(e)}"
-        }
+    Cached photos come back as an already finished job, and a photo that's
+    already being identified for someone else shares that job
+    """
+    return get_explorer().start_identification(image_data, original_bytes)
 
 # ----------------------------------
 # Hugging Face Chat Functions (Kid-Friendly)
 # ----------------------------------
-def chat_with_hf(user_message, context=None):
+# Stream answers word by word on the Ask Questions page
+CHAT_STREAMING = True
+# Once a streamed answer is this long, stop at the end of the current sentence
+STREAM_STOP_CHARS = 400
+
+# Answers are shared between everyone asking the same thing about the same animal
+CHAT_CACHE_MAX_ENTRIES = 2000
+CHAT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+# Also reuse answers to reworded questions ("what does a panda eat" ~ "What do pandas eat?")
+CHAT_CACHE_SEMANTIC = True
+
+# The fun question buttons, answered ahead of time when the app starts
+QUICK_QUESTIONS = [
+    "What's the biggest animal on Earth?",
+    "How do dolphins talk to each other?",
+    "What do pandas eat?",
+    "How fast can a cheetah run?",
+    "Why do elephants have trunks?",
+    "Can penguins fly?"
+]
+
+CHAT_PARAMETERS = {
+    "max_new_tokens": 250,
+    "temperature": 0.7,
+    "top_p": 0.9
+}
+
+# Each session keeps this many chat messages; older ones shrink into a short summary
+CHAT_KEEP_TURNS = 20
+CHAT_SUMMARY_TOKENS = 80
+# Most of the chat so far sent along with a follow-up question
+CHAT_CONTEXT_TOKENS = 300
+# Messages drawn on the Ask Questions page
+CHAT_VISIBLE_TURNS = 8
+
+def get_conversation():
+    """
+    This session's chat, made on first use
+    """
+    if st.session_state.conversation is None:
+        st.session_state.conversation = Conversation(
+            max_turns=CHAT_KEEP_TURNS,
+            summary_tokens=CHAT_SUMMARY_TOKENS,
+            vocabulary=get_vocabulary()
+        )
+    return st.session_state.conversation
+
+def chat_so_far(question):
+    """
+    The earlier chat to send with a question, or None if it stands on its own
+    
+    "What do they eat?" needs the chat so far; "What do sharks eat?" and
+    first questions don't, so they keep sharing cached answers with everyone
+    """
+    conversation = get_conversation()
+    if not len(conversation) or get_vocabulary().extract(question):
+        return None
+    return conversation.window(CHAT_CONTEXT_TOKENS) or None
+
+@st.cache_resource
+def get_answer_cache():
+    """
+    One chat answer cache shared by every session, stored on disk
+    """
+    state = get_shared_state()
+    if state is not None:
+        return SharedAnswerCache(
+            state,
+            max_entries=CHAT_CACHE_MAX_ENTRIES,
+            ttl_seconds=CHAT_CACHE_TTL_SECONDS,
+            semantic=CHAT_CACHE_SEMANTIC,
+            vocabulary=get_vocabulary()
+        )
+    return AnswerCache(
+        os.path.join(CACHE_DIR, "answers.sqlite3"),
+        max_entries=CHAT_CACHE_MAX_ENTRIES,
+        ttl_seconds=CHAT_CACHE_TTL_SECONDS,
+        semantic=CHAT_CACHE_SEMANTIC,
+        vocabulary=get_vocabulary()
+    )
+
+@st.cache_resource
+def get_explorer():
+    """
+    The identify and chat logic (animal_explorer/explorer.py), wired to the
+    app's shared clients and caches
+    """
+    from animal_explorer.explorer import AnimalExplorer
+    
+    return AnimalExplorer(
+        get_hf_client(),
+        get_vision_backend(),
+        CHAT_MODELS,
+        answer_models=ANSWER_MODELS,
+        prompt_version=PROMPT_VERSION,
+        result_cache=get_result_cache(),
+        phash_index=get_phash_index(),
+        phash_namespace=PHASH_NAMESPACE,
+        knowledge_base=get_knowledge_base() if USE_FACT_BOOK else None,
+        vocabulary=get_vocabulary(),
+        answer_cache=get_answer_cache(),
+        single_flight=get_single_flight(),
+        pipeline=get_identify_pipeline() if ASYNC_PIPELINE else None,
+        upload_max_side=UPLOAD_MAX_SIDE,
+        upload_format=UPLOAD_FORMAT,
+        upload_quality=UPLOAD_QUALITY,
+        chat_parameters=CHAT_PARAMETERS,
+        stream_stop_chars=STREAM_STOP_CHARS,
+        metrics=get_metrics(),
+        phash_sync_seconds=PHASH_SYNC_SECONDS if get_shared_state() is not None else None
+    )
+
+def chat_with_hf(user_message, context=None, history=None):
     """
     Chat with Hugging Face AI about animals - kid-friendly version
+    
+    Someone already asking the same thing? Wait for their answer instead
     """
-    if not HF_API_KEY:
-        return "Oops! We need to set up the AI first. Ask a grown-up to add the API key!"
+    return get_explorer().ask(user_message, context, history)
+
+def chat_with_hf_stream(user_message, context=None, timings=None, history=None):
+    """
+    Same as chat_with_hf, but yields the answer bit by bit while the model writes it
     
-    try:
-        headers = {"Authorization": f"Bearer {HF_API_KEY}"}
-        
-        if context:
-            prompt = f"""You are a super friendly animal expert talking to kids in grades 1-6 (ages 6-12).
+    If timings (a dict) is given, it gets the model used, the seconds until the
+    first word arrived and the total seconds
+    """
+    return get_explorer().ask_stream(user_message, context, timings, history)
+
+# ----------------------------------
+# Background Jobs
+# ----------------------------------
+# AI calls run on a shared thread pool instead of inside the button handler,
+# so clicking around while the AI works doesn't throw the work away
+JOB_WORKERS = 8
+MAX_JOBS_PER_SESSION = 3
+JOB_POLL_SECONDS = 0.5
 
-Current animal: {context.get('animal_name', 'Unknown')}
-Type: {context.get('animal_type', 'N/A')}
-Where it lives: {context.get('habitat', 'N/A')}
+@st.cache_resource
+def get_job_scheduler():
+    return JobScheduler(max_workers=JOB_WORKERS, max_per_session=MAX_JOBS_PER_SESSION)
 
-Answer this question in a fun, exciting way using simple words: {user_message}
+def job_services():
+    """
+    The shared objects background jobs use, looked up in the session thread
+    
+    The cached get_*() helpers need the script's context, which job threads
+    don't have, so jobs are handed these instead of calling them
+    """
+    return {
+        "explorer": get_explorer(),
+        "history": get_history(),
+        "image_store": get_image_store(),
+        "single_flight": get_single_flight(),
+        "answer_cache": get_answer_cache(),
+        "metrics": get_metrics()
+    }
 
-Keep your answer short (2-3 sentences), fun, and easy to understand for kids!"""
+def run_identify_job(job, services, image_data, original_bytes=None, user_id=None, image_hash=None):
+    """
+    Identify a photo in the background, sharing the caption as soon as it's known
+    
+    The animal is saved to user_id's collection even if they've left the page
+    """
+    explorer = services["explorer"]
+    with caller(job.session_id, "interactive"):
+        if ASYNC_PIPELINE:
+            pipeline_job = explorer.start_identification(image_data, original_bytes)
+            job.partial["caption"] = pipeline_job.caption.result()
+            result = pipeline_job.result.result()
         else:
-            prompt = f"""You are a super friendly animal expert talking to kids ages 6-12. Answer this question about animals in a fun, exciting way using simple words: {user_message}
+            result = explorer.identify(image_data, original_bytes)
+    
+    remember_detection(services, user_id, job.session_id, result, image_data, image_hash=image_hash)
+    return result
 
-Keep your answer short (2-3 sentences), fun, and easy to understand for kids! Use emojis if it helps! 🐾"""
+def run_chat_job(job, services, question, context=None, history=None):
+    """
+    Answer a question in the background, collecting the streamed words in job.partial
+    """
+    from animal_explorer.explorer import chat_key
+    
+    explorer = services["explorer"]
+    with caller(job.session_id, "interactive"):
+        if not CHAT_STREAMING:
+            return {"text": explorer.ask(question, context, history), "timings": None}
         
-        # Try multiple chat models
-        for chat_model in CHAT_MODELS:
-            try:
-                chat_url = f"https://api-inference.huggingface.co/models/{chat_model}"
-                response = requests.post(
-                    chat_url,
-                    headers=headers,
-                    json={
-                        "inputs": prompt,
-                        "parameters": {
-                            "max_new_tokens": 250,
-                            "temperature": 0.7,
-                            "top_p": 0.9
-                        }
-                    },
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if isinstance(result, list) and len(result) > 0:
-                        text = result[0].get('generated_text', '')
-                    else:
-                        text = result.get('generated_text', '')
-                    
-                    # Extract only the response part (remove the prompt)
-                    if prompt in text:
-                        text = text.replace(prompt, '').strip()
-                    
-                    if text and len(text) > 10:
-                        return text
-                        
-            except Exception as e:
-                continue
+        # The same question already streaming for someone else? Watch that one instead
+        def follow(partial):
+            job.partial = partial
         
-        # Fallback response
-        return "That's a great question! Animals are amazing creatures. Try asking again in a moment! 🐾"
+        return services["single_flight"].do(
+            "chat_stream", chat_key(question, context, history), stream_chat_answer,
+            explorer, job.partial, question, context, history, shared=job.partial, on_join=follow
+        )
+
+def stream_chat_answer(explorer, partial, question, context=None, history=None):
+    """
+    Stream an answer into partial["text"] and return it with its timings
+    """
+    timings = {}
+    partial["text"] = ""
+    for token in explorer.ask_stream(question, context, timings, history):
+        partial["text"] += token
+    return {"text": partial["text"], "timings": timings}
+
+def run_prewarm_job(job, services):
+    """
+    Answer the quick questions that aren't cached yet, so they're instant for everyone
+    """
+    answer_cache = services["answer_cache"]
+    with caller(job.session_id, "batch"):
+        for question in QUICK_QUESTIONS:
+            if not answer_cache.contains(question):
+                services["explorer"].ask(question)
+    return {"cached": sum(answer_cache.contains(question) for question in QUICK_QUESTIONS)}
+
+@st.cache_resource
+def prewarm_quick_answers():
+    """
+    Start answering the quick questions and the model health probes once,
+    when the app starts
+    """
+    if not HF_API_KEY:
+        return None
+    if MODEL_PROBES:
+        get_health_prober()
+    return get_job_scheduler().submit("app", "prewarm", run_prewarm_job, job_services())
+
+def collect_identify_job():
+    """
+    Move a finished identification job's result into the session
+    """
+    job_id = st.session_state.identify_job_id
+    if not job_id:
+        return
+    
+    job = get_job_scheduler().get(job_id)
+    if job is not None and not job.done:
+        return
+    
+    if job is None:
+        result = {"error": True, "message": "Oops! We lost track of your picture. Please try again! 🙈"}
+    elif job.status == "failed":
+        result = {"error": True, "message": f"Oops! Something went wrong: {job.error}"}
+    else:
+        result = job.result
+    
+    st.session_state.identify_job_id = None
+    st.session_state.identify_result = result
+    st.session_state.identify_result_new = True
+    
+    if not result.get("error"):
+        st.session_state.animal_context = result["animal_info"]
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def watch_identify_job():
+    """
+    Show how the identification is going, and rerun the page once it's done
+    """
+    job = get_job_scheduler().get(st.session_state.identify_job_id)
+    if job is None or job.done:
+        st.rerun()
+    
+    caption = job.partial.get("caption")
+    if caption:
+        st.info(f"👀 The AI sees: {caption}")
+        st.write("📚 Finding super cool facts...")
+    else:
+        st.write("🤖 AI is looking at your picture... This is so cool! ✨")
+    show_queue_status()
+
+# ----------------------------------
+# Batch Mode (Lots of Pictures at Once)
+# ----------------------------------
+BATCH_CONCURRENCY = 4
+
+def run_batch_job(job, services, files, user_id=None):
+    """
+    Identify a list of (name, bytes) photos, sharing the progress table as it fills in
+    """
+    image_store = services["image_store"]
+    
+    def identify(name, data):
+        # The same photo twice in a batch is decoded once
+        image_hash = image_store.put(data)
+        image = image_store.image(image_hash)
+        result = services["explorer"].identify(image, len(data))
+        remember_detection(services, user_id, job.session_id, result, image, source="batch", image_hash=image_hash)
+        return result
+    
+    def progress(rows):
+        job.partial["rows"] = rows
+    
+    # Batches give way to kids waiting on a single answer
+    with caller(job.session_id, "batch"):
+        rows, stats = run_batch(files, identify, concurrency=BATCH_CONCURRENCY, progress=progress)
+    return {"rows": rows, "stats": stats}
+
+def show_batch_stats(stats):
+    col1, col2, col3 = st.columns(3)
+    col1.metric("📸 Pictures per Minute", f"{stats['images_per_minute']:.1f}")
+    col2.metric("⏱️ Average per Picture", f"{stats['mean_seconds']:.1f}s")
+    col3.metric("🐢 Slowest 5%", f"{stats['p95_seconds']:.1f}s")
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def watch_batch_job():
+    """
+    Show the batch progress table while it fills in, and rerun the page once it's done
+    """
+    job = get_job_scheduler().get(st.session_state.batch_job_id)
+    if job is None or job.done:
+        st.rerun()
+    
+    rows = job.partial.get("rows", [])
+    finished = [row for row in rows if row["status"] in ("done", "error")]
+    if rows:
+        st.progress(len(finished) / len(rows), text=f"🔍 Checked {len(finished)} of {len(rows)} pictures...")
+        latencies = [row["seconds"] for row in finished if not row["duplicate_of"]]
+        show_batch_stats(batch_stats(latencies, job.seconds, len(finished)))
+        st.dataframe(rows, width="stretch", hide_index=True)
+    else:
+        st.write("🤖 Getting ready to look at your pictures...")
+    show_queue_status()
+
+def render_batch_mode():
+    """
+    Teacher mode: upload a whole folder of photos and identify them together
+    """
+    st.markdown("### 📚 Find Lots of Animals at Once!")
+    st.info("Drop in all your field-trip photos! Pictures that are exactly the same are only checked once. 🏫")
+    
+    batch_files = st.file_uploader(
+        "Choose animal images",
+        type=["jpg", "jpeg", "png"],
+        accept_multiple_files=True,
+        key="batch_upload",
+        label_visibility="collapsed"
+    )
+    
+    if batch_files and st.button(f"🔍 Find All {len(batch_files)} Animals!", width="stretch") and not too_busy("batch"):
+        try:
+            job = get_job_scheduler().submit(
+                st.session_state.session_id, "batch", run_batch_job, job_services(),
+                [(uploaded.name, uploaded.getvalue()) for uploaded in batch_files],
+                user_id=st.session_state.user_id
+            )
+            st.session_state.batch_job_id = job.id
+            st.session_state.batch_result = None
+        except QueueFull:
+            st.warning("🐢 Whoa, the AI is still busy with your other pictures! Wait a moment and try again.")
+    
+    job_id = st.session_state.batch_job_id
+    if job_id:
+        job = get_job_scheduler().get(job_id)
+        if job is None or job.done:
+            st.session_state.batch_job_id = None
+            if job is None or job.status == "failed":
+                st.error("Oops! Something went wrong with your pictures. Please try again! 🙈")
+            else:
+                st.session_state.batch_result = job.result
+        else:
+            watch_batch_job()
+    
+    batch_result = st.session_state.batch_result
+    if batch_result:
+        st.markdown("### 🎉 All Done!")
+        show_batch_stats(batch_result["stats"])
+        st.dataframe(batch_result["rows"], width="stretch", hide_index=True)
         
-    except Exception as e:
-        return f"Oops! The AI is resting right now. Please try again! 😊"
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                "📄 Download as CSV",
+                rows_to_csv(batch_result["rows"]),
+                file_name="animals.csv",
+                mime="text/csv",
+                width="stretch"
+            )
+        with col2:
+            st.download_button(
+                "🧾 Download as JSON",
+                rows_to_json(batch_result["rows"], batch_result["stats"]),
+                file_name="animals.json",
+                mime="application/json",
+                width="stretch"
+            )
+
+def ask_animal_expert(question, with_context=True):
+    """
+    Add a question to the chat and start answering it in the background
+    
+    with_context=False asks about animals in general, not the one we found
+    """
+    context = st.session_state.animal_context if with_context else None
+    if too_busy():
+        return
+    try:
+        job = get_job_scheduler().submit(
+            st.session_state.session_id, "chat", run_chat_job, job_services(), question, context,
+            chat_so_far(question)
+        )
+    except QueueFull:
+        st.warning("🐢 Whoa, slow down! The expert is still answering your other questions.")
+        return
+    
+    get_conversation().add('user', question)
+    st.session_state.chat_job_id = job.id
+    st.rerun()
+
+def collect_chat_job():
+    """
+    Add a finished answer to the chat history
+    """
+    job_id = st.session_state.chat_job_id
+    if not job_id:
+        return
+    
+    job = get_job_scheduler().get(job_id)
+    if job is not None and not job.done:
+        return
+    
+    if job is None or job.status == "failed":
+        response = "Oops! The AI is resting right now. Please try again! 😊"
+    else:
+        response = job.result["text"]
+        st.session_state.last_chat_timings = job.result["timings"]
+    
+    st.session_state.chat_job_id = None
+    get_conversation().add('assistant', response)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def watch_chat_job():
+    """
+    Show the answer as it's being written, and rerun the page once it's done
+    """
+    job = get_job_scheduler().get(st.session_state.chat_job_id)
+    if job is None or job.done:
+        st.rerun()
+    
+    text = job.partial.get("text")
+    if text:
+        st.markdown(f"""
+        <div class="chat-message bot-message">
+            <strong>🦉 Animal Expert Says:</strong> {text}
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.write("🤔 Thinking...")
+        show_queue_status()
+
 
 # ----------------------------------
 # Sidebar
 # ----------------------------------
 st.sidebar.markdown("# 🌟 Let's Explore!")
 st.sidebar.markdown("---")
+page_names = ["🏠 Home", "🔍 Find Animals", "💬 Ask Questions", "📚 My Animals"]
+if is_admin():
+    page_names.append("🛠️ Grown-Ups")
 app_mode = st.sidebar.selectbox(
     "Where do you want to go?", 
-    ["🏠 Home", "🔍 Find Animals", "💬 Ask Questions", "📚 My Animals"]
+    page_names
 )
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 🎉 Your Stats")
-st.sidebar.metric("Animals You Found", len(st.session_state.detection_history))
+st.sidebar.metric("Animals You Found", get_history().count(st.session_state.user_id))
 st.sidebar.metric("Animals We Know", "1,000+")
 st.sidebar.metric("Fun Level", "⭐⭐⭐⭐⭐")
 
@@ -505,9 +1054,13 @@ if app_mode == "🏠 Home":
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        # FIXED: Replaced use_container_width=True with width="stretch" per logs
-        st.image("https://images.unsplash.com/photo-1497752531616-c3afd9760a11?w=800", 
-                 width="stretch", caption="Red Pandas are super cute and love to climb trees!")
+        # A plain <img>, so reruns don't send the photo again and the browser keeps it
+        st.markdown(f"""
+        <div class="red-panda-container">
+            <img class="hero-image" src="{static_url(HERO_IMAGE) or HERO_IMAGE_FALLBACK_URL}" alt="A red panda">
+            <p class="hero-caption">Red Pandas are super cute and love to climb trees!</p>
+        </div>
+        """, unsafe_allow_html=True)
     
     st.markdown("<br>", unsafe_allow_html=True)
     
@@ -650,6 +1203,15 @@ elif app_mode == "🔍 Find Animals":
         st.error("⚠️ Oops! We need to set up the AI first. Ask a grown-up to add the API key!")
         st.stop()
     
+    find_mode = st.radio(
+        "How many pictures?",
+        ["📸 One Picture", "📚 Lots of Pictures (for teachers)"],
+        horizontal=True
+    )
+    if find_mode == "📚 Lots of Pictures (for teachers)":
+        render_batch_mode()
+        st.stop()
+    
     col1, col2 = st.columns([1, 1])
     
     with col1:
@@ -664,97 +1226,78 @@ elif app_mode == "🔍 Find Animals":
         )
         
         if uploaded_file:
-            image = Image.open(uploaded_file)
+            try:
+                image_hash = store_upload(uploaded_file)
+            except Exception as e:
+                get_metrics().error("image_store", e)
+                st.error("😕 Oops! We couldn't open that picture. Try a different photo!")
+                st.stop()
+            # A small ready-made preview, so reruns don't decode the photo again
             # FIXED: Replaced use_container_width=True with width="stretch" per logs
-            st.image(image, caption="Your Awesome Photo! 📸", width="stretch")
+            st.image(get_image_store().thumbnail(image_hash, PREVIEW_SIZE), caption="Your Awesome Photo! 📸", width="stretch")
             
             # FIXED: Applied width="stretch" to button as well since it was using use_container_width
-            if st.button("🔍 Find Out What Animal This Is!", width="stretch"):
-                with st.spinner("🤖 AI is looking at your picture... This is so cool! ✨"):
-                    result = identify_animal_with_hf(image)
+            if st.button("🔍 Find Out What Animal This Is!", width="stretch") and not too_busy():
+                try:
+                    job = get_job_scheduler().submit(
+                        st.session_state.session_id, "identify", run_identify_job, job_services(),
+                        get_image_store().image(image_hash), original_bytes=uploaded_file.size,
+                        user_id=st.session_state.user_id, image_hash=image_hash
+                    )
+                    st.session_state.identify_job_id = job.id
+                    st.session_state.identify_result = None
+                except QueueFull:
+                    st.warning("🐢 Whoa, the AI is still busy with your other pictures! Wait a moment and try again.")
+            
+            collect_identify_job()
+            if st.session_state.identify_job_id:
+                watch_identify_job()
+            
+            result = st.session_state.identify_result
+            if result:
+                if result.get("error"):
+                    st.error(result.get("message"))
+                else:
+                    animal_info = result["animal_info"]
+                    
+                    upload_stats = result.get("upload_stats")
+                    if upload_stats:
+                        st.caption(
+                            f"📦 Sent {upload_stats['encoded_bytes'] / 1024:.0f} KB instead of "
+                            f"{upload_stats['original_bytes'] / 1024:.0f} KB "
+                            f"(packed in {upload_stats['encode_ms']:.0f} ms)"
+                        )
                     
-                    if result.get("error"):
-                        st.error(result.get("message"))
-                    else:
-                        response_text = result.get("text", "")
+                    # Display results in col2
+                    with col2, get_metrics().span("render", view="result_card"):
+                        st.markdown("### 🎉 We Found It!")
+                        if st.session_state.identify_result_new:
+                            st.balloons()
+                            st.session_state.identify_result_new = False
                         
-                        # Extract information
-                        lines = response_text.split('\n')
-                        animal_info = {
-                            'animal_name': 'Mystery Animal',
-                            'scientific_name': 'N/A',
-                            'animal_type': 'N/A',
-                            'habitat': 'N/A',
-                            'diet': 'N/A',
-                            'conservation': 'N/A',
-                            'facts': [],
-                            'characteristics': 'N/A'
-                        }
+                        st.markdown(f"""
+                        <div class="animal-card">
+                            <h2>🐾 {animal_info['animal_name']}</h2>
+                            <p><strong>🔬 Science Name:</strong> {animal_info['scientific_name']}</p>
+                            <p><strong>🏷️ Type:</strong> {animal_info['animal_type']}</p>
+                            <p><strong>🏠 Where They Live:</strong> {animal_info['habitat']}</p>
+                            <p><strong>🍽️ What They Eat:</strong> {animal_info['diet']}</p>
+                            <p><strong>💚 Are They Safe?:</strong> {animal_info['conservation']}</p>
+                        </div>
+                        """, unsafe_allow_html=True)
                         
-                        current_section = None
-                        for line in lines:
-                            line = line.strip()
-                            if 'Animal Name:' in line or 'Name:' in line:
-                                animal_info['animal_name'] = line.split(':', 1)[1].strip()
-                            elif 'Scientific Name:' in line or 'Science Name:' in line:
-                                animal_info['scientific_name'] = line.split(':', 1)[1].strip()
-                            elif 'Animal Type:' in line or 'Type:' in line:
-                                animal_info['animal_type'] = line.split(':', 1)[1].strip()
-                            elif 'Where They Live:' in line or 'Habitat:' in line or 'Home:' in line:
-                                animal_info['habitat'] = line.split(':', 1)[1].strip()
-                            elif 'What They Eat:' in line or 'Diet:' in line or 'Food:' in line:
-                                animal_info['diet'] = line.split(':', 1)[1].strip()
-                            elif 'Are They Safe:' in line or 'Conservation' in line or 'Status:' in line:
-                                animal_info['conservation'] = line.split(':', 1)[1].strip()
-                            elif 'What They Look Like:' in line or 'Physical' in line or 'Looks:' in line:
-                                current_section = 'characteristics'
-                                animal_info['characteristics'] = line.split(':', 1)[1].strip() if ':' in line else ''
-                            elif 'Cool Facts:' in line or 'Fun Facts:' in line or 'Interesting Facts:' in line:
-                                current_section = 'facts'
-                            elif (line.startswith('*') or line.startswith('-') or line.startswith('•') or line.startswith('→')):
-                                if current_section == 'facts':
-                                    fact = line.lstrip('*-•→ ').strip()
-                                    if fact:
-                                        animal_info['facts'].append(fact)
-                                elif current_section == 'characteristics' and animal_info['characteristics'] == 'N/A':
-                                    animal_info['characteristics'] = line.lstrip('*-•→ ').strip()
+                        if animal_info['characteristics'] and animal_info['characteristics'] != 'N/A':
+                            st.markdown("### 👀 What They Look Like")
+                            st.success(animal_info['characteristics'])
                         
-                        # Store in session state
-                        st.session_state.animal_context = animal_info
-                        st.session_state.detection_history.append({
-                            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                            'animal_name': animal_info['animal_name'],
-                            'animal_type': animal_info['animal_type']
-                        })
+                        if animal_info['facts']:
+                            st.markdown("### 🌟 Super Cool Facts!")
+                            for i, fact in enumerate(animal_info['facts'], 1):
+                                if fact:
+                                    st.write(f"**{i}.** {fact}")
                         
-                        # Display results in col2
-                        with col2:
-                            st.markdown("### 🎉 We Found It!")
-                            st.balloons()
-                            
-                            st.markdown(f"""
-                            <div class="animal-card">
-                                <h2>🐾 {animal_info['animal_name']}</h2>
-                                <p><strong>🔬 Science Name:</strong> {animal_info['scientific_name']}</p>
-                                <p><strong>🏷️ Type:</strong> {animal_info['animal_type']}</p>
-                                <p><strong>🏠 Where They Live:</strong> {animal_info['habitat']}</p>
-                                <p><strong>🍽️ What They Eat:</strong> {animal_info['diet']}</p>
-                                <p><strong>💚 Are They Safe?:</strong> {animal_info['conservation']}</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            if animal_info['characteristics'] and animal_info['characteristics'] != 'N/A':
-                                st.markdown("### 👀 What They Look Like")
-                                st.success(animal_info['characteristics'])
-                            
-                            if animal_info['facts']:
-                                st.markdown("### 🌟 Super Cool Facts!")
-                                for i, fact in enumerate(animal_info['facts'], 1):
-                                    if fact:
-                                        st.write(f"**{i}.** {fact}")
-                            
-                            st.success("✅ Awesome! Now you can ask questions about this animal in the 'Ask Questions' page!")
-    
+                        st.success("✅ Awesome! Now you can ask questions about this animal in the 'Ask Questions' page!")
+
     with col2:
         if not uploaded_file:
             st.markdown("### 🎨 What Can You Find?")
@@ -805,22 +1348,41 @@ elif app_mode == "💬 Ask Questions":
     
     st.markdown("---")
     
-    # Chat History
+    collect_chat_job()
+    
+    # Chat History - only the newest messages are drawn, all in one go
+    conversation = get_conversation()
     chat_container = st.container()
     with chat_container:
-        for message in st.session_state.chat_history:
-            if message['role'] == 'user':
-                st.markdown(f"""
-                <div class="chat-message user-message">
-                    <strong>😊 You Asked:</strong> {message['content']}
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div class="chat-message bot-message">
-                    <strong>🦉 Animal Expert Says:</strong> {message['content']}
-                </div>
-                """, unsafe_allow_html=True)
+        hidden = conversation.hidden(CHAT_VISIBLE_TURNS)
+        if hidden:
+            st.caption(f"📜 {hidden} earlier messages are tucked away")
+        
+        with get_metrics().span("render", view="chat_history"):
+            messages = []
+            for message in conversation.visible(CHAT_VISIBLE_TURNS):
+                if message['role'] == 'user':
+                    messages.append(
+                        f'<div class="chat-message user-message"><strong>😊 You Asked:</strong> {message["content"]}</div>'
+                    )
+                else:
+                    messages.append(
+                        f'<div class="chat-message bot-message"><strong>🦉 Animal Expert Says:</strong> {message["content"]}</div>'
+                    )
+            if messages:
+                st.markdown("\n".join(messages), unsafe_allow_html=True)
+        
+        if st.session_state.chat_job_id:
+            watch_chat_job()
+    
+    timings = st.session_state.last_chat_timings
+    if timings and timings.get("cached"):
+        st.caption("⚡ Answered instantly - someone asked that before!")
+    elif timings and "first_token_seconds" in timings:
+        st.caption(
+            f"⚡ First words after {timings['first_token_seconds']:.1f}s, "
+            f"whole answer in {timings['total_seconds']:.1f}s"
+        )
     
     # Chat Input
     st.markdown("---")
@@ -837,50 +1399,234 @@ elif app_mode == "💬 Ask Questions":
         send_btn = st.button("Send! 📨", width="stretch")
     
     if send_btn and user_input:
-        st.session_state.chat_history.append({
-            'role': 'user',
-            'content': user_input
-        })
-        
-        with st.spinner("🤔 Thinking..."):
-            response = chat_with_hf(user_input, st.session_state.animal_context)
-        
-        st.session_state.chat_history.append({
-            'role': 'assistant',
-            'content': response
-        })
-        
-        st.rerun()
+        ask_animal_expert(user_input)
     
     # Quick Questions
-    if len(st.session_state.chat_history) == 0:
+    if len(conversation) == 0:
         st.markdown("### 💡 Fun Questions to Ask!")
-        quick_questions = [
-            "What's the biggest animal on Earth?",
-            "How do dolphins talk to each other?",
-            "What do pandas eat?",
-            "How fast can a cheetah run?",
-            "Why do elephants have trunks?",
-            "Can penguins fly?"
-        ]
-        
         cols = st.columns(2)
-        for i, question in enumerate(quick_questions):
+        for i, question in enumerate(QUICK_QUESTIONS):
             with cols[i % 2]:
+                # General questions, so everyone shares the answers cached at startup
                 if st.button(question, key=f"quick_{i}"):
-                    st.session_state.chat_history.append({
-                        'role': 'user',
-                        'content': question
-                    })
-                    response = chat_with_hf(question, st.session_state.animal_context)
-                    st.session_state.chat_history.append({
-                        'role': 'assistant',
-                        'content': response
-                    })
-                    st.rerun()
+                    ask_animal_expert(question, with_context=False)
     
     # Clear Chat
-    if len(st.session_state.chat_history) > 0:
+    if len(conversation) > 0:
         if st.button("🗑️ Clear Chat History"):
-            st.session_state.chat_history = []
+            conversation.clear()
+            st.rerun()
+
+# ----------------------------------
+# My Animals Page
+# ----------------------------------
+elif app_mode == "📚 My Animals":
+    st.markdown("<h1>📚 My Animal Collection! 🏆</h1>", unsafe_allow_html=True)
+    
+    history = get_history()
+    user_id = st.session_state.user_id
+    summary = history.summary(user_id)
+    
+    if summary["total"] == 0:
+        st.info("🐾 You haven't found any animals yet! Go to 'Find Animals' and upload a picture to start your collection!")
+        st.stop()
+    
+    # Counts come straight from the database, however long the collection gets
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.markdown(f"""
+        <div class="stat-box">
+            <div class="stat-number">{summary['total']}</div>
+            <div>Animals Found!</div>
+        </div>
+        """, unsafe_allow_html=True)
+    with col2:
+        st.markdown(f"""
+        <div class="stat-box">
+            <div class="stat-number">{summary['different']}</div>
+            <div>Different Kinds!</div>
+        </div>
+        """, unsafe_allow_html=True)
+    with col3:
+        st.markdown(f"""
+        <div class="stat-box">
+            <div class="stat-number">🥇</div>
+            <div>Favorite: {summary['animals'][0][1]}</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown("### 🏷️ Animal Types You Found")
+    st.bar_chart({animal_type: found for animal_type, found in summary["types"]}, horizontal=True)
+    
+    # Show every animal, or just one kind
+    choices = {"🌈 All my animals": None}
+    for animal_key, animal_name, found in summary["animals"]:
+        choices[f"🐾 {animal_name} ({found})"] = animal_key
+    choice = st.selectbox(
+        "Which animals do you want to see?", list(choices), key="history_filter",
+        on_change=lambda: st.session_state.update(history_page=0)
+    )
+    animal_key = choices[choice]
+    
+    total = summary["total"] if animal_key is None else history.count(user_id, animal_key)
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    page = min(st.session_state.history_page, pages - 1)
+    
+    # Only this page's rows and thumbnails are loaded
+    rows = history.page(user_id, page, HISTORY_PAGE_SIZE, animal_key)
+    cols = st.columns(4)
+    for i, row in enumerate(rows):
+        with cols[i % 4]:
+            if row["thumbnail"]:
+                st.image(row["thumbnail"], width=HISTORY_THUMBNAIL_SIZE)
+            st.markdown(f"**{row['animal_name']}**")
+            st.caption(
+                f"🏷️ {row['animal_type']} · 📅 {datetime.fromtimestamp(row['created']).strftime('%Y-%m-%d %H:%M')}"
+            )
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        if st.button("⬅️ Newer", disabled=page == 0, width="stretch"):
+            st.session_state.history_page = page - 1
+            st.rerun()
+    with col2:
+        st.markdown(f"<p style='text-align: center;'>Page {page + 1} of {pages}</p>", unsafe_allow_html=True)
+    with col3:
+        if st.button("Older ➡️", disabled=page >= pages - 1, width="stretch"):
+            st.session_state.history_page = page + 1
             st.rerun()
+    
+    st.markdown("---")
+    st.info("🔖 Bookmark this page to keep your collection - it's saved in the page address!")
+    if st.button("🗑️ Start a New Collection"):
+        history.clear(user_id)
+        st.session_state.history_page = 0
+        st.rerun()
+
+# ----------------------------------
+# Grown-Ups Page (only with ?admin=<ADMIN_TOKEN>)
+# ----------------------------------
+elif app_mode == "🛠️ Grown-Ups" and is_admin():
+    st.markdown("<h1>🛠️ How Is the App Doing?</h1>", unsafe_allow_html=True)
+    metrics = get_metrics()
+    counters = metrics.counters()
+    
+    def total(name, **labels):
+        return sum(
+            value for counter, counter_labels, value in counters
+            if counter == name and all(counter_labels.get(key) == wanted for key, wanted in labels.items())
+        )
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Photos identified", total("identify_total"))
+    col2.metric("Questions answered", total("chat_total"))
+    col3.metric("Model calls", total("hf_responses_total"))
+    col4.metric("Errors", total("errors_total"))
+    
+    # Every timed step, slowest first
+    st.markdown("### ⏱️ How Long Things Take")
+    timings = [
+        {
+            "step": name.removesuffix("_seconds"),
+            "labels": ", ".join(f"{key}={value}" for key, value in labels.items()),
+            "count": row["count"],
+            "p50 ms": round(row["p50"] * 1000, 1),
+            "p95 ms": round(row["p95"] * 1000, 1),
+            "p99 ms": round(row["p99"] * 1000, 1)
+        }
+        for name, labels, row in metrics.histograms()
+    ]
+    timings.sort(key=lambda row: row["p95 ms"], reverse=True)
+    st.dataframe(timings, width="stretch", hide_index=True)
+    
+    # What each model answered: status codes, timeouts, open circuits
+    st.markdown("### 🤖 Model Calls")
+    responses = {}
+    for name, labels, value in counters:
+        if name == "hf_responses_total":
+            row = responses.setdefault(labels["model"], {"model": labels["model"]})
+            row[labels["status"]] = value
+    st.dataframe(list(responses.values()), width="stretch", hide_index=True)
+    
+    # Identical requests that shared one call instead of making their own
+    st.markdown("### 🤝 Shared Requests")
+    flights = {}
+    for name, labels, value in counters:
+        if name == "single_flight_calls_total":
+            row = flights.setdefault(labels["kind"], {"kind": labels["kind"]})
+            row[labels["role"]] = value
+    st.dataframe(list(flights.values()), width="stretch", hide_index=True)
+    
+    # Up, loading or down, from real calls and the health probes
+    st.markdown("### 🩺 Model Health")
+    if MODEL_PROBES and HF_API_KEY:
+        prober = get_health_prober()
+        health_rows = prober.status()
+        in_class = prober.class_hours.active()
+        st.caption(
+            f"{'🏫 Class hours: keeping models warm' if in_class else '🌙 Outside class hours: probing now and then'}"
+            f" ({CLASS_HOURS or 'always'})"
+        )
+    else:
+        health_rows = get_model_health().snapshot()
+    st.dataframe([
+        {
+            "model": row["model"],
+            "state": row["state"],
+            "latency ms": round(row["latency"] * 1000) if row["latency"] is not None else None,
+            "failures": row["failures"],
+            "last status": row["last_status"],
+            "last ok": datetime.fromtimestamp(row["last_ok"]).strftime("%H:%M:%S") if row["last_ok"] else None,
+            "next probe in s": round(row["next_probe"]) if row.get("next_probe") is not None else None
+        }
+        for row in health_rows
+    ], width="stretch", hide_index=True)
+    
+    # Near-duplicate photos, the shared call budget and the background job queue
+    st.markdown("### 📦 Caches and Queues")
+    phash_stats = get_phash_index().stats()
+    limiter_stats = get_rate_limiter().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Look-alike photo hits", f"{phash_stats['hit_rate']:.0%}",
+                f"{phash_stats['hits']} of {phash_stats['hits'] + phash_stats['misses']}", delta_color="off")
+    col2.metric("Hourly calls left", f"{get_rate_limiter().quota_left():.0%}")
+    col3.metric("Calls waiting", sum(limiter_stats["queued"].values()), f"{limiter_stats['shed']} turned away",
+                delta_color="off")
+    col4.metric("Jobs running or waiting", get_job_scheduler().queue_depth())
+    st.caption(
+        f"{phash_stats['entries']} photos indexed · look-alike hits by bits apart: {phash_stats['hit_distances']}"
+        f" · calls served by priority: {limiter_stats['served']}"
+    )
+    
+    st.markdown("### 🚨 Recent Errors")
+    errors = metrics.recent_errors()
+    if not errors:
+        st.success("No errors so far! 🎉")
+    for error in errors:
+        when = datetime.fromtimestamp(error["time"]).strftime("%H:%M:%S")
+        labels = ", ".join(f"{key}={value}" for key, value in error["labels"].items())
+        with st.expander(f"{when} · {error['where']} · {error['type']}: {error['message'][:80]}"):
+            if labels:
+                st.caption(labels)
+            st.code(error["traceback"] or error["message"])
+    
+    st.markdown("---")
+    prometheus = metrics.render_prometheus()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("📥 Download Prometheus metrics", prometheus, file_name="metrics.txt", mime="text/plain")
+    with col2:
+        if st.button("🔄 Start Counting Again"):
+            metrics.reset()
+            st.rerun()
+    if METRICS_PORT:
+        st.caption(f"📡 Prometheus can scrape http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    with st.expander("Prometheus text"):
+        st.code(prometheus, language="text")
+
+# ----------------------------------
+# Warm Up
+# ----------------------------------
+# Runs once per app start, after the first page is out so it doesn't hold it up
+prewarm_quick_answers()
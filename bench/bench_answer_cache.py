@@ -0,0 +1,88 @@
+"""
+Check which reworded questions the chat answer cache answers from each other.
+
+Each pair is a question cached and one asked later, with whether the cached
+answer should be given. Reports the pairs it gets wrong and how long a
+semantic lookup takes with a full cache.
+
+    python bench/bench_answer_cache.py [--entries N] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from animal_explorer.answer_cache import AnswerCache
+from animal_explorer.vocabulary import load_vocabulary
+
+# (cached question, question asked, should it be answered from the cache)
+PAIRS = [
+    ("What do pandas eat?", "what does a panda eat", True),
+    ("How fast can a cheetah run?", "How fast can cheetahs run??", True),
+    ("Where do penguins live?", "where do the penguins live", True),
+    ("What do pandas eat?", "What do pandsa eat?", True),
+    ("What do pandas eat?", "What food do pandas eat?", True),
+    ("How do giraffes sleep?", "How do girafes sleep?", True),
+    ("What do elephants eat?", "What do elephants like to eat?", True),
+    ("What do sharks eat?", "What eats sharks?", False),
+    ("Do lions eat zebras?", "Do zebras eat lions?", False),
+    ("How big is a whale?", "How big is a whale shark?", False),
+    ("Can penguins fly?", "Can penguins swim?", False),
+    ("How long do polar bears live?", "How long do brown bears live?", False),
+    ("Is a dolphin a fish?", "Is a fish a dolphin?", False),
+    ("Why can penguins fly?", "Why can't penguins fly?", False),
+    ("Where do penguins live?", "Where do penguins sleep?", False),
+    ("How long do owls live?", "How long do owls sleep?", False),
+    ("Where do moose live?", "Where do mouse live?", False),
+    ("What do frogs eat?", "What do frogs eat when they are babies?", False),
+]
+
+
+def check_pairs(vocabulary, directory):
+    """
+    Return the pairs answered wrongly, as (cached, asked, expected, got).
+    """
+    mistakes = []
+    for index, (cached, asked, expected) in enumerate(PAIRS):
+        cache = AnswerCache(os.path.join(directory, f"pair{index}.sqlite3"), vocabulary=vocabulary)
+        cache.put(cached, "answer")
+        got = cache.get(asked) is not None
+        if got != expected:
+            mistakes.append((cached, asked, expected, got))
+    return mistakes
+
+
+def time_lookups(vocabulary, directory, entries, repeat):
+    cache = AnswerCache(os.path.join(directory, "full.sqlite3"), max_entries=entries, vocabulary=vocabulary)
+    for index in range(entries):
+        cache.put(f"What does animal number {index} eat?", "answer")
+    started = time.perf_counter()
+    for _ in range(repeat):
+        cache.get("What does animal number seven like to eat?")
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--entries", type=int, default=2000, help="cached questions for the timing")
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    vocabulary = load_vocabulary()
+    with tempfile.TemporaryDirectory() as directory:
+        mistakes = check_pairs(vocabulary, directory)
+        per_lookup = time_lookups(vocabulary, directory, args.entries, args.repeat)
+
+    print(f"pairs correct: {len(PAIRS) - len(mistakes)}/{len(PAIRS)}")
+    print(f"lookup time:   {per_lookup * 1e3:.2f} ms with {args.entries} cached questions")
+    for cached, asked, expected, got in mistakes:
+        print(f"  {cached!r} -> {asked!r}: expected {'hit' if expected else 'miss'}, got {'hit' if got else 'miss'}")
+
+    return 0 if not mistakes else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
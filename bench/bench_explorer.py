@@ -0,0 +1,322 @@
+"""
+Benchmark identifying photos and answering questions against a mock API.
+
+Starts bench/mock_hf_server.py in-process and drives the same code the app
+uses (animal_explorer.explorer.AnimalExplorer, plus image preprocessing and
+fact sheet parsing), then reports p50/p95/p99 latency, throughput and error
+rate per scenario. Needs no network and no API key.
+
+    python bench/bench_explorer.py [--profile healthy|flaky|slow] [--count N]
+    python bench/bench_explorer.py --save-baseline     # record bench/baselines/<profile>.json
+    python bench/bench_explorer.py --json results.json # also write the numbers out
+    python bench/bench_explorer.py --breakdown         # plus the time spent in each step
+    python bench/bench_explorer.py --repeat 5          # median of 5 runs (default 3)
+
+Each scenario is run --repeat times, each against a fresh mock server with
+its own seed, and the median of every figure is reported. If a baseline
+for the profile exists, the run is compared with it and the exit code is 1
+when a scenario got noticeably slower or less reliable. On the flaky
+profile a slower p95 is only reported: it depends on which few calls hit a
+hang or a retry, so only the error rates fail the run there.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+from animal_explorer.explorer import build_explorer
+from animal_explorer.fact_parser import parse_animal_info
+from animal_explorer.preprocess import prepare_image_for_upload
+from animal_explorer.prompts import CHAT_FALLBACK_MESSAGE, CHAT_RESTING_MESSAGE
+from mock_hf_server import PROFILES, MockHFServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+PARSER_CORPUS = os.path.join(BENCH_DIR, "parser_corpus.jsonl")
+
+VISION_MODELS = ["bench/vision-a", "bench/vision-b"]
+CHAT_MODELS = ["bench/chat-a", "bench/chat-b"]
+# Shorter than the mock server's hang, so hung calls time out instead of stalling the run
+CLIENT_TIMEOUT = 1.5
+
+SCENARIOS = ("preprocess", "parse", "identify", "identify_pipeline", "chat", "chat_stream", "chat_first_token")
+# A scenario regresses when its p95 grows by more than this fraction (and
+# at least REGRESSION_MIN_MS), or its error rate by more than REGRESSION_ERRORS
+REGRESSION_RATIO = 0.25
+REGRESSION_MIN_MS = 5.0
+REGRESSION_ERRORS = 0.05
+# Profiles whose p95 is too noisy to fail a run on; it's reported instead
+UNGATED_LATENCY_PROFILES = ("flaky",)
+
+
+# ----------------------------------
+# Inputs
+# ----------------------------------
+def make_photos(count, seed=7, size=(1600, 1200)):
+    """
+    Distinct phone-sized pictures, so nothing is answered from a cache.
+    """
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(count):
+        image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(size[0]), rng.randrange(size[1])
+            draw.ellipse((x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 400)),
+                         fill=tuple(rng.randrange(256) for _ in range(3)))
+        photos.append(image)
+    return photos
+
+
+def make_questions(count):
+    animals = ["pandas", "sharks", "owls", "frogs", "tigers", "koalas", "eagles", "octopuses"]
+    topics = ["eat", "sleep", "talk to each other", "stay warm", "find their way home"]
+    return [f"How do {animals[i % len(animals)]} {topics[(i // len(animals)) % len(topics)]}? (#{i})"
+            for i in range(count)]
+
+
+def load_parser_corpus():
+    with open(PARSER_CORPUS, encoding="utf-8") as f:
+        return [json.loads(line)["response"] for line in f if line.strip()]
+
+
+# ----------------------------------
+# Measuring
+# ----------------------------------
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(latencies, errors, elapsed):
+    count = len(latencies)
+    return {
+        "count": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+        "per_second": count / elapsed if elapsed else 0.0
+    }
+
+
+def median_results(runs):
+    """
+    The median of every figure for each scenario, over several runs of run_scenarios().
+    """
+    return {
+        name: {key: statistics.median(run[name][key] for run in runs) for key in runs[0][name]}
+        for name in runs[0]
+    }
+
+
+def measure(items, call, concurrency=1):
+    """
+    Run call(item) for every item and summarize. call returns True if it went wrong.
+    """
+    def timed(item):
+        started = time.perf_counter()
+        try:
+            failed = call(item)
+        except Exception:
+            failed = True
+        return time.perf_counter() - started, bool(failed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, items))
+    elapsed = time.perf_counter() - started
+    return summarize([seconds for seconds, _ in outcomes], sum(failed for _, failed in outcomes), elapsed)
+
+
+def bad_answer(text):
+    return not text or text in (CHAT_FALLBACK_MESSAGE, CHAT_RESTING_MESSAGE)
+
+
+# ----------------------------------
+# Scenarios
+# ----------------------------------
+def run_scenarios(explorer, count, concurrency, selected):
+    results = {}
+    photos = make_photos(count)
+    questions = make_questions(count)
+
+    if "preprocess" in selected:
+        results["preprocess"] = measure(photos, lambda image: not prepare_image_for_upload(image)[0])
+
+    if "parse" in selected:
+        corpus = load_parser_corpus()
+        responses = [corpus[i % len(corpus)] for i in range(max(count, len(corpus)) * 10)]
+        results["parse"] = measure(responses, lambda text: not parse_animal_info(text)["animal_name"])
+
+    if "identify" in selected:
+        results["identify"] = measure(
+            photos, lambda image: explorer.identify(image).get("error"), concurrency
+        )
+
+    if "identify_pipeline" in selected:
+        # Different pictures again, so the first run's answers don't help
+        pipeline_photos = make_photos(count, seed=8)
+        results["identify_pipeline"] = measure(
+            pipeline_photos,
+            lambda image: explorer.start_identification(image).result.result(timeout=60).get("error"),
+            concurrency
+        )
+
+    if "chat" in selected:
+        results["chat"] = measure(questions, lambda question: bad_answer(explorer.ask(question)), concurrency)
+
+    if "chat_stream" in selected or "chat_first_token" in selected:
+        first_tokens = []
+
+        def stream(question):
+            timings = {}
+            text = "".join(explorer.ask_stream(f"{question} (streamed)", timings=timings))
+            if "first_token_seconds" in timings:
+                first_tokens.append(timings["first_token_seconds"])
+            return bad_answer(text.strip())
+
+        started = time.perf_counter()
+        results["chat_stream"] = measure(questions, stream, concurrency)
+        elapsed = time.perf_counter() - started
+        results["chat_first_token"] = summarize(first_tokens, count - len(first_tokens), elapsed)
+
+    return {name: results[name] for name in SCENARIOS if name in results and name in selected}
+
+
+# ----------------------------------
+# Baselines
+# ----------------------------------
+def baseline_path(profile):
+    return os.path.join(BASELINE_DIR, f"{profile}.json")
+
+
+def compare(results, baseline, gate_latency=True):
+    """
+    List (scenario, what got worse, whether it fails the run) for every
+    regression against baseline. Slower p95s only fail it if gate_latency.
+    """
+    regressions = []
+    for name, now in results.items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        allowed = max(before["p95_ms"] * (1 + REGRESSION_RATIO), before["p95_ms"] + REGRESSION_MIN_MS)
+        if now["p95_ms"] > allowed:
+            regressions.append((name, f"p95 {before['p95_ms']:.1f} -> {now['p95_ms']:.1f} ms", gate_latency))
+        if now["error_rate"] > before["error_rate"] + REGRESSION_ERRORS:
+            regressions.append((name, f"errors {before['error_rate']:.0%} -> {now['error_rate']:.0%}", True))
+    return regressions
+
+
+def print_table(results, baseline=None):
+    print(f"{'scenario':<18} {'n':>5} {'err':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'/s':>8}  vs baseline p95")
+    for name, row in results.items():
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        change = f"{(row['p95_ms'] / before['p95_ms'] - 1):+.0%}" if before and before["p95_ms"] else ""
+        print(
+            f"{name:<18} {row['count']:>5} {row['error_rate']:>6.1%} {row['p50_ms']:>9.1f} "
+            f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['per_second']:>8.1f}  {change}"
+        )
+
+
+def print_breakdown(metrics):
+    """
+    Where the time went: every span the run recorded, by step and labels.
+    """
+    print(f"{'step':<18} {'labels':<44} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, labels, row in metrics.histograms():
+        described = ",".join(f"{key}={value}" for key, value in labels.items())
+        print(
+            f"{name.removesuffix('_seconds'):<18} {described[:44]:<44} {row['count']:>5} "
+            f"{row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f}"
+        )
+    errors = [(labels, value) for name, labels, value in metrics.counters() if name == "errors_total"]
+    for labels, value in errors:
+        print(f"errors {labels}: {value}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--profile", default="healthy", choices=sorted(PROFILES))
+    arg_parser.add_argument("--count", type=int, default=40, help="photos / questions per scenario")
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    arg_parser.add_argument("--seed", type=int, default=1234)
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs to take the median of (default: 3)")
+    arg_parser.add_argument("--json", help="write the results to this file")
+    arg_parser.add_argument("--save-baseline", action="store_true")
+    arg_parser.add_argument("--breakdown", action="store_true", help="also print the time spent in each step (last run)")
+    arg_parser.add_argument("--baseline", help="baseline file (default: bench/baselines/<profile>.json)")
+    args = arg_parser.parse_args()
+
+    selected = set(args.scenarios.split(","))
+    runs = []
+    server_counts = {}
+    for repeat in range(args.repeat):
+        server = MockHFServer(args.profile, seed=args.seed + repeat)
+        url = server.start()
+        # No cache directory: every call really goes through the (mock) API
+        explorer = build_explorer("bench-key", VISION_MODELS, CHAT_MODELS, base_url=url, timeout=CLIENT_TIMEOUT)
+        runs.append(run_scenarios(explorer, args.count, args.concurrency, selected))
+        server.shutdown()
+        for outcome, count in server.counts.items():
+            server_counts[outcome] = server_counts.get(outcome, 0) + count
+    results = median_results(runs)
+
+    report = {
+        "profile": args.profile,
+        "settings": {"count": args.count, "concurrency": args.concurrency, "seed": args.seed, "repeat": args.repeat},
+        "server": server_counts,
+        "scenarios": results
+    }
+
+    path = args.baseline or baseline_path(args.profile)
+    baseline = None
+    if not args.save_baseline and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(
+        f"profile {args.profile}, {args.count} per scenario, concurrency {args.concurrency}, "
+        f"median of {args.repeat} runs"
+    )
+    print(f"mock server: {server_counts}")
+    print_table(results, baseline)
+    if args.breakdown:
+        print()
+        print_breakdown(explorer.metrics)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"saved baseline {path}")
+        return 0
+
+    gate_latency = args.profile not in UNGATED_LATENCY_PROFILES
+    regressions = compare(results, baseline, gate_latency) if baseline else []
+    for name, what, fails in regressions:
+        print(f"{'REGRESSION' if fails else 'slower (not gated on this profile)'} {name}: {what}")
+    return 1 if any(fails for _, _, fails in regressions) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Benchmark the fact sheet parser on a corpus of recorded model answers.
+
+Each line of the corpus is {"response": "...", "expected": {field: value}}.
+Reports how many expected fields came out right and how long parsing takes.
+
+    python bench/bench_parser.py [corpus.jsonl] [--repeat N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from animal_explorer.fact_parser import parse_animal_info, parse_json_fact_sheet
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.jsonl")
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_accuracy(corpus):
+    """
+    Return (fields right, fields expected, json answers, list of mistakes).
+    """
+    right = total = json_answers = 0
+    mistakes = []
+    for index, entry in enumerate(corpus):
+        if parse_json_fact_sheet(entry["response"]) is not None:
+            json_answers += 1
+        parsed = parse_animal_info(entry["response"])
+        for field, expected in entry["expected"].items():
+            total += 1
+            if parsed[field] == expected:
+                right += 1
+            else:
+                mistakes.append((index, field, expected, parsed[field]))
+    return right, total, json_answers, mistakes
+
+
+def time_parsing(corpus, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for entry in corpus:
+            parse_animal_info(entry["response"])
+    elapsed = time.perf_counter() - started
+    return elapsed / (repeat * len(corpus))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    arg_parser.add_argument("--repeat", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    right, total, json_answers, mistakes = check_accuracy(corpus)
+    per_response = time_parsing(corpus, args.repeat)
+
+    print(f"responses:      {len(corpus)} ({json_answers} parsed as JSON)")
+    print(f"fields correct: {right}/{total}")
+    print(f"parse time:     {per_response * 1e6:.1f} us per response")
+    for index, field, expected, got in mistakes:
+        print(f"  #{index} {field}: expected {expected!r}, got {got!r}")
+
+    return 0 if not mistakes else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
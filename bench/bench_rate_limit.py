@@ -0,0 +1,102 @@
+"""
+Measure the rate limiter's own overhead and check how it paces calls.
+
+Several sessions take turns acquiring calls from a ModelRateLimiter with
+limits far above what the run needs, so the time per acquire() is the
+limiter's bookkeeping and fair queueing, not waiting for tokens.
+
+    python bench/bench_rate_limit.py [--sessions N] [--calls N]
+    python bench/bench_rate_limit.py --check   # pacing checks, a few seconds
+
+--check makes sure a 429 pause holds calls back for the pause and no
+longer: the hourly quota is left alone, so afterwards calls go through at
+the per-minute rate again.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from animal_explorer.rate_limit import ModelRateLimiter, caller
+
+MODEL = "bench/chat-a"
+
+
+def run(sessions, calls):
+    limiter = ModelRateLimiter(
+        default_per_minute=10 ** 9, burst=10 ** 6, global_per_minute=10 ** 9, quota_per_hour=10 ** 9
+    )
+
+    def session(index):
+        with caller(f"session-{index}"):
+            for _ in range(calls):
+                limiter.acquire(MODEL)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(session, range(sessions)))
+    return (time.perf_counter() - started) / (sessions * calls)
+
+
+def check():
+    """
+    Run the pacing checks and return the number that failed.
+    """
+    failures = []
+
+    def expect(what, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            failures.append(what)
+
+    limiter = ModelRateLimiter(
+        default_per_minute=600, burst=30, global_per_minute=600, global_burst=30, quota_per_hour=3000
+    )
+    before = limiter.quota_left()
+    limiter.pause(1.0)
+    expect("a pause leaves the hourly quota alone", limiter.quota_left() == before)
+
+    started = time.monotonic()
+    limiter.acquire(MODEL)
+    waited = time.monotonic() - started
+    expect(f"the first call after a 1s pause waits for it ({waited:.2f}s)", 0.8 <= waited <= 1.5)
+
+    started = time.monotonic()
+    for _ in range(20):
+        limiter.acquire(MODEL)
+    waited = time.monotonic() - started
+    # 20 calls at 10 a second, not at the quota's one every 1.2 seconds
+    expect(f"then calls go at the per-minute rate again ({waited:.2f}s for 20)", waited <= 3.0)
+
+    limiter = ModelRateLimiter(default_per_minute=600, burst=30, quota_per_hour=3000)
+    limiter.acquire(MODEL)
+    limiter.pause(0.5)
+    expect("with only a quota, a pause still leaves it alone", limiter.quota_left() > 0.99)
+    expect("and pauses the model buckets instead", limiter.bucket(MODEL).wait_time() > 0.3)
+
+    limiter = ModelRateLimiter(default_per_minute=600, burst=30, global_per_minute=600, quota_per_hour=3000)
+    limiter.pause(1.0, model=MODEL)
+    expect("pausing one model leaves the others alone", limiter.bucket("bench/chat-b").wait_time() == 0)
+    return len(failures)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--sessions", type=int, default=8, help="sessions taking turns")
+    arg_parser.add_argument("--calls", type=int, default=500, help="calls per session")
+    arg_parser.add_argument("--check", action="store_true", help="run the pacing checks instead")
+    args = arg_parser.parse_args()
+
+    if args.check:
+        return 1 if check() else 0
+
+    per_call = run(args.sessions, args.calls)
+    print(f"{args.sessions} sessions x {args.calls} calls: {per_call * 1e6:.1f} us per acquire()")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Time the shared state stores and check that app workers really share them.
+
+Times the commands the app uses most (get, set, zadd, a lock) on each store,
+which is what every shared cache lookup and rate limiter token costs.
+
+    python bench/bench_shared_state.py [--stores memory,sqlite] [--repeat N]
+    python bench/bench_shared_state.py --check   # two workers, no network needed
+
+--check plays two app workers on memory:// and on a SQLite state file
+(each worker with its own connection, as separate processes would have),
+both talking to bench/mock_hf_server.py. It checks that what one worker
+caches the other uses, that the same photo sent to both at once is only
+identified once, and that they take their calls from one rate limit.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from animal_explorer.explorer import build_explorer
+from animal_explorer.history import SharedDetectionHistory
+from animal_explorer.rate_limit import ModelRateLimiter
+from animal_explorer.result_cache import SharedResultCache
+from animal_explorer.shared_state import connect_state, locked
+from bench_explorer import CHAT_MODELS, CLIENT_TIMEOUT, VISION_MODELS, make_photos
+from mock_hf_server import MockHFServer
+
+
+def open_workers(store, directory):
+    """
+    Two connections to one store, as two app workers would hold. memory://
+    only lives in one process, so both workers get the same one.
+    """
+    if store == "memory":
+        state = connect_state("memory://")
+        return state, state
+    url = "sqlite:///" + os.path.join(directory, "state.sqlite3")
+    return connect_state(url), connect_state(url)
+
+
+# ----------------------------------
+# Timing
+# ----------------------------------
+def time_commands(state, repeat):
+    """
+    Microseconds per call of each command.
+    """
+    def lock(_):
+        with locked(state, "bench:lock"):
+            pass
+
+    commands = {
+        "set": lambda i: state.set(f"bench:{i % 100}", "x" * 200, ex=60),
+        "get": lambda i: state.get(f"bench:{i % 100}"),
+        "zadd": lambda i: state.zadd("bench:used", {f"key{i % 100}": time.time()}),
+        "lock": lock
+    }
+    timings = {}
+    for name, command in commands.items():
+        started = time.perf_counter()
+        for i in range(repeat):
+            command(i)
+        timings[name] = (time.perf_counter() - started) / repeat * 1e6
+    return timings
+
+
+# ----------------------------------
+# Checks
+# ----------------------------------
+def check_store(store, server, url, directory, expect):
+    first, second = open_workers(store, directory)
+    workers = [
+        build_explorer("check-key", VISION_MODELS, CHAT_MODELS, base_url=url, timeout=CLIENT_TIMEOUT, state=state)
+        for state in (first, second)
+    ]
+    photos = make_photos(2)
+
+    def calls():
+        return sum(server.counts.values())
+
+    before = calls()
+    result = workers[0].identify(photos[0])
+    solo = calls() - before
+    again = workers[1].identify(photos[0])
+    expect(f"{store}: a photo one worker identified is cached for the other",
+           again.get("cached") and calls() - before == solo)
+
+    before = calls()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        both = list(executor.map(lambda worker: worker.identify(photos[1]), workers))
+    expect(f"{store}: the same photo sent to both at once is identified once ({calls() - before} calls)",
+           calls() - before == solo and not any(row.get("error") for row in both))
+    expect(f"{store}: the second worker waited for the first one's lock",
+           workers[1].single_flight.stats().get("identify", {}).get("waited_remote", 0)
+           + workers[0].single_flight.stats().get("identify", {}).get("waited_remote", 0) == 1)
+
+    before = calls()
+    answer = workers[0].ask("How do pandas stay warm?")
+    asked = calls() - before
+    expect(f"{store}: an answer one worker got is cached for the other",
+           workers[1].ask("How do pandas stay warm?") == answer and calls() - before == asked)
+
+    limiters = [ModelRateLimiter(default_per_minute=600, quota_per_hour=100, state=state) for state in (first, second)]
+    for _ in range(40):
+        limiters[0].reserve(CHAT_MODELS[0])
+    expect(f"{store}: calls one worker made come out of the other's quota",
+           abs(limiters[1].quota_left() - 0.6) < 0.02)
+
+    histories = [SharedDetectionHistory(state) for state in (first, second)]
+    histories[0].add("kid", "session", result)
+    expect(f"{store}: a detection one worker saved is in the other's history", histories[1].count("kid") == 1)
+
+    caches = [SharedResultCache(state, ttl_seconds=1, prefix="check") for state in (first, second)]
+    caches[0].put("key", "a caption", "text", {"animal_name": "Panda"})
+    time.sleep(0.6)
+    caches[1].get("key")
+    time.sleep(0.6)
+    expect(f"{store}: an expired result isn't counted, however recently it was used", len(caches[1]) == 0)
+
+
+def check(stores):
+    """
+    Run the two-worker checks and return the number that failed.
+    """
+    failures = []
+
+    def expect(what, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            failures.append(what)
+
+    for store in stores:
+        server = MockHFServer("healthy", seed=1)
+        url = server.start()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                check_store(store, server, url, directory, expect)
+        finally:
+            server.shutdown()
+    return len(failures)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--stores", default="memory,sqlite")
+    arg_parser.add_argument("--repeat", type=int, default=2000)
+    arg_parser.add_argument("--check", action="store_true", help="run the two-worker checks instead")
+    args = arg_parser.parse_args()
+    stores = args.stores.split(",")
+
+    if args.check:
+        return 1 if check(stores) else 0
+
+    print(f"{'store':<8} " + " ".join(f"{name + ' us':>10}" for name in ("set", "get", "zadd", "lock")))
+    for store in stores:
+        with tempfile.TemporaryDirectory() as directory:
+            timings = time_commands(open_workers(store, directory)[0], args.repeat)
+        print(f"{store:<8} " + " ".join(f"{timings[name]:>10.1f}" for name in ("set", "get", "zadd", "lock")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
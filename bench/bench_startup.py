@@ -0,0 +1,212 @@
+"""
+Benchmark how fast the app starts and reruns.
+
+Measures, against bench/mock_hf_server.py so no network is needed:
+  import         importing what app.py imports up front, in a fresh interpreter
+  first_run      the very first run of the script in a fresh interpreter
+  rerun_<page>   a rerun of each page (what every click costs)
+and how much page content (markdown, HTML and CSS) each page sends per run.
+
+    python bench/bench_startup.py [--runs N] [--cold-runs N]
+    python bench/bench_startup.py --save-baseline     # record bench/baselines/startup.json
+    python bench/bench_startup.py --json results.json # also write the numbers out
+
+If the baseline exists, the run is compared with it and the exit code is 1
+when something got noticeably slower.
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+sys.path.insert(0, REPO_DIR)
+
+from bench_explorer import compare, print_table, summarize
+from mock_hf_server import MockHFServer
+
+PAGES = {
+    "home": "🏠 Home",
+    "find": "🔍 Find Animals",
+    "ask": "💬 Ask Questions",
+    "my_animals": "📚 My Animals"
+}
+BASELINE_PATH = os.path.join(BENCH_DIR, "baselines", "startup.json")
+
+
+def app_imports():
+    """
+    The modules app.py imports at the top, before it draws anything.
+    """
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return [module for module in modules if module != "streamlit"]
+
+
+# ----------------------------------
+# Fresh Interpreters
+# ----------------------------------
+IMPORT_CHILD = """
+import importlib, sys, time
+sys.path.insert(0, {repo!r})
+import streamlit
+started = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+print(time.perf_counter() - started)
+"""
+
+FIRST_RUN_CHILD = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=60)
+at.secrets["HF_API_KEY"] = "bench-key"
+at.secrets["HF_API_URL"] = {url!r}
+at.secrets["CACHE_DIR"] = {cache_dir!r}
+started = time.perf_counter()
+at.run()
+elapsed = time.perf_counter() - started
+print(elapsed if not at.exception else -1)
+"""
+
+
+def run_child(code):
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, cwd=REPO_DIR, timeout=300
+    ).stdout.strip().splitlines()
+    seconds = float(output[-1]) if output else -1
+    return seconds if seconds >= 0 else None
+
+
+def measure_cold(code, runs):
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        seconds = run_child(code)
+        if seconds is None:
+            errors += 1
+        else:
+            latencies.append(seconds)
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+# ----------------------------------
+# Reruns
+# ----------------------------------
+def page_payload(at):
+    """
+    Bytes of markdown, HTML and CSS the last run sent to the browser.
+    """
+    bodies = [element.value for element in at.markdown] + [element.value for element in at.get("html")]
+    return sum(len(str(body).encode()) for body in bodies)
+
+
+def measure_reruns(url, cache_dir, runs):
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest, local_script_runner
+
+    # A server compiles the script once and keeps the bytecode; AppTest would
+    # compile it again for every run, which isn't what a rerun costs
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+
+    at = AppTest.from_file(APP_PATH, default_timeout=60)
+    at.secrets["HF_API_KEY"] = "bench-key"
+    at.secrets["HF_API_URL"] = url
+    at.secrets["CACHE_DIR"] = cache_dir
+    at.run()
+
+    results, payloads = {}, {}
+    for name, label in PAGES.items():
+        at.sidebar.selectbox[0].select(label).run()
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(runs):
+            run_started = time.perf_counter()
+            at.run()
+            latencies.append(time.perf_counter() - run_started)
+            errors += bool(at.exception)
+        results[f"rerun_{name}"] = summarize(latencies, errors, time.perf_counter() - started)
+        payloads[name] = page_payload(at)
+    return results, payloads
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--runs", type=int, default=30, help="reruns per page")
+    arg_parser.add_argument("--cold-runs", type=int, default=5, help="fresh interpreters per cold scenario")
+    arg_parser.add_argument("--json", help="write the results to this file")
+    arg_parser.add_argument("--save-baseline", action="store_true")
+    arg_parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = arg_parser.parse_args()
+
+    # Like `streamlit run app.py`, so .streamlit/config.toml applies
+    os.chdir(REPO_DIR)
+    server = MockHFServer("healthy")
+    url = server.start()
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results["import"] = measure_cold(
+            IMPORT_CHILD.format(repo=REPO_DIR, modules=app_imports()), args.cold_runs
+        )
+        results["first_run"] = measure_cold(
+            FIRST_RUN_CHILD.format(app=APP_PATH, url=url, cache_dir=os.path.join(cache_dir, "first")),
+            args.cold_runs
+        )
+        reruns, payloads = measure_reruns(url, os.path.join(cache_dir, "reruns"), args.runs)
+        results.update(reruns)
+    server.shutdown()
+
+    report = {
+        "settings": {"runs": args.runs, "cold_runs": args.cold_runs},
+        "scenarios": results,
+        "page_bytes": payloads
+    }
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{args.runs} reruns per page, {args.cold_runs} fresh interpreters per cold scenario")
+    print_table(results, baseline)
+    before = (baseline or {}).get("page_bytes", {})
+    print("page content sent per run: " + ", ".join(
+        f"{name} {size / 1024:.1f} KB" + (f" (was {before[name] / 1024:.1f})" if name in before else "")
+        for name, size in payloads.items()
+    ))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"saved baseline {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline) if baseline else []
+    for name, what, _ in regressions:
+        print(f"REGRESSION {name}: {what}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Compare caption latency of the remote and local vision backends.
+
+Captions every image in a folder (or a few generated test pictures) with
+each backend and reports load time and per-image latency percentiles.
+
+    python bench/bench_vision_backends.py [--images DIR] [--backends remote,local]
+    python bench/bench_vision_backends.py --check   # offline checks, no torch needed
+
+The remote backend needs HF_API_KEY in the environment (or --base-url to
+point at a stand-in server); the local one needs requirements-local.txt.
+
+--check needs neither: it swaps in a stub torch and transformers and
+bench/mock_hf_server.py to check, with local_files_only=True, that the
+local weights load lazily and only once, and that captions fall back to
+the remote models when the local model can't be loaded.
+"""
+import argparse
+import contextlib
+import glob
+import os
+import statistics
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from animal_explorer.hf_client import HF_API_URL, HFClient
+from animal_explorer.metrics import Metrics
+from animal_explorer.preprocess import prepare_image_for_upload
+from animal_explorer.vision_backends import FallbackVisionBackend, LocalBlipBackend, RemoteHFBackend
+
+VISION_MODELS = [
+    "Salesforce/blip-image-captioning-base",
+    "nlpconnect/vit-gpt2-image-captioning",
+    "Salesforce/blip-image-captioning-large"
+]
+
+
+def load_images(folder, count):
+    if folder:
+        paths = sorted(glob.glob(os.path.join(folder, "*")))
+        images = [Image.open(path) for path in paths if path.lower().endswith((".jpg", ".jpeg", ".png"))]
+    else:
+        images = [
+            Image.effect_mandelbrot((1024, 768), (-2 + i * 0.1, -1.2, 1, 1.2), 64).convert("RGB")
+            for i in range(count)
+        ]
+    return [prepare_image_for_upload(image)[0] for image in images]
+
+
+def make_backend(name, args):
+    if name == "local":
+        return LocalBlipBackend(quantize=not args.no_quantize, num_threads=args.threads)
+    client = HFClient(os.environ.get("HF_API_KEY", ""), base_url=args.base_url)
+    return RemoteHFBackend(client, VISION_MODELS, ThreadPoolExecutor(max_workers=4), hedge_delay=4.0)
+
+
+def run(backend, images):
+    load_seconds = 0.0
+    if hasattr(backend, "load"):
+        started = time.perf_counter()
+        backend.load()
+        load_seconds = time.perf_counter() - started
+
+    latencies = []
+    failures = 0
+    for image_bytes in images:
+        started = time.perf_counter()
+        try:
+            _, caption = backend.caption(image_bytes)
+        except Exception:
+            caption = None
+        latencies.append(time.perf_counter() - started)
+        if not caption:
+            failures += 1
+    return load_seconds, latencies, failures
+
+
+# ----------------------------------
+# Offline Checks
+# ----------------------------------
+STUB_CAPTION = "a stub cat sitting on a stub mat"
+
+
+def stub_modules(weights_cached=True):
+    """
+    Stand-ins for torch and transformers, just enough for LocalBlipBackend.
+
+    from_pretrained() records its calls, and raises OSError like the real
+    one does with local_files_only=True when weights_cached is False.
+    """
+    loads = []
+
+    def from_pretrained(kind, result):
+        def load(name, local_files_only=False):
+            loads.append((kind, name, local_files_only))
+            if local_files_only and not weights_cached:
+                raise OSError(f"{name} isn't in the cache and local_files_only is set")
+            time.sleep(0.05)
+            return result
+        return load
+
+    class Processor:
+        def __call__(self, images=None, return_tensors=None):
+            return {"pixel_values": images}
+
+        def decode(self, output, skip_special_tokens=True):
+            return STUB_CAPTION
+
+    model = types.SimpleNamespace(eval=lambda: None, generate=lambda max_new_tokens=None, **inputs: [[1, 2]])
+
+    transformers = types.ModuleType("transformers")
+    transformers.BlipProcessor = types.SimpleNamespace(from_pretrained=from_pretrained("processor", Processor()))
+    transformers.BlipForConditionalGeneration = types.SimpleNamespace(
+        from_pretrained=from_pretrained("model", model)
+    )
+    torch = types.ModuleType("torch")
+    torch.set_num_threads = lambda threads: None
+    torch.inference_mode = contextlib.nullcontext
+    torch.nn = types.SimpleNamespace(Linear=object)
+    torch.qint8 = "qint8"
+    torch.quantization = types.SimpleNamespace(quantize_dynamic=lambda model, layers, dtype=None: model)
+    return {"torch": torch, "transformers": transformers}, loads
+
+
+@contextlib.contextmanager
+def swapped_modules(modules):
+    saved = {name: sys.modules.get(name) for name in modules}
+    sys.modules.update(modules)
+    try:
+        yield
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+def check():
+    """
+    Run the offline checks and return the number that failed.
+    """
+    from mock_hf_server import MockHFServer
+
+    failures = []
+
+    def expect(what, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            failures.append(what)
+
+    image_bytes = load_images(None, 1)[0]
+    server = MockHFServer("healthy", seed=1)
+    url = server.start()
+    remote = RemoteHFBackend(HFClient("check-key", base_url=url), VISION_MODELS, ThreadPoolExecutor(max_workers=4))
+    try:
+        modules, loads = stub_modules()
+        with swapped_modules(modules):
+            local = LocalBlipBackend(num_threads=2, local_files_only=True)
+            expect("nothing is loaded until the first caption", not local.loaded and not loads)
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                captions = list(executor.map(lambda _: local.caption(image_bytes), range(4)))
+            expect("four captions at once load the weights once", len(loads) == 2 and local.loaded)
+            expect("weights are only looked for locally", all(offline for _, _, offline in loads))
+            expect("the local model captions", all(caption == STUB_CAPTION for _, caption in captions))
+
+        modules, loads = stub_modules(weights_cached=False)
+        with swapped_modules(modules):
+            metrics = Metrics()
+            backend = FallbackVisionBackend(LocalBlipBackend(local_files_only=True), remote, metrics=metrics)
+            model_used, caption = backend.caption(image_bytes)
+            expect("without cached weights the remote models caption", bool(caption) and "Hugging Face" in model_used)
+            errors = metrics.recent_errors()
+            expect("the failed local load is recorded", any(error["where"] == "vision_backend" for error in errors))
+
+        # None in sys.modules makes the import fail, as if torch weren't installed
+        with swapped_modules({"torch": None, "transformers": None}):
+            backend = FallbackVisionBackend(LocalBlipBackend(local_files_only=True), remote)
+            model_used, caption = backend.caption(image_bytes)
+            expect("without torch the remote models caption", bool(caption) and "Hugging Face" in model_used)
+    finally:
+        server.shutdown()
+    return len(failures)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--images", help="folder of photos (default: generated pictures)")
+    arg_parser.add_argument("--count", type=int, default=5, help="generated pictures to use")
+    arg_parser.add_argument("--backends", default="remote,local")
+    arg_parser.add_argument("--base-url", default=HF_API_URL)
+    arg_parser.add_argument("--threads", type=int, default=4, help="torch threads for the local backend")
+    arg_parser.add_argument("--no-quantize", action="store_true")
+    arg_parser.add_argument("--check", action="store_true", help="run the offline checks instead")
+    args = arg_parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if check() else 0)
+
+    images = load_images(args.images, args.count)
+    print(f"{len(images)} images")
+    for name in args.backends.split(","):
+        try:
+            load_seconds, latencies, failures = run(make_backend(name, args), images)
+        except Exception as e:
+            print(f"{name:>7}: skipped ({e})")
+            continue
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        print(
+            f"{name:>7}: load {load_seconds:.2f}s  "
+            f"p50 {statistics.median(latencies) * 1000:.0f} ms  "
+            f"p95 {p95 * 1000:.0f} ms  "
+            f"failures {failures}/{len(latencies)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
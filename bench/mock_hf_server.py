@@ -0,0 +1,214 @@
+"""
+A local stand-in for the Hugging Face inference API, for offline benchmarks.
+
+Answers captioning calls (image bytes) with a caption, and text calls with
+the prompt plus an answer, the way the real API echoes its input. Each
+profile sets how long answers take (a log-normal latency) and how often a
+call gets a 503 "model is loading", a 429, or hangs past the client's
+timeout. "stream": true calls get server-sent events, one token at a time.
+
+    python bench/mock_hf_server.py [--profile flaky] [--port 8765]
+
+then set HF_API_URL = "http://127.0.0.1:8765/models" (and any HF_API_KEY)
+in .streamlit/secrets.toml to try the app offline.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latencies are medians in milliseconds with a log-normal spread (sigma);
+# loading / rate_limited / hang are the chance a call gets that instead
+PROFILES = {
+    "healthy": {
+        "vision_ms": 60, "chat_ms": 90, "sigma": 0.35, "token_ms": 4,
+        "loading": 0.0, "rate_limited": 0.0, "hang": 0.0
+    },
+    "flaky": {
+        "vision_ms": 60, "chat_ms": 90, "sigma": 0.6, "token_ms": 4,
+        "loading": 0.08, "rate_limited": 0.05, "hang": 0.02
+    },
+    "slow": {
+        "vision_ms": 400, "chat_ms": 700, "sigma": 0.5, "token_ms": 20,
+        "loading": 0.02, "rate_limited": 0.0, "hang": 0.05
+    }
+}
+# What a 503 or 429 asks the client to wait, and how long a hung call sleeps
+LOADING_SECONDS = 0.2
+RETRY_AFTER_SECONDS = 0.2
+HANG_SECONDS = 3.0
+
+# Captions handed out for photos, with the animal each one shows
+CAPTIONS = {
+    "a red panda sitting on a tree branch": "Red Panda",
+    "a dog sitting on a couch": "Dog",
+    "a close up of a lion laying in the grass": "Lion",
+    "a penguin standing on a rock": "Penguin",
+    "an orange and black butterfly on a flower": "Monarch Butterfly",
+    "a turtle swimming in the ocean": "Sea Turtle",
+    "a snow leopard on a snowy mountain": "Snow Leopard",
+    "a small tree frog on a green leaf": "Tree Frog"
+}
+
+CHAT_ANSWER = (
+    "Great question! These amazing animals are full of surprises. "
+    "They eat, sleep and play just like you do, and some can even do tricks! 🐾"
+)
+
+
+def fact_sheet_json(caption):
+    return json.dumps({
+        "animal_name": CAPTIONS.get(caption, "Mystery Animal"),
+        "scientific_name": "Animalia benchmarkus",
+        "animal_type": "Mammal",
+        "habitat": "Forests and mountains",
+        "diet": "Leaves, fruit and bugs",
+        "conservation": "Least Concern",
+        "facts": ["They are great climbers", "They love to nap", "They have thick fur"],
+        "characteristics": f"Looks like {caption}"
+    })
+
+
+# ----------------------------------
+# Request Handler
+# ----------------------------------
+class MockHFHandler(BaseHTTPRequestHandler):
+    server_version = "MockHF/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        outcome, latency = server.draw(self.path, body)
+        server.count(outcome)
+
+        if outcome == "hang":
+            time.sleep(HANG_SECONDS)
+            return self._send(504, {"error": "timed out"})
+        if outcome == "loading":
+            return self._send(503, {
+                "error": f"Model {self.path} is currently loading", "estimated_time": LOADING_SECONDS
+            })
+        if outcome == "rate_limited":
+            return self._send(429, {"error": "Rate limit reached"}, {"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+        time.sleep(latency)
+        if not body.startswith(b"{"):
+            captions = list(CAPTIONS)
+            caption = captions[int(hashlib.md5(body).hexdigest(), 16) % len(captions)]
+            return self._send(200, [{"generated_text": caption}])
+
+        payload = json.loads(body)
+        prompt = payload.get("inputs", "")
+        if payload.get("parameters", {}).get("max_new_tokens", 0) <= 1:
+            answer = "Hi"
+        elif "ONLY a JSON object" in prompt:
+            caption = prompt.split('"')[1] if '"' in prompt else "an animal"
+            answer = fact_sheet_json(caption)
+        else:
+            answer = CHAT_ANSWER
+
+        if payload.get("stream"):
+            return self._stream(answer)
+        self._send(200, [{"generated_text": prompt + answer}])
+
+    def _send(self, status, data, headers=None):
+        encoded = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(encoded)
+        except OSError:
+            pass
+
+    def _stream(self, answer):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for word in answer.split(" "):
+                time.sleep(self.server.profile["token_ms"] / 1000)
+                event = {"token": {"text": word + " ", "special": False}}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except OSError:
+            # The client stopped listening early, like the app does with long answers
+            pass
+
+
+# ----------------------------------
+# Server
+# ----------------------------------
+class MockHFServer(ThreadingHTTPServer):
+    """
+    The stand-in server; start() runs it on a daemon thread and returns its base URL.
+
+    Outcomes are drawn from a seeded random generator, so a run with the
+    same profile and seed sees the same mix of failures.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, profile="healthy", port=0, seed=1234):
+        super().__init__(("127.0.0.1", port), MockHFHandler)
+        self.profile = PROFILES[profile] if isinstance(profile, str) else profile
+        self.random = random.Random(seed)
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/models"
+
+    def draw(self, path, body):
+        """
+        Pick what happens to a call: (outcome, seconds to take if it succeeds).
+        """
+        profile = self.profile
+        median = profile["vision_ms"] if not body.startswith(b"{") else profile["chat_ms"]
+        with self._lock:
+            roll = self.random.random()
+            latency = self.random.lognormvariate(math.log(median / 1000), profile["sigma"])
+        for outcome in ("hang", "loading", "rate_limited"):
+            if roll < profile[outcome]:
+                return outcome, latency
+            roll -= profile[outcome]
+        return "ok", latency
+
+    def count(self, outcome):
+        with self._lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-hf", daemon=True).start()
+        return self.url
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--profile", default="healthy", choices=sorted(PROFILES))
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--seed", type=int, default=1234)
+    args = arg_parser.parse_args()
+
+    server = MockHFServer(args.profile, port=args.port, seed=args.seed)
+    print(f"Mock Hugging Face API ({args.profile}) at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()